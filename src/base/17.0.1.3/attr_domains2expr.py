@@ -9,7 +9,8 @@ The main entry point is `fix_attrs(cr, model, arch, comb_arch)` -- see docstring
 details about its parameters. One important consideration when converting views is that
 we must convert views in the right order to ensure the arch is built correctly. Thus we
 should convert root views first, then continue with children view, respecting also the
-sequence of the views.
+sequence of the views. `adapt_views(cr, view_ids)` takes care of that ordering for a
+batch of views, converting independent inheritance trees in parallel.
 
 The script can be imported directly or via `util.import_script`. The model of the view
 should be fully loaded before attempting to convert it -- thus an end- script is the
@@ -24,30 +25,43 @@ script = util.import_script("base/17.0.1.3/attr_domains2expr.py")
 
 def migrate(cr, version):
     # script.adapt_view(...)
+    # script.adapt_views(...)
     # script.fix_attrs(...)
     pass
 ```
 """
 
 import ast
+import collections
+import concurrent.futures
 import logging
+import multiprocessing
 import re
+import threading
+import time
+import traceback
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 from lxml import etree
 
+from odoo import sql_db
+from odoo.modules import module as odoo_module
 from odoo.tools.safe_eval import safe_eval
 
 from odoo.upgrade import util
 from odoo.upgrade.util.domains import DOMAIN_OPERATORS, normalize_domain
 
 
-def adapt_view(cr, view_xmlid):
+def adapt_view(cr, view_xmlid, cache=None):
     """
     Adapt one view.
 
     Example usage of the utilities in this file.
 
+    When adapting several views, pass the same `CombinedArchCache` instance as `cache` to
+    avoid recombining the arch of their common parents for each of them.
+
     We use `util.edit_view` because it handles the propagation of the changes to all
     languages while updating the whole arch. Alternatively you could just update specific
     elements.
@@ -65,7 +79,12 @@ def adapt_view(cr, view_xmlid):
     # disable view to avoid it being applied to the parent arch
     view.active = False
     # get combined arch of the parent view
-    comb_arch = view.inherit_id._get_combined_arch() if view.inherit_id else None
+    if not view.inherit_id:
+        comb_arch = None
+    elif cache is not None:
+        comb_arch = cache.get(view.inherit_id)
+    else:
+        comb_arch = view.inherit_id._get_combined_arch()
 
     # update current view arch
     new_arch = etree.fromstring(view.arch_db)
@@ -80,6 +99,255 @@ def adapt_view(cr, view_xmlid):
         arch.extend(new_arch)
 
 
+def adapt_views(cr, view_ids, max_workers=None):
+    """
+    Adapt many views at once, respecting their inheritance order.
+
+    The views are grouped by the root of their inheritance tree. Since the combined arch
+    of a view only depends on the views of its own tree, independent trees are converted
+    in parallel worker processes, each one with its own cursor. Inside a tree, the views
+    to convert are first all deactivated, then converted one by one in the order Odoo
+    applies them, parents first, and re-activated. The combined arches of their parents
+    are kept in a `CombinedArchCache`.
+
+    When the trees are converted in parallel, the cursor is committed before the
+    conversion. They are converted one after the other, without committing, when there is
+    only one tree, or while running tests. A view that fails to be converted is left
+    untouched, and one that could only be partially converted is
+    saved as is. In both cases the failure is logged and reported in the result.
+
+    :param list(int) view_ids: ids of the views to convert
+    :param int max_workers: maximum number of worker processes, defaults to
+                            :func:`~odoo.upgrade.util.pg.get_max_workers`
+    :return: the conversion time and error (`None` on success) of each view, by view id
+    :rtype: dict(int, tuple(float, str))
+    """
+    trees = _view_trees(cr, view_ids)
+    if not trees:
+        return {}
+
+    results = {}
+    if len(trees) == 1 or _testing():
+        for vids in trees:
+            results.update(_adapt_tree(cr, vids))
+    else:
+        # children cannot borrow from copies of the same pool, it will cause protocol error
+        def init_worker_process():
+            sql_db._Pool = None
+
+        cr.commit()
+        adapt_tree = util.make_pickleable_callback(_adapt_tree_worker)
+        with ProcessPoolExecutor(
+            max_workers=max_workers or util.get_max_workers(),
+            initializer=init_worker_process,
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            # biggest trees first, to avoid ending with a long one running alone
+            trees.sort(key=len, reverse=True)
+            futures = [executor.submit(adapt_tree, cr.dbname, vids) for vids in trees]
+            for future in util.log_progress(
+                concurrent.futures.as_completed(futures),
+                logger=_logger,
+                qualifier="view trees",
+                size=len(futures),
+                estimate=False,
+                log_hundred_percent=True,
+            ):
+                results.update(future.result())
+
+    failures = sorted(vid for vid, (_, error) in results.items() if error)
+    slowest = sorted(results.items(), key=lambda r: -r[1][0])[:10]
+    _logger.info(
+        "Converted %s views in %.2fs, %s failures. Slowest views: %s",
+        len(results),
+        sum(duration for duration, _ in results.values()),
+        len(failures),
+        ", ".join("%s (%.2fs)" % (vid, duration) for vid, (duration, _) in slowest),
+    )
+    if failures:
+        _logger.error("Failed to convert views %s", failures)
+    return results
+
+
+def _testing():
+    # cannot commit, nor use other cursors, during tests
+    return getattr(threading.current_thread(), "testing", False) or getattr(odoo_module, "current_test", False)
+
+
+def _view_trees(cr, view_ids):
+    """
+    Group views by inheritance tree.
+
+    Return a list of trees, one per root view. Each tree is the list of the ids of the
+    views to convert, in depth-first order: parents first, siblings sorted by priority.
+    """
+    cr.execute(
+        """
+        WITH RECURSIVE chain AS (
+            SELECT id, inherit_id
+              FROM ir_ui_view
+             WHERE id = ANY(%s)
+             UNION
+            SELECT v.id, v.inherit_id
+              FROM ir_ui_view v
+              JOIN chain c
+                ON c.inherit_id = v.id
+        )
+        SELECT v.id, v.inherit_id, v.priority
+          FROM chain c
+          JOIN ir_ui_view v
+            ON v.id = c.id
+        """,
+        [list(view_ids)],
+    )
+    views = {vid: (parent_id, priority) for vid, parent_id, priority in cr.fetchall()}
+
+    def path(vid):
+        # sorting the views by the path from their root gives the depth-first order
+        path = []
+        while vid:
+            parent_id, priority = views[vid]
+            path.append((priority, vid))
+            vid = parent_id
+        return path[::-1]
+
+    trees = collections.defaultdict(list)
+    for vid in set(view_ids) & set(views):
+        vpath = path(vid)
+        trees[vpath[0][1]].append((vpath, vid))
+    return [[vid for _, vid in sorted(tree)] for tree in trees.values()]
+
+
+def _adapt_tree(cr, vids):
+    """
+    Convert the views of one inheritance tree, see :func:`_view_trees`.
+
+    Return the conversion time and error of each view.
+    """
+    IrUiView = util.env(cr)["ir.ui.view"]
+    views = IrUiView.browse(vids)
+    active_views = views.filtered("active")
+    # disable the views to avoid them being applied to the parent arch before their conversion
+    views.active = False
+
+    cache = CombinedArchCache()
+    results = {}
+    for view in views:
+        start = time.time()
+        error = None
+        try:
+            with util.savepoint(cr):
+                comb_arch = cache.get(view.inherit_id) if view.inherit_id else None
+                new_arch = etree.fromstring(view.arch_db)
+                if not fix_attrs(cr, view.model, new_arch, comb_arch):
+                    error = "Partially converted, see the logs for details"
+                with util.edit_view(cr, view_id=view.id, active=None) as arch:
+                    arch.clear()
+                    arch.attrib.update(new_arch.attrib)
+                    arch.text = new_arch.text
+                    arch.extend(new_arch)
+        except Exception:
+            _logger.exception("Failed to convert view %s (%s)", view.id, view.xml_id or view.name)
+            error = traceback.format_exc()
+        # re-activate the view, even when it failed, as before the conversion
+        view.invalidate_recordset()
+        if view in active_views:
+            view.active = True
+        results[view.id] = (time.time() - start, error)
+        _logger.debug("View %s converted in %.2fs", view.id, results[view.id][0])
+
+    _logger.debug("Combined arches of tree %s: %s", vids[0], cache.stats)
+    return results
+
+
+def _adapt_tree_worker(dbname, vids):
+    with sql_db.db_connect(dbname).cursor() as cr:
+        return _adapt_tree(cr, vids)
+
+
+class CombinedArchCache:
+    """
+    Memoize combined arches of views.
+
+    The combined arch of a view depends on the view and on the set of active views of
+    its inheritance tree. Cached arches are keyed by the list of views they combine, in
+    the order Odoo applies them, along with a digest of their arch in the database. When
+    a view is (re-)activated and happens to be the last one to be applied, its arch is
+    applied on top of the cached one instead of recombining the whole tree. Converting
+    views in the order Odoo applies them, as `adapt_views` does, thus makes the cost of
+    the combinations linear in the number of views.
+
+    When the arch of a view is rewritten, e.g. by `util.edit_view`, the arches combining
+    it are dropped from the cache, and the view is invalidated from the ORM cache so its
+    new arch is used by the next combination.
+
+    The returned arches are owned by the cache: they must not be modified, nor be used
+    after the next call to `get`.
+    """
+
+    def __init__(self):
+        self._arches = {}
+        self._digests = {}
+        self.stats = {"hits": 0, "incremental": 0, "misses": 0}
+
+    def get(self, view):
+        """Return the combined arch of `view`, like `view._get_combined_arch()`."""
+        root = chain = view
+        while root.inherit_id:
+            root = root.inherit_id
+            chain |= root
+        order = self._combine_order(root, chain._get_inheriting_views())
+        key = tuple(zip(order, self._check_digests(view, order)))
+
+        arch = self._arches.get(key)
+        if arch is not None:
+            self.stats["hits"] += 1
+            return arch
+
+        prefix = max((k for k in self._arches if k == key[: len(k)]), key=len, default=None)
+        if prefix is None:
+            self.stats["misses"] += 1
+            arch = view._get_combined_arch()
+        else:
+            self.stats["incremental"] += 1
+            arch = self._arches.pop(prefix)
+            for inheriting_view in view.browse(order[len(prefix) :]):
+                arch = inheriting_view.apply_inheritance_specs(arch, etree.fromstring(inheriting_view.arch))
+        self._arches[key] = arch
+        return arch
+
+    def _check_digests(self, view, vids):
+        # the arches are rewritten in SQL, bypassing the ORM
+        view.env.cr.execute("SELECT id, md5(arch_db::text) FROM ir_ui_view WHERE id IN %s", [vids])
+        digests = dict(view.env.cr.fetchall())
+        changed = {vid for vid in vids if self._digests.get(vid, digests[vid]) != digests[vid]}
+        if changed:
+            self._arches = {
+                key: arch for key, arch in self._arches.items() if not any(vid in changed for vid, _ in key)
+            }
+            view.browse(sorted(changed)).invalidate_recordset()
+        self._digests.update(digests)
+        return [digests[vid] for vid in vids]
+
+    @staticmethod
+    def _combine_order(root, tree_views):
+        # same traversal as `ir.ui.view._combine`: extensions depth-first, primary views last
+        hierarchy = collections.defaultdict(list)
+        for view in tree_views:
+            hierarchy[view.inherit_id].append(view)
+        order = [root.id]
+        queue = collections.deque(sorted(hierarchy[root], key=lambda v: v.mode))
+        while queue:
+            view = queue.popleft()
+            order.append(view.id)
+            for child_view in reversed(hierarchy[view]):
+                if child_view.mode == "primary":
+                    queue.append(child_view)
+                else:
+                    queue.appendleft(child_view)
+        return tuple(order)
+
+
 _logger = logging.getLogger(__name__)
 
 MODS = ["invisible", "readonly", "required", "column_invisible"]
@@ -1 +1 @@
-from . import test_ensure_has_pk, test_moved0, test_util
+from . import test_attr_domains2expr, test_ensure_has_pk, test_moved0, test_util
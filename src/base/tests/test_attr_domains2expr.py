@@ -0,0 +1,132 @@
+import concurrent.futures
+import unittest
+from unittest import mock
+
+from lxml import etree
+
+from odoo.addons.base.maintenance.migrations import util
+from odoo.addons.base.maintenance.migrations.testing import UnitTestCase
+
+
+@unittest.skipUnless(util.version_gte("17.0"), "The `attrs` conversion only applies to Odoo 17")
+class TestAdaptViews(UnitTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.script = util.import_script("base/17.0.1.3/attr_domains2expr.py")
+
+    def _create_view(self, arch, inherit_id=None, priority=16):
+        # views with `attrs` cannot be created through the ORM anymore
+        self.env.cr.execute(
+            """
+            INSERT INTO ir_ui_view(name, model, type, arch_db, inherit_id, priority, mode, active)
+                 VALUES ('test_adapt_views', 'res.partner', 'form', jsonb_build_object('en_US', %s), %s, %s, %s, true)
+              RETURNING id
+            """,
+            [arch, inherit_id, priority, "extension" if inherit_id else "primary"],
+        )
+        return self.env.cr.fetchone()[0]
+
+    def _create_trees(self):
+        root_1 = self._create_view(
+            """<form><field name="name" attrs="{'invisible': [('is_company', '=', True)]}"/><field name="is_company"/></form>"""
+        )
+        child_1 = self._create_view(
+            """<data><field name="name" position="after"><field name="ref" attrs="{'readonly': [('name', '=', False)]}"/></field></data>""",
+            inherit_id=root_1,
+        )
+        grandchild_1 = self._create_view(
+            """<data><field name="ref" position="attributes"><attribute name="attrs">{'required': [('is_company', '=', True)]}</attribute></field></data>""",
+            inherit_id=child_1,
+        )
+        root_2 = self._create_view(
+            """<form><field name="name"/><field name="email" attrs="{'invisible': [('name', '=', False)]}"/></form>"""
+        )
+        return [root_1, child_1, grandchild_1, root_2]
+
+    def _adapt_views(self, view_ids, parallel):
+        cr = self.env.cr
+        script = self.script
+        cr.execute("SAVEPOINT test_adapt_views")
+        try:
+            if parallel:
+                # run the workers in a thread, on the test cursor
+                with mock.patch.object(script, "_testing", return_value=False), mock.patch.object(
+                    script, "ProcessPoolExecutor", lambda **kw: concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                ), mock.patch.object(
+                    script.util,
+                    "make_pickleable_callback",
+                    return_value=lambda dbname, vids: script._adapt_tree(cr, vids),
+                ), mock.patch.object(cr, "commit") as commit:
+                    results = script.adapt_views(cr, view_ids)
+                commit.assert_called_once_with()
+            else:
+                with mock.patch.object(cr, "commit") as commit:
+                    results = script.adapt_views(cr, view_ids)
+                commit.assert_not_called()
+            self.env.invalidate_all()
+            cr.execute("SELECT id, arch_db->>'en_US', active FROM ir_ui_view WHERE id IN %s", [tuple(view_ids)])
+            views = {vid: (etree.tostring(etree.fromstring(arch)), active) for vid, arch, active in cr.fetchall()}
+        finally:
+            cr.execute("ROLLBACK TO SAVEPOINT test_adapt_views")
+            self.env.invalidate_all()
+        return {vid: error for vid, (_, error) in results.items()}, views
+
+    def test_view_trees(self):
+        root_1, child_1, grandchild_1, root_2 = self._create_trees()
+        sibling_1 = self._create_view("<data/>", inherit_id=root_1, priority=1)
+        trees = self.script._view_trees(self.env.cr, [grandchild_1, root_2, child_1, root_1, sibling_1])
+        self.assertEqual(sorted(trees), sorted([[root_1, sibling_1, child_1, grandchild_1], [root_2]]))
+        self.assertEqual(self.script._view_trees(self.env.cr, [grandchild_1]), [[grandchild_1]])
+
+    def test_adapt_views(self):
+        view_ids = self._create_trees()
+        serial_errors, serial_views = self._adapt_views(view_ids, parallel=False)
+        parallel_errors, parallel_views = self._adapt_views(view_ids, parallel=True)
+
+        self.assertEqual(serial_errors, dict.fromkeys(view_ids))
+        self.assertEqual(parallel_errors, serial_errors)
+        self.assertEqual(parallel_views, serial_views)
+        root_1, _, _, root_2 = view_ids
+        self.assertIn(b'invisible="is_company"', serial_views[root_1][0])
+        self.assertNotIn(b"attrs", serial_views[root_2][0])
+        self.assertTrue(all(active for _, active in serial_views.values()))
+
+    def test_combined_arch_cache(self):
+        root_1, child_1, grandchild_1, _ = self._create_trees()
+        View = self.env["ir.ui.view"]
+        cache = self.script.CombinedArchCache()
+
+        def set_active(vid, active):
+            self.env.cr.execute("UPDATE ir_ui_view SET active = %s WHERE id = %s", [active, vid])
+            View.browse(vid).invalidate_recordset(["active"])
+
+        def check(vid):
+            self.assertEqual(
+                etree.tostring(cache.get(View.browse(vid))), etree.tostring(View.browse(vid)._get_combined_arch())
+            )
+
+        set_active(grandchild_1, active=False)
+        check(child_1)
+        set_active(grandchild_1, active=True)
+        # the arch of `grandchild_1` is applied on the cached one
+        check(child_1)
+        # the three views combine the same views
+        check(grandchild_1)
+        check(root_1)
+        self.assertEqual(cache.stats, {"hits": 2, "incremental": 1, "misses": 1})
+
+    def test_combined_arch_cache_rewritten_parent(self):
+        root_1, child_1, _, _ = self._create_trees()
+        View = self.env["ir.ui.view"]
+        cache = self.script.CombinedArchCache()
+        cache.get(View.browse(child_1))
+
+        with util.edit_view(self.env.cr, view_id=root_1) as arch:
+            etree.SubElement(arch, "field", name="email")
+        combined = etree.tostring(cache.get(View.browse(child_1)))
+
+        self.env.invalidate_all()
+        self.assertEqual(combined, etree.tostring(View.browse(child_1)._get_combined_arch()))
+        self.assertIn(b'name="email"', combined)
+        self.assertEqual(cache.stats["hits"], 0)
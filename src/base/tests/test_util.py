@@ -1,13 +1,18 @@
 import ast
+import concurrent.futures
+import json
 import operator
 import re
 import sys
+import tempfile
 import threading
 import unittest
 import uuid
 from ast import literal_eval
 from contextlib import contextmanager
 
+import psycopg2.extensions
+import psycopg2.extras
 from lxml import etree
 
 try:
@@ -701,6 +706,71 @@ class TestIterBrowse(UnitTestCase):
         expected = (len(ids) + chunk_size - 1) // chunk_size
         self.assertEqual(write.call_count, expected)
 
+    def test_iter_browse_iter_auto_chunks(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_country")
+        ids = [c for (c,) in cr.fetchall()]
+
+        res_chunks = list(
+            util.iter_browse(self.env["res.country"], ids, logger=None, chunk_size=util.AUTO, yield_chunks=True)
+        )
+        self.assertEqual([r.id for chunk in res_chunks for r in chunk], ids)
+
+    def test_iter_browse_auto_chunks_measure_end(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_country ORDER BY id LIMIT 10")
+        ids = [c for (c,) in cr.fetchall()]
+
+        calls = []
+        with mock.patch("odoo.upgrade.util.orm.flush", side_effect=lambda *a: calls.append("flush")), mock.patch.object(
+            util.AdaptiveChunkSize, "update", autospec=True, side_effect=lambda *a: calls.append("update")
+        ):
+            ib = util.iter_browse(self.env["res.country"], ids, logger=None, chunk_size=util.AUTO, yield_chunks=True)
+            ib._sizer.size = 4
+            self.assertEqual(len(list(ib)), 3)
+        # each chunk is flushed before its cost is measured
+        self.assertEqual(calls[:6], ["flush", "update"] * 3)
+
+    def test_iter_browse_prefetch(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_country")
+        ids = [c for (c,) in cr.fetchall()]
+        chunk_size = 10
+
+        Currency = type(self.env["res.currency"])
+        func = "fetch" if util.version_gte("saas~16.2") else "_read" if util.version_gte("saas~12.5") else "read"
+        with mock.patch.object(Currency, func, autospec=True, side_effect=getattr(Currency, func)) as read:
+            ib = util.iter_browse(
+                self.env["res.country"], ids, logger=None, chunk_size=chunk_size, prefetch=["currency_id.name"]
+            )
+            res_ids = []
+            for c in ib:
+                c.currency_id.name  # noqa: B018
+                res_ids.append(c.id)
+        self.assertEqual(res_ids, ids)
+        # at most one read of the currencies per chunk
+        self.assertLessEqual(read.call_count, (len(ids) + chunk_size - 1) // chunk_size)
+
+        with self.assertRaises(ValueError):
+            util.iter_browse(self.env["res.country"], cr, SUPERUSER_ID, ids, prefetch=["currency_id.name"])
+
+    def test_adaptive_chunk_size(self):
+        sizer = util.AdaptiveChunkSize(initial=100, target_time=1, target_memory=1)
+        sizer.update(100, 0.1, 0)
+        self.assertEqual(sizer.size, 200)  # at most doubled
+        sizer.update(200, 1, 0)
+        self.assertEqual(sizer.size, 200)
+        sizer.update(200, 10, 0)
+        self.assertEqual(sizer.size, 100)  # at most halved
+        sizer.update(100, 0.5, 2 * 1024 * 1024)
+        self.assertEqual(sizer.size, 50)  # memory bound
+
+        sizer = util.AdaptiveChunkSize(initial=2, target_time=1)
+        with mock.patch.object(sizer, "update", wraps=sizer.update) as update:
+            result = list(sizer.chunks(range(10), fmt=list))
+        self.assertEqual([x for chunk in result for x in chunk], list(range(10)))
+        self.assertEqual(update.call_count, len(result))
+
     def test_iter_browse_create_non_empty(self):
         RP = self.env["res.partner"]
         with self.assertRaises(ValueError):
@@ -716,6 +786,40 @@ class TestIterBrowse(UnitTestCase):
         records = ib.create([{"name": name} for name in names], multi=multi)
         self.assertEqual([t.name for t in records], names)
 
+    def test_iter_browse_create_copy(self):
+        Category = self.env["res.partner.category"]
+        parent = Category.create({"name": "Parent"})
+
+        names = [f"Child {i}" for i in range(5)]
+        ib = util.iter_browse(Category, [], chunk_size=2)
+        records = ib.create([{"name": name, "parent_id": parent.id} for name in names], mode="copy")
+        self.assertEqual([c.name for c in records], names)
+
+        children = Category.search([("parent_id", "=", parent.id)], order="id")
+        self.assertEqual(children.mapped("name"), names)
+        self.assertEqual(children.mapped("complete_name"), [f"Parent / {name}" for name in names])
+        self.assertTrue(all(child.parent_path.startswith(parent.parent_path) for child in children))
+        self.assertTrue(all(children.mapped("active")))
+
+    def test_iter_browse_create_copy_defaults(self):
+        Category = self.env["res.partner.category"]
+        ib = util.iter_browse(Category, [], chunk_size=2)
+        with mock.patch.object(
+            type(Category), "default_get", autospec=True, side_effect=type(Category).default_get
+        ) as default_get:
+            ib.create([{"name": f"Test {i}"} for i in range(5)] + [{"name": "Test", "color": 3}], mode="copy")
+        # the defaults are computed for each record, only for the missing fields
+        self.assertEqual(default_get.call_count, 6)
+        self.assertNotIn("color", default_get.call_args[0][1])
+        self.assertEqual(Category.search([("name", "=", "Test")]).color, 3)
+
+    def test_iter_browse_create_copy_invalid(self):
+        ib = util.iter_browse(self.env["res.partner.category"], [])
+        with self.assertRaises(ValueError):
+            ib.create([{"name": "Test", "partner_ids": [(6, 0, [])]}], mode="copy")
+        with self.assertRaises(ValueError):
+            ib.create([{"name": "Test"}], mode="copy", multi=True)
+
     def test_iter_browse_iter_twice(self):
         cr = self.env.cr
         cr.execute("SELECT id FROM res_country")
@@ -830,6 +934,107 @@ class TestPG(UnitTestCase):
         self.assertEqual(util.column_type(cr, "res_partner_bank", "y"), "varchar")
         self.assertEqual(util.column_type(cr, "res_partner_bank", "y", sized=True), "varchar(12)")
 
+    def test_alter_columns_type(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_test_alter_columns(
+                id serial PRIMARY KEY,
+                x int4 NOT NULL DEFAULT 0,
+                y varchar(4),
+                z int4,
+                UNIQUE (x, z)
+            );
+            CREATE INDEX _upgrade_test_alter_columns_y_idx ON _upgrade_test_alter_columns(lower(y));
+            CREATE TABLE _upgrade_test_alter_columns_rel(
+                id serial PRIMARY KEY,
+                alter_id int4 REFERENCES _upgrade_test_alter_columns(id) ON DELETE CASCADE
+            );
+            INSERT INTO _upgrade_test_alter_columns(x, y, z) SELECT i, 'y' || i, i FROM generate_series(1, 10) i;
+            INSERT INTO _upgrade_test_alter_columns_rel(alter_id) SELECT id FROM _upgrade_test_alter_columns;
+            """
+        )
+
+        util.alter_columns_type(
+            cr,
+            "_upgrade_test_alter_columns",
+            {"id": "int8", "x": ("int8", "{0} * 2"), "y": "varchar", "z": "int4"},
+        )
+
+        self.assertEqual(util.column_type(cr, "_upgrade_test_alter_columns", "id"), "int8")
+        self.assertEqual(util.column_type(cr, "_upgrade_test_alter_columns", "x"), "int8")
+        self.assertEqual(util.column_type(cr, "_upgrade_test_alter_columns", "y", sized=True), "varchar")
+        self.assertTrue(util.column_nullable(cr, "_upgrade_test_alter_columns", "y"))
+        self.assertFalse(util.column_nullable(cr, "_upgrade_test_alter_columns", "x"))
+
+        cr.execute("SELECT sum(x), count(*) FROM _upgrade_test_alter_columns")
+        self.assertEqual(cr.fetchone(), (110, 10))
+
+        # defaults and sequence are kept
+        cr.execute("INSERT INTO _upgrade_test_alter_columns(y) VALUES ('new') RETURNING id, x")
+        self.assertEqual(cr.fetchone(), (11, 0))
+
+        cr.execute(
+            """
+            SELECT conrelid::regclass::text, contype
+              FROM pg_constraint
+             WHERE conrelid IN ('_upgrade_test_alter_columns'::regclass, '_upgrade_test_alter_columns_rel'::regclass)
+          ORDER BY 1, 2
+            """
+        )
+        self.assertEqual(
+            cr.fetchall(),
+            [
+                ("_upgrade_test_alter_columns", "p"),
+                ("_upgrade_test_alter_columns", "u"),
+                ("_upgrade_test_alter_columns_rel", "f"),
+                ("_upgrade_test_alter_columns_rel", "p"),
+            ],
+        )
+        self.assertTrue(util.get_index_on(cr, "_upgrade_test_alter_columns", "id").ispk)
+        cr.execute("SELECT 1 FROM pg_indexes WHERE indexname = '_upgrade_test_alter_columns_y_idx'")
+        self.assertEqual(cr.rowcount, 1)
+
+    def test_without_indexes(self):
+        cr = self.env.cr
+        cr.execute(
+            """
+            CREATE TABLE _upgrade_test_without_indexes(id serial PRIMARY KEY, x int4 UNIQUE, y varchar);
+            CREATE INDEX _upgrade_test_without_indexes_x_idx ON _upgrade_test_without_indexes(x);
+            CREATE INDEX _upgrade_test_without_indexes_y_idx ON _upgrade_test_without_indexes(y) WHERE y LIKE '%a';
+            """
+        )
+
+        def indexes():
+            cr.execute("SELECT indexname FROM pg_indexes WHERE tablename = '_upgrade_test_without_indexes' ORDER BY 1")
+            return [name for (name,) in cr.fetchall()]
+
+        all_indexes = [
+            "_upgrade_test_without_indexes_pkey",
+            "_upgrade_test_without_indexes_x_idx",
+            "_upgrade_test_without_indexes_x_key",
+            "_upgrade_test_without_indexes_y_idx",
+        ]
+        self.assertEqual(indexes(), all_indexes)
+
+        cr.execute("SHOW maintenance_work_mem")
+        [work_mem] = cr.fetchone()
+        with util.without_indexes(cr, ["_upgrade_test_without_indexes"]):
+            self.assertEqual(indexes(), ["_upgrade_test_without_indexes_pkey", "_upgrade_test_without_indexes_x_key"])
+            cr.execute("INSERT INTO _upgrade_test_without_indexes(x, y) SELECT i, 'a' FROM generate_series(1, 10) i")
+        self.assertEqual(indexes(), all_indexes)
+        self.assertFalse(util.table_exists(cr, "_upgrade_dropped_indexes"))
+        # the builds ran on the test cursor, without changing its settings
+        cr.execute("SHOW maintenance_work_mem")
+        self.assertEqual(cr.fetchone()[0], work_mem)
+
+        # indexes are restored on error
+        with self.assertRaises(ZeroDivisionError), util.without_indexes(cr, "_upgrade_test_without_indexes"):
+            self.assertEqual(len(indexes()), 2)
+            _ = 1 / 0
+        self.assertEqual(indexes(), all_indexes)
+        self.assertFalse(util.table_exists(cr, "_upgrade_dropped_indexes"))
+
     @parametrize(
         [
             ("test", "<p>test</p>"),
@@ -892,6 +1097,14 @@ class TestPG(UnitTestCase):
             # assert that the new formatted output match the old one.
             self.assertEqual(formatted, std_formatted)
 
+    def test_copy_escape(self):
+        escape = util.pg._copy_escape
+        self.assertEqual(escape(psycopg2.Binary(b"\x00\xff")), "\\\\x00ff")
+        self.assertEqual(escape(psycopg2.extras.Json({"a": 1})), '{"a": 1}')
+        self.assertEqual(escape(psycopg2.extensions.QuotedString("it's\n")), "it's\\n")
+        with self.assertRaises(TypeError):
+            escape(psycopg2.extensions.AsIs("now()"))
+
     def _get_cr(self):
         cr = self.registry.cursor()
         self.addCleanup(cr.close)
@@ -1007,7 +1220,8 @@ class TestPG(UnitTestCase):
         cr.execute(util.format_query(cr, "SELECT 1 FROM {}", TEST_TABLE_NAME))
         self.assertFalse(cr.rowcount)
 
-    def test_update_one_col_from_dict(self):
+    @parametrize([("json",), ("copy",)])
+    def test_update_one_col_from_dict(self, method):
         TEST_TABLE_NAME = "_upgrade_bulk_update_one_col_test_table"
         N_ROWS = 10
 
@@ -1032,7 +1246,7 @@ class TestPG(UnitTestCase):
             [N_ROWS],
         )
         mapping = {id: id * 2 for id in range(1, N_ROWS + 1, 2)}
-        util.bulk_update_table(cr, TEST_TABLE_NAME, "col1", mapping)
+        util.bulk_update_table(cr, TEST_TABLE_NAME, "col1", mapping, method=method)
 
         cr.execute(
             util.format_query(
@@ -1061,7 +1275,8 @@ class TestPG(UnitTestCase):
         )
         self.assertFalse(cr.rowcount, "partial/incorrect updates are performed")
 
-    def test_update_multiple_cols_from_dict(self):
+    @parametrize([("json",), ("copy",)])
+    def test_update_multiple_cols_from_dict(self, method):
         TEST_TABLE_NAME = "_upgrade_bulk_update_multiple_cols_test_table"
         N_ROWS = 10
 
@@ -1087,7 +1302,7 @@ class TestPG(UnitTestCase):
             [N_ROWS],
         )
         mapping = {id: [id * 2, id * 3] for id in range(1, N_ROWS + 1, 2)}
-        util.bulk_update_table(cr, TEST_TABLE_NAME, ["col1", "col2"], mapping)
+        util.bulk_update_table(cr, TEST_TABLE_NAME, ["col1", "col2"], mapping, method=method)
 
         cr.execute(
             util.format_query(
@@ -1232,6 +1447,84 @@ class TestORM(UnitTestCase):
         cron = self.env["ir.cron"].browse(cron_id)
         self.assertEqual(cron.code, "answer = 42")
 
+    def test_recompute_plan(self):
+        Partner = self.env["res.partner"]
+        steps = {
+            ("res.partner", name): {"model": "res.partner", "fields": [name]}
+            for name in ["commercial_company_name", "name", "commercial_partner_id"]
+        }
+        step_of_field = {Partner._fields[name]: key for key, step in steps.items() for name in step["fields"]}
+
+        order = util.orm._recompute_plan(self.env, steps, step_of_field)
+
+        # `commercial_company_name` depends on `commercial_partner_id.name`
+        self.assertEqual([name for _, name in order], ["name", "commercial_partner_id", "commercial_company_name"])
+
+    def test_recompute_fields_parallel(self):
+        cr = self.env.cr
+        company = self.env["res.partner"].create({"name": "test_recompute_parallel", "is_company": True})
+        contacts = self.env["res.partner"].create(
+            [{"name": f"test_recompute_parallel_{i}", "parent_id": company.id} for i in range(4)]
+        )
+        partners = company | contacts
+        util.flush(partners)
+
+        def recompute(strategy):
+            cr.execute("UPDATE res_partner SET commercial_partner_id = NULL WHERE id IN %s", [tuple(partners.ids)])
+            util.invalidate(partners)
+            util.recompute_fields(
+                cr, "res.partner", ["commercial_partner_id"], ids=partners.ids, chunk_size=2, strategy=strategy
+            )
+            cr.execute("SELECT id, commercial_partner_id FROM res_partner WHERE id IN %s", [tuple(partners.ids)])
+            return dict(cr.fetchall())
+
+        # run the workers in a thread, on the test cursor
+        with without_testing(), mock.patch(
+            "odoo.upgrade.util.orm.ProcessPoolExecutor",
+            lambda **kw: concurrent.futures.ThreadPoolExecutor(max_workers=1),
+        ), mock.patch(
+            "odoo.upgrade.util.orm._recompute_fields_worker",
+            lambda dbname, model, fields, ids: util.orm._recompute_chunk(self.env[model].browse(ids), fields),
+        ), mock.patch("odoo.upgrade.util.orm.get_max_workers", return_value=1), mock.patch.object(
+            cr, "commit"
+        ) as commit:
+            parallel = recompute("parallel")
+        commit.assert_called_once_with()
+
+        self.assertEqual(parallel, dict.fromkeys(partners.ids, company.id))
+        self.assertEqual(recompute("flush"), parallel)
+
+    def test_recompute_fields_batch(self):
+        cr = self.env.cr
+        partners = self.env["res.partner"].create([{"name": f"test_recompute_batch_{i}"} for i in range(3)])
+        util.flush(partners)
+        a, b, c = partners.ids
+        cr.execute("UPDATE res_partner SET commercial_partner_id = NULL WHERE id IN %s", [tuple(partners.ids)])
+        util.invalidate(partners)
+
+        with mock.patch("odoo.upgrade.util.orm.recompute", wraps=util.orm.recompute) as recompute:
+            util.recompute_fields_batch(
+                cr,
+                [
+                    {"model": "res.partner", "fields": ["commercial_company_name"], "ids": [a]},
+                    {"model": "res.partner", "fields": ["commercial_partner_id"], "ids": [a, b]},
+                    {
+                        "model": "res.partner",
+                        "fields": ["commercial_partner_id"],
+                        "query": f"SELECT id FROM res_partner WHERE id IN ({b}, {c})",
+                    },
+                ],
+            )
+
+        # the requests on `commercial_partner_id` are merged, without duplicates, and recomputed first
+        self.assertEqual(recompute.call_count, 2)
+        self.assertEqual(recompute.call_args_list[0].args[0].ids, [a, b, c])
+        self.assertIn(a, recompute.call_args_list[1].args[0].ids)
+        cr.execute("SELECT id, commercial_partner_id FROM res_partner WHERE id IN %s", [tuple(partners.ids)])
+        self.assertEqual(dict(cr.fetchall()), {a: a, b: b, c: c})
+        cr.execute("SELECT count(*) FROM pg_class WHERE relname LIKE '\\_upgrade\\_recompute\\_ids\\_%'")
+        self.assertEqual(cr.fetchone()[0], 0)
+
 
 class TestField(UnitTestCase):
     def test_invert_boolean_field(self):
@@ -1517,6 +1810,88 @@ class TestQueryIds(UnitTestCase):
             result = list(util.chunks(ids, 100, fmt=list))
         self.assertEqual(result, [[1, 2]])
 
+    def test_chunks_id_arrays(self):
+        with util.query_ids(self.env.cr, "SELECT * FROM generate_series(1, 1000)") as ids, mock.patch.object(
+            util.IdArray, "from_int8send", wraps=util.IdArray.from_int8send
+        ) as from_int8send:
+            result = list(util.chunks(ids, 300, fmt=list))
+        self.assertEqual(result, [list(range(i, min(i + 300, 1001))) for i in range(1, 1001, 300)])
+        self.assertEqual(from_int8send.call_count, 1)
+
+    def test_id_array(self):
+        ids = util.IdArray(range(10))
+        self.assertEqual(list(util.chunks(ids, 4, fmt=list)), [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(util.IdArray.from_int8send(b"\x00" * 7 + b"\x2a").tolist(), [42])
+
+    def test_simple_pk_select(self):
+        cr = self.env.cr
+        cr.execute("SELECT id FROM res_users WHERE active ORDER BY id")
+        expected = [id_ for (id_,) in cr.fetchall()]
+
+        with util.query_ids(cr, "SELECT u.id FROM res_users u WHERE u.active", itersize=2, trusted=True) as ids:
+            self.assertIsNone(ids._tmp_tbl)
+            self.assertEqual(len(ids), len(expected))
+            self.assertEqual(list(ids), expected)
+
+        with util.query_ids(cr, "SELECT id FROM res_users WHERE active -- FOR UPDATE", itersize=2) as ids:
+            self.assertIsNone(ids._tmp_tbl)
+            self.assertEqual(list(ids), expected)
+
+        with util.query_ids(cr, "SELECT id FROM res_users WHERE active", trusted=False) as ids:
+            self.assertIsNotNone(ids._tmp_tbl)
+            self.assertEqual(list(ids), expected)
+
+        self.assertFalse(
+            util.query_ids._is_simple_pk_select(
+                cr, "SELECT id FROM res_users u JOIN res_partner p ON p.id = u.partner_id"
+            )
+        )
+
+    @parametrize([(None,), (False,), (True,)])
+    def test_rows_changed_while_iterating(self, trusted):
+        cr = self.env.cr
+        partners = self.env["res.partner"].create([{"name": f"test_query_ids_{i}", "ref": "qids"} for i in range(5)])
+        util.flush(partners)
+
+        seen = []
+        with util.query_ids(cr, "SELECT id FROM res_partner WHERE ref = 'qids'", itersize=2, trusted=trusted) as ids:
+            self.assertEqual(len(ids), 5)
+            for id_ in ids:
+                seen.append(id_)
+                # the processed rows do not match anymore, while new ones do
+                cr.execute("UPDATE res_partner SET ref = 'done' WHERE id = %s", [id_])
+                cr.execute("INSERT INTO res_partner(name, ref, active) VALUES ('test_query_ids_new', 'qids', true)")
+
+        self.assertEqual(seen, partners.ids)
+
+    def test_trusted(self):
+        cr = self.env.cr
+        with util.query_ids(cr, "SELECT * FROM (VALUES (3), (1), (2)) AS x(x)", trusted=True) as ids:
+            self.assertIsNone(ids._tmp_tbl)
+            self.assertGreater(len(ids), 0)
+            self.assertEqual(list(util.chunks(ids, 2, fmt=list)), [[1, 2], [3]])
+
+        with self.assertRaises(ValueError):
+            util.query_ids(cr, "UPDATE res_users SET active = active RETURNING id", trusted=True)
+
+    @parametrize(
+        [
+            ("SELECT id FROM res_users WHERE login = 'update'", False),
+            ("SELECT id FROM res_users WHERE active FOR UPDATE", False),
+            ("SELECT id FROM res_users /* rows to delete */", False),
+            ("WITH u AS (SELECT id FROM res_users) SELECT id FROM u", False),
+            ("VALUES (1), (2)", False),
+            ("UPDATE res_users SET active = active RETURNING id", True),
+            (
+                "WITH u AS (SELECT id FROM res_users) DELETE FROM res_groups_users_rel r USING u WHERE r.uid = u.id RETURNING u.id",
+                True,
+            ),
+            ("WITH u AS MATERIALIZED (DELETE FROM res_users RETURNING id) SELECT id FROM u", True),
+        ]
+    )
+    def test_is_dml(self, query, expected):
+        self.assertEqual(util.pg._is_dml(query), expected)
+
     def test_destructor(self):
         ids = util.query_ids(self.env.cr, "SELECT id from res_users")
         del ids
@@ -1601,6 +1976,27 @@ class TestRecords(UnitTestCase):
         for key, value in data_before.items():
             self.assertEqual(record[key], value)
 
+    def test_update_records_from_xml(self):
+        xmlids = ["base.res_partner_industry_A", "base.res_partner_industry_B", "base.menu_security"]
+        records = [self.env.ref(xmlid) for xmlid in xmlids]
+        names_before = [record.name for record in records]
+        for record in records:
+            record.write({"name": str(uuid.uuid4())})
+        util.flush(records[0])
+
+        with mock.patch.object(util.records, "_xml_data_index", wraps=util.records._xml_data_index) as index:
+            util.update_records_from_xml(self.env.cr, xmlids)
+        # all the records are defined in `base`, its data files are only parsed once
+        self.assertEqual(index.call_count, 1)
+
+        for record, name in zip(records, names_before):
+            util.invalidate(record)
+            self.assertEqual(record.name, name)
+
+    def test_update_records_from_xml_not_found(self):
+        with self.assertRaises(ValueError):
+            util.update_records_from_xml(self.env.cr, ["base.res_partner_industry_A", "base.no_such_xmlid"])
+
     def test_update_record_from_xml_recursive_menuitem(self):
         # reset all fields on a <menuitem>
         xmlid = "base.menu_security"
@@ -2007,6 +2403,206 @@ class TestRecords(UnitTestCase):
         self.assertTrue(cat_2.exists())
         self.assertFalse(cat_3.exists())
 
+    def test_delete_unused_report(self):
+        cat_1, cat_2, _ = self._prepare_test_delete_unused()
+
+        with mock.patch("odoo.upgrade.util.records.add_to_migration_reports") as report:
+            deleted = util.delete_unused(self.env.cr, f"base.{cat_1.name}", f"base.{cat_2.name}")
+
+        self.assertEqual(deleted, [f"base.{cat_2.name}"])
+        report.assert_called_once()
+        message = report.call_args[0][0]
+        self.assertIn(f"base.{cat_1.name}", message)
+        self.assertIn("res_partner._cat_id", message)
+        self.assertNotIn(f"base.{cat_2.name}", message)
+
+    def test_remove_records_reference_fields(self):
+        cr = self.env.cr
+        model_id = self.env["ir.model"]._get_id("res.partner")
+        for name in ["x_test_ref_a", "x_test_ref_b"]:
+            self.env["ir.model.fields"].create(
+                {
+                    "name": name,
+                    "field_description": name,
+                    "ttype": "reference",
+                    "model_id": model_id,
+                    "selection": "[('res.partner.category', 'Tag')]",
+                }
+            )
+        cat_1, cat_2, cat_3 = self.env["res.partner.category"].create([{"name": f"test_ref_{i}"} for i in range(3)])
+        p1, p2, p3 = self.env["res.partner"].create([{"name": f"test_ref_{i}"} for i in range(3)])
+        util.flush(p1)
+        for partner, column, cat in [
+            (p1, "x_test_ref_a", cat_1),
+            (p2, "x_test_ref_b", cat_2),
+            (p3, "x_test_ref_a", cat_3),
+        ]:
+            cr.execute(
+                util.format_query(cr, "UPDATE res_partner SET {} = %s WHERE id = %s", column),
+                [f"res.partner.category,{cat.id}", partner.id],
+            )
+
+        util.remove_records(cr, "res.partner.category", [cat_1.id, cat_2.id])
+
+        cr.execute("SELECT id FROM res_partner WHERE id IN %s", [(p1.id, p2.id, p3.id)])
+        self.assertEqual([id_ for (id_,) in cr.fetchall()], [p3.id])
+
+    @parametrize([(False,), (True,)])
+    @unittest.skipUnless(util.version_gte("18.0"), "Only work on Odoo >= 18")
+    def test_remove_records__company_dependent(self, gin_index):
+        cr = self.env.cr
+        self.env["ir.model.fields"].create(
+            {
+                "name": "x_test_cd_curr",
+                "ttype": "many2one",
+                "model_id": self.env["ir.model"]._get_id("res.partner"),
+                "relation": "res.currency",
+                "company_dependent": True,
+            }
+        )
+        if gin_index:
+            cr.execute("CREATE INDEX ON res_partner USING gin (jsonb_path_query_array(x_test_cd_curr, '$.*'))")
+        c1, c2, c3 = self.env["res.currency"].create([{"name": f"RM{i}", "symbol": f"RM{i}"} for i in range(3)])
+        p1, p2 = self.env["res.partner"].create([{"name": "Rory Williams"}, {"name": "Amy Pond"}])
+        util.flush(p1)
+        values = {
+            p1.id: f'{{"1": {c1.id}, "2": {c2.id}, "3": {c3.id}}}',
+            p2.id: f'{{"1": {c3.id}}}',
+        }
+        for id_, value in values.items():
+            cr.execute("UPDATE res_partner SET x_test_cd_curr = %s WHERE id = %s", [value, id_])
+
+        with self.assertNotUpdated("res_partner", ids=[p2.id]):
+            util.remove_records(cr, "res.currency", [c1.id, c2.id])
+
+        cr.execute("SELECT id, x_test_cd_curr FROM res_partner WHERE id IN %s ORDER BY id", [(p1.id, p2.id)])
+        self.assertEqual(
+            cr.fetchall(),
+            [(p1.id, {"1": None, "2": None, "3": c3.id}), (p2.id, {"1": c3.id})],
+        )
+
+    @parametrize([(False,), (True,)])
+    def test_update_parent_path(self, parallel):
+        cr = self.env.cr
+        Category = self.env["res.partner.category"]
+        root_1, root_2 = Category.create([{"name": "test_root_1"}, {"name": "test_root_2"}])
+        child_1 = Category.create({"name": "test_child_1", "parent_id": root_1.id})
+        child_2 = Category.create({"name": "test_child_2", "parent_id": child_1.id})
+        leaf = Category.create({"name": "test_leaf", "parent_id": root_2.id})
+        util.flush(leaf)
+        ids = (root_1 | root_2 | child_1 | child_2 | leaf).ids
+        cr.execute("UPDATE res_partner_category SET parent_path = NULL WHERE id IN %s", [tuple(ids)])
+        cr.execute("UPDATE res_partner_category SET parent_path = 'garbage' WHERE id = %s", [child_2.id])
+
+        with self.assertNotUpdated("res_partner_category", ids=Category.search([("id", "not in", ids)]).ids):
+            util.update_parent_path(cr, "res.partner.category", parallel=parallel)
+
+        cr.execute("SELECT id, parent_path FROM res_partner_category WHERE id IN %s", [tuple(ids)])
+        self.assertEqual(
+            dict(cr.fetchall()),
+            {
+                root_1.id: f"{root_1.id}/",
+                root_2.id: f"{root_2.id}/",
+                child_1.id: f"{root_1.id}/{child_1.id}/",
+                child_2.id: f"{root_1.id}/{child_1.id}/{child_2.id}/",
+                leaf.id: f"{root_2.id}/{leaf.id}/",
+            },
+        )
+        cr.execute("SELECT count(*) FROM pg_class WHERE relname LIKE '\\_upgrade\\_parent\\_path\\_%'")
+        self.assertEqual(cr.fetchone()[0], 0)
+
+    @parametrize([("cte",), ("stream",)])
+    def test_break_recursive_loops(self, method):
+        cr = self.env.cr
+        a, b, c, d = self.env["res.partner.category"].create([{"name": f"test_loop_{i}"} for i in range(4)])
+        util.flush(a)
+        links = [(a, b), (b, c), (c, a), (d, a)]
+        for child, parent in links:
+            cr.execute("UPDATE res_partner_category SET parent_id = %s WHERE id = %s", [parent.id, child.id])
+
+        with mock.patch("odoo.upgrade.util.inconsistencies.add_to_migration_reports") as report:
+            util.break_recursive_loops(cr, "res.partner.category", "parent_id", method=method)
+
+        report.assert_called_once()
+        cr.execute("SELECT id, parent_id FROM res_partner_category WHERE id IN %s", [tuple((a | b | c | d).ids)])
+        self.assertEqual(dict(cr.fetchall()), {a.id: None, b.id: c.id, c.id: a.id, d.id: a.id})
+
+    def test_break_recursive_loops_m2m(self):
+        cr = self.env.cr
+        g1, g2, g3, g4 = self.env["res.groups"].create([{"name": f"test_loop_{i}"} for i in range(4)])
+        util.flush(g1)
+        links = [(g1, g2), (g2, g3), (g3, g1), (g3, g4), (g2, g1)]
+        cr.execute(
+            "INSERT INTO res_groups_implied_rel(gid, hid) SELECT unnest(%s::int4[]), unnest(%s::int4[])",
+            [[s.id for s, _ in links], [t.id for _, t in links]],
+        )
+
+        with mock.patch("odoo.upgrade.util.inconsistencies.add_to_migration_reports") as report:
+            util.inconsistencies.break_recursive_loops_m2m(cr, "res.groups", "implied_ids")
+
+        report.assert_called_once()
+        cr.execute(
+            "SELECT gid, hid FROM res_groups_implied_rel WHERE gid IN %s ORDER BY gid, hid",
+            [tuple((g1 | g2 | g3 | g4).ids)],
+        )
+        remaining = cr.fetchall()
+        self.assertIn((g3.id, g4.id), remaining)
+        # no loop left
+        graph = {}
+        for source, target in remaining:
+            graph.setdefault(source, []).append(target)
+        self.assertEqual(util.inconsistencies._strongly_connected_components(graph), ([], []))
+
+    @parametrize([(False,), (True,)])
+    def test_fetch_inconsistencies(self, by_ids):
+        cr = self.env.cr
+        partners = self.env["res.partner"].create([{"name": f"test_fetch_{i}", "ref": "fetch"} for i in range(5)])
+        util.flush(partners)
+        query = "SELECT {columns} FROM res_partner t WHERE t.ref = 'fetch'"
+        ids = None
+        if by_ids:
+            ids = partners.ids
+            query += " AND t.id IN %s"
+        fetch = util.inconsistencies._fetch_inconsistencies
+
+        keys, rows = fetch(cr, query, "t.id, t.name", "t.id", lambda row: row[:1], ids, 2)
+        self.assertEqual(sorted(keys), [(id_,) for id_ in partners.ids])
+        # one more row than listed, to know some are left out
+        self.assertEqual(len(rows), 3)
+
+        keys, rows = fetch(cr, query, "t.id, t.name", "t.id", lambda row: row[:1], ids, None)
+        self.assertEqual(sorted(keys), [(id_,) for id_ in partners.ids])
+        self.assertEqual(len(rows), 5)
+
+    def test_verify_batch(self):
+        cr = self.env.cr
+        c1, c2 = self.env["res.company"].create([{"name": f"test_verify_{i}"} for i in range(2)])
+        parent = self.env["res.partner"].create({"name": "test_verify_parent", "company_id": c1.id})
+        children = self.env["res.partner"].create([{"name": f"test_verify_{i}"} for i in range(3)])
+        util.flush(parent)
+        cr.execute(
+            "UPDATE res_partner SET parent_id = %s, company_id = %s WHERE id IN %s",
+            [parent.id, c2.id, tuple(children.ids)],
+        )
+        other_check = mock.Mock(return_value="done")
+
+        with mock.patch("odoo.upgrade.util.inconsistencies.add_to_migration_reports") as report:
+            results = util.inconsistencies.verify_batch(
+                cr,
+                [
+                    (util.inconsistencies.verify_companies, ["res.partner", "parent_id"]),
+                    (other_check, ["arg"], {"limit": 5}),
+                ],
+                limit=2,
+            )
+
+        self.assertEqual(results, [None, "done"])
+        other_check.assert_called_once_with(cr, "arg", limit=5)
+        report.assert_called_once()
+        message = report.call_args.kwargs["message"]
+        self.assertIn("3 records affected; show top 2", message)
+        self.assertEqual(message.count("<li>"), 2)
+
 
 class TestEditView(UnitTestCase):
     @parametrize(
@@ -2359,6 +2955,69 @@ class TestMisc(UnitTestCase):
         else:
             self.assertEqual(res, expected)
 
+    def test_profiling(self):
+        cr = self.env.cr
+        profiling = util.profiling
+        cr.execute("SELECT count(*) FROM res_partner")
+        [count] = cr.fetchone()
+        with mock.patch.object(profiling, "PROFILE_PATH", "/dev/null"), mock.patch.dict(
+            profiling._stats, clear=True
+        ), mock.patch.object(type(cr), "execute", profiling._wrap_execute(type(cr).execute)):
+            util.explode_execute(cr, "UPDATE res_partner SET active = active", table="res_partner")
+            cr.execute("SELECT 1")
+            stats = {(s["script"], s["helper"]): s for s in profiling.stats()}
+
+        self.assertGreaterEqual(stats["-", "pg.explode_execute"]["rows"], count)
+        self.assertEqual(stats["-", "-"]["queries"], 1)
+        self.assertEqual(stats["-", "-"]["rows"], 1)
+        self.assertEqual(stats["-", "-"]["bytes"], len("SELECT 1"))
+
+    def test_script_ledger(self):
+        profiling = util.profiling
+        cr = self.env.cr
+
+        def migrate(cr, version):
+            cr.execute("SELECT 1 FROM generate_series(1, 3)")
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as ledger, mock.patch.object(
+            profiling, "SCRIPT_LEDGER", ledger.name
+        ), mock.patch.object(type(cr), "execute", profiling._wrap_execute(type(cr).execute)):
+            timed = profiling._timed_migrate(migrate, "/upgrade/sale/17.0.1.0/post-10-fix.py")
+            timed(cr, "16.0.1.0")
+            entry = json.loads(ledger.read())
+
+        self.assertEqual(
+            {k: entry[k] for k in ["module", "version", "stage", "script", "queries", "rows", "failed"]},
+            {
+                "module": "sale",
+                "version": "17.0.1.0",
+                "stage": "post",
+                "script": "post-10-fix",
+                "queries": 1,
+                "rows": 3,
+                "failed": False,
+            },
+        )
+        self.assertGreater(entry["peak_rss"], 0)
+
+    def test_log_progress_sink(self):
+        misc = util.misc
+        logger = mock.Mock(name="logger")
+        logger.name = "odoo.upgrade.test"
+        with tempfile.NamedTemporaryFile(suffix=".jsonl") as sink, mock.patch.multiple(
+            misc, PROGRESS_SINK=sink.name, PROGRESS_SINK_INTERVAL=0, _progress_sink=None
+        ):
+            self.assertEqual(list(util.log_progress(range(4), logger, qualifier="things")), [0, 1, 2, 3])
+            misc._progress_sink.close()
+            records = [json.loads(line) for line in sink.read().splitlines()]
+
+        self.assertEqual([r["done"] for r in records], [1, 2, 3, 4, 4])
+        self.assertEqual([r["final"] for r in records], [False] * 4 + [True])
+        self.assertEqual(
+            {(r["logger"], r["qualifier"], r["size"]) for r in records}, {("odoo.upgrade.test", "things", 4)}
+        )
+        self.assertEqual(records[-1]["eta"] or 0, 0)
+
 
 def not_doing_anything_converter(el):
     return True
@@ -2629,6 +3288,69 @@ class TestRenameXMLID(UnitTestCase):
         self.assertIn('t-call="base.rename_view"', test_view_2.arch_db)
         self.assertIn('t-name="base.rename_view"', test_view_1.arch_db)
 
+    def _create_qweb_view(self, name, body):
+        view = self.env["ir.ui.view"].create(
+            {
+                "name": name,
+                "type": "qweb",
+                "key": f"base.{name}",
+                "arch": f'<t t-name="base.{name}">{body}</t>',
+            }
+        )
+        self.env["ir.model.data"].create({"name": name, "module": "base", "model": "ir.ui.view", "res_id": view.id})
+        return view
+
+    def test_rename_xmlid_batch(self):
+        view_1 = self._create_qweb_view("test_view_1", "<div>Test View 1 Content</div>")
+        view_2 = self._create_qweb_view("test_view_2", "<div>Test View 2 Content</div>")
+        view_3 = self._create_qweb_view(
+            "test_view_3", '<t t-call="base.test_view_1"/><t t-call="base.test_view_2"/><t t-call="base.test_view_4"/>'
+        )
+
+        res = util.rename_xmlid_batch(
+            self.env.cr,
+            {"base.test_view_1": "base.rename_view_1", "base.test_view_2": "base.rename_view_2"},
+        )
+        self.assertEqual(res, {"base.rename_view_1": view_1.id, "base.rename_view_2": view_2.id})
+        self.assertIsNone(util.ref(self.env.cr, "base.test_view_1"))
+        self.assertEqual(util.ref(self.env.cr, "base.rename_view_2"), view_2.id)
+
+        util.invalidate(view_3)
+        self.assertEqual((view_1.key, view_2.key), ("base.rename_view_1", "base.rename_view_2"))
+        self.assertIn('t-name="base.rename_view_1"', view_1.arch_db)
+        self.assertIn('t-call="base.rename_view_1"', view_3.arch_db)
+        self.assertIn('t-call="base.rename_view_2"', view_3.arch_db)
+        self.assertIn('t-call="base.test_view_4"', view_3.arch_db)
+
+    def test_rename_xmlid_batch_collision(self):
+        cr = self.env.cr
+        self._create_qweb_view("test_view_1", "<div/>")
+        self._create_qweb_view("test_view_2", "<div/>")
+        self._create_qweb_view("test_view_3", "<div/>")
+
+        with self.assertRaises(MigrationError):
+            util.rename_xmlid_batch(cr, {"base.test_view_1": "base.test_view_3", "base.test_view_2": "base.new"})
+        with self.assertRaises(ValueError):
+            util.rename_xmlid_batch(cr, {"base.test_view_1": "base.test_view_2", "base.test_view_2": "base.new"})
+
+        # nothing has been renamed
+        self.assertIsNotNone(util.ref(cr, "base.test_view_2"))
+        self.assertIsNone(util.ref(cr, "base.new"))
+
+    def test_rename_xmlid_batch_error(self):
+        cr = self.env.cr
+        self._create_qweb_view("test_view_1", "<div/>")
+        self._create_qweb_view("test_view_2", "<div/>")
+
+        with mock.patch(
+            "odoo.upgrade.util.records.replace_record_references_batch", side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            util.rename_xmlid_batch(cr, {"base.test_view_1": "base.test_view_2"}, on_collision="merge")
+
+        # the work table is dropped
+        cr.execute("SELECT 1 FROM pg_class WHERE relname LIKE '\\_upgrade\\_rename\\_xmlid\\_%'")
+        self.assertFalse(cr.rowcount)
+
 
 class TestRefs(UnitTestCase):
     def test_refs_found(self):
@@ -2652,6 +3374,53 @@ class TestRefs(UnitTestCase):
         result = util.refs(self.env.cr, [])
         self.assertEqual(result, {})
 
+    def test_refs_module(self):
+        cr = self.env.cr
+        result = util.refs(cr, module="base")
+        self.assertEqual(result["base.partner_root"], util.ref(cr, "base.partner_root"))
+        self.assertEqual(result["base.main_company"], util.ref(cr, "base.main_company"))
+        self.assertNotIn("base.no_such_xmlid", result)
+
+        result = util.refs(cr, ["base.partner_root", "base.no_such_xmlid"], module="base")
+        self.assertEqual(result, {"base.partner_root": util.ref(cr, "base.partner_root"), "base.no_such_xmlid": None})
+
+    def test_refs_cache(self):
+        cr = self.env.cr
+        with mock.patch.object(util.records, "_xmlid_cache", util.records._XmlidCache(10)):
+            partner_id = util.ref(cr, "base.partner_root")
+            self.assertEqual(util.ref(cr, "base.partner_root"), partner_id)
+            self.assertIsNone(util.ref(cr, "base.no_such_xmlid"))
+            stats = util.xmlid_cache_stats()
+            self.assertEqual(stats["queries"], 2)
+            self.assertEqual(stats["saved_queries"], 1)
+
+            util.refs(cr, module="base")
+            self.assertEqual(util.xmlid_cache_stats()["size"], 10)
+
+            util.rename_xmlid(cr, "base.partner_root", "base.TX1")
+            self.assertIsNone(util.ref(cr, "base.partner_root"))
+            self.assertEqual(util.ref(cr, "base.TX1"), partner_id)
+
+            util.invalidate_xmlid_cache(cr, modules=["base"])
+            self.assertEqual(util.xmlid_cache_stats()["size"], 0)
+
+    def test_xmlid_cache_invalidate(self):
+        cr = self.env.cr
+        cache = util.records._XmlidCache(3)
+        cache.set(cr, "base.a", "res.partner", 1)
+        cache.set(cr, "base.b", "res.partner", 2)
+        cache.set(cr, "web.c", "res.users", 1)
+        cache.set(cr, "web.d", "res.partner", 1)
+        # the least recently used is evicted
+        self.assertIsNone(cache.get(cr, "base.a"))
+
+        cache.invalidate(cr, model="res.partner", ids=[1])
+        self.assertIsNone(cache.get(cr, "web.d"))
+        self.assertEqual(cache.get(cr, "web.c"), ("res.users", 1))
+        cache.invalidate(cr, modules=["web"], xmlids=["base.b"])
+        self.assertFalse(cache._data or cache._by_module or cache._by_record)
+        self.assertEqual(cache.stats["invalidations"], 3)
+
 
 class TestAssertUpdated(UnitTestCase):
     def test_assert_updated(self):
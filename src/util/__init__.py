@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from . import profiling
 from .const import *
 from .data import *
 from .domains import *
@@ -3,13 +3,24 @@ import logging
 import os
 from textwrap import dedent
 
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    ThreadPoolExecutor = None
+
 from psycopg2.extensions import quote_ident
 from psycopg2.extras import Json
 from psycopg2.sql import SQL
 
+try:
+    from odoo.sql_db import db_connect
+except ImportError:
+    from openerp.sql_db import db_connect
+
+from .const import BIG_TABLE_THRESHOLD
 from .helpers import _validate_model, table_of_model
-from .misc import Sentinel, chunks, str2bool
-from .pg import format_query, get_value_or_en_translation, target_of
+from .misc import Sentinel, chunks, log_progress, str2bool
+from .pg import _running_tests, format_query, get_max_workers, get_value_or_en_translation, named_cursor, target_of
 from .report import add_to_migration_reports, get_anchor_link_to_record, html_escape
 
 _logger = logging.getLogger(__name__)
@@ -23,8 +34,22 @@ FIX_PRODUCT_UOM = str2bool(os.environ.get("ODOO_MIG_FIX_ALL_UOM_INCONSISTENCIES"
 FROM_ENV = Sentinel("FROM_ENV")
 
 
-def break_recursive_loops(cr, model, field, name_field="name"):
-    # TODO add a variant to verify loops on m2m
+def break_recursive_loops(cr, model, field, name_field="name", method="auto"):
+    """
+    Break the loops of a hierarchy defined by a many2one field targeting its own model.
+
+    For each loop, the `field` of the record with the lowest id is unset. The affected
+    records are listed in the migration report.
+
+    :param str model: model of the hierarchy
+    :param str field: many2one field holding the parent of the records
+    :param str name_field: field used to name the records in the report
+    :param str method: how the loops are found. With `cte`, the parent chains are followed by
+                       a recursive query, which is quadratic in the depth of the hierarchy.
+                       With `stream`, the `(id, parent)` pairs that may be part of a loop are
+                       read once, and the loops are found in linear time. `auto` picks
+                       `stream` for big tables.
+    """
     _validate_model(model)
 
     table = table_of_model(cr, model)
@@ -32,6 +57,119 @@ def break_recursive_loops(cr, model, field, name_field="name"):
     if not trgt or trgt[:2] != (table, "id"):
         raise ValueError("The column `{}` is not FK on itself".format(field))
 
+    if method == "auto":
+        cr.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+        method = "stream" if cr.fetchone()[0] > BIG_TABLE_THRESHOLD else "cte"
+    if method == "cte":
+        loops = _recursive_loops_cte(cr, table, field)
+    elif method == "stream":
+        loops = _recursive_loops_stream(cr, table, field)
+    else:
+        raise ValueError("Invalid method {!r}".format(method))
+    if not loops:
+        return
+
+    ids = sorted({min(loop) for loop in loops})
+    update_query = format_query(
+        cr,
+        """
+        UPDATE {table}
+           SET {field} = NULL
+         WHERE id IN %s
+     RETURNING id, {name}
+        """,
+        table=table,
+        field=field,
+        name=SQL(get_value_or_en_translation(cr, table, name_field)),
+    )
+    cr.execute(update_query, [tuple(ids)])
+    n_updates = cr.rowcount
+    _logger.warning("%s records in %s got their %r column unset to break a recursive loop.", n_updates, table, field)
+    _report_recursive_loops(cr, model, field, cr.fetchmany(_N_UPDATES_IN_REPORT), n_updates, "field has been reset")
+
+
+def break_recursive_loops_m2m(cr, model, field, name_field="name"):
+    """
+    Break the loops of a graph defined by a many2many field targeting its own model.
+
+    The `(record, related record)` pairs that may be part of a loop are read once, and the
+    loops are found in linear time, as strongly connected components. The links closing a
+    loop, found by a depth-first search, are removed. The records losing a link are listed
+    in the migration report.
+
+    :param str model: model of the graph
+    :param str field: many2many field relating the records to others of the same model
+    :param str name_field: field used to name the records in the report
+    """
+    _validate_model(model)
+    cr.execute(
+        """
+        SELECT relation_table, column1, column2
+          FROM ir_model_fields
+         WHERE model = %s
+           AND name = %s
+           AND ttype = 'many2many'
+           AND relation = model
+        """,
+        [model, field],
+    )
+    if not cr.rowcount:
+        raise ValueError("The field `{}` is not a many2many on its own model".format(field))
+    rel_table, column1, column2 = cr.fetchone()
+
+    graph = {}
+    with named_cursor(cr, itersize=10000) as ncr:
+        # only the links between records having both parents and children can close a loop
+        ncr.execute(
+            format_query(
+                cr,
+                """
+                SELECT r.{column1}, r.{column2}
+                  FROM {rel} r
+                 WHERE EXISTS(SELECT 1 FROM {rel} p WHERE p.{column2} = r.{column1})
+                   AND EXISTS(SELECT 1 FROM {rel} c WHERE c.{column1} = r.{column2})
+                """,
+                rel=rel_table,
+                column1=column1,
+                column2=column2,
+            )
+        )
+        for source, target in ncr:
+            graph.setdefault(source, []).append(target)
+
+    loops, links = _strongly_connected_components(graph)
+    if not links:
+        return
+
+    cr.execute(
+        format_query(
+            cr,
+            "DELETE FROM {rel} WHERE ({column1}, {column2}) IN (SELECT unnest(%s::int4[]), unnest(%s::int4[]))",
+            rel=rel_table,
+            column1=column1,
+            column2=column2,
+        ),
+        [[source for source, _ in links], [target for _, target in links]],
+    )
+    _logger.warning(
+        "%s links of %r in %s were removed to break %s recursive loops.", cr.rowcount, field, rel_table, len(loops)
+    )
+
+    table = table_of_model(cr, model)
+    ids = sorted({source for source, _ in links})
+    cr.execute(
+        format_query(
+            cr,
+            "SELECT id, {name} FROM {table} WHERE id IN %s ORDER BY id",
+            table=table,
+            name=SQL(get_value_or_en_translation(cr, table, name_field)),
+        ),
+        [tuple(ids)],
+    )
+    _report_recursive_loops(cr, model, field, cr.fetchmany(_N_UPDATES_IN_REPORT), len(ids), "field has lost some links")
+
+
+def _recursive_loops_cte(cr, table, field):
     query = format_query(
         cr,
         """
@@ -56,35 +194,111 @@ def break_recursive_loops(cr, model, field, name_field="name"):
         field=field,
     )
     cr.execute(query)
-    if not cr.rowcount:
-        return
-
-    ids = []
-    done = set()
-    for (cycle,) in cr.fetchall():
-        to_break = min(cycle[: cycle.index(cycle[0], 1)])
-        if to_break not in done:
-            ids.append(to_break)
-        done.update(cycle)
+    return [cycle[: cycle.index(cycle[0], 1)] for (cycle,) in cr.fetchall()]
+
+
+def _recursive_loops_stream(cr, table, field):
+    parents = {}
+    with named_cursor(cr, itersize=10000) as ncr:
+        # only the records having both a parent and children can be part of a loop
+        ncr.execute(
+            format_query(
+                cr,
+                """
+                SELECT r.id, r.{field}
+                  FROM {table} r
+                 WHERE r.{field} IS NOT NULL
+                   AND EXISTS(SELECT 1 FROM {table} c WHERE c.{field} = r.id)
+                """,
+                table=table,
+                field=field,
+            )
+        )
+        parents.update(ncr)
+
+    # each record has at most one parent: following the parents from each record not
+    # visited yet either ends on a visited record, or loops on the current walk
+    loops = []
+    visited = set()
+    for start in parents:
+        if start in visited:
+            continue
+        walk = []
+        on_walk = set()
+        node = start
+        while node is not None and node not in visited:
+            visited.add(node)
+            walk.append(node)
+            on_walk.add(node)
+            node = parents.get(node)
+        if node in on_walk:
+            loops.append(walk[walk.index(node) :])
+    return loops
+
+
+def _strongly_connected_components(graph):
+    """
+    Find the loops of a directed graph, with Tarjan's algorithm.
 
-    update_query = format_query(
-        cr,
-        """
-        UPDATE {table}
-           SET {field} = NULL
-         WHERE id IN %s
-     RETURNING id, {name}
-        """,
-        table=table,
-        field=field,
-        name=SQL(get_value_or_en_translation(cr, table, name_field)),
-    )
-    cr.execute(update_query, [tuple(ids)])
-    n_updates = cr.rowcount
-    _logger.warning("%s records in %s got their %r column unset to break a recursive loop.", n_updates, table, field)
-    N_UPDATES_IN_REPORT = 20
-    bad_data = cr.fetchmany(N_UPDATES_IN_REPORT)
+    :param dict(int, list(int)) graph: targets of the edges, by source
+    :return: the strongly connected components forming a loop, and the edges to remove to
+             make the graph acyclic, i.e. the back edges of the depth-first search
+    :rtype: tuple(list(list(int)), list(tuple(int, int)))
 
+    :meta private: exclude from online docs
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    on_path = set()
+    components = []
+    back_edges = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        on_path.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    on_path.add(child)
+                    work.append((child, iter(graph.get(child, ()))))
+                    break
+                if child in on_path:
+                    back_edges.append((node, child))
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                on_path.discard(node)
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph.get(node, ()):
+                        components.append(component)
+    return components, back_edges
+
+
+_N_UPDATES_IN_REPORT = 20
+
+
+def _report_recursive_loops(cr, model, field, bad_data, n_updates, action):
     query = format_query(
         cr,
         """
@@ -105,17 +319,18 @@ def break_recursive_loops(cr, model, field, name_field="name"):
         """
             <details>
             <summary>
-                The following {model} were found to be recursive. Their "{field}" field has been reset.{disclaimer}
+                The following {model} were found to be recursive. Their "{field}" {action}.{disclaimer}
             </summary>
               <ul>{li}</ul>
             </details>
         """.format(
             model=html_escape(model_label),
             field=html_escape(field_label),
+            action=action,
             disclaimer=" Find below a list of the first {} (out of {}) affected records.".format(
-                N_UPDATES_IN_REPORT, n_updates
+                _N_UPDATES_IN_REPORT, n_updates
             )
-            if n_updates > N_UPDATES_IN_REPORT
+            if n_updates > _N_UPDATES_IN_REPORT
             else "",
             li="".join("<li>{}</li>".format(get_anchor_link_to_record(model, id_, name)) for id_, name in bad_data),
         ),
@@ -125,8 +340,20 @@ def break_recursive_loops(cr, model, field, name_field="name"):
 
 
 def verify_companies(
-    cr, model, field_name, logger=_logger, model_company_field="company_id", comodel_company_field="company_id"
+    cr,
+    model,
+    field_name,
+    logger=_logger,
+    model_company_field="company_id",
+    comodel_company_field="company_id",
+    limit=15,
 ):
+    """
+    Check that the records of `model` and the ones they refer to through `field_name` belong to the same company.
+
+    The inconsistencies are logged and added to the migration report, which lists at most
+    `limit` of them.
+    """
     _validate_model(model)
     cr.execute(
         """
@@ -149,8 +376,7 @@ def verify_companies(
     table = table_of_model(cr, model)
     comodel = field_values["relation"]
     cotable = table_of_model(cr, comodel)
-
-    limit = 15
+    limit = "ALL" if limit is None else int(limit)
 
     if field_values["ttype"] == "many2one":
         query = """
@@ -217,12 +443,16 @@ def verify_uoms(
     include_archived_products=FROM_ENV,
     auto_fix=FROM_ENV,
     ids=None,
+    limit=None,
 ):
     """
     Check if the category of uom  on `model` is the same as the category of uom on `product.template`.
 
     When `ids` is not provided, every ids would be verified.
 
+    When `limit` is set, at most `limit` inconsistencies are listed in the report. All of
+    them are still fixed and returned.
+
     Returns list of ids if inconsistencies found, else []
     """
     _validate_model(model)
@@ -236,8 +466,8 @@ def verify_uoms(
     if auto_fix is FROM_ENV:
         auto_fix = FIX_PRODUCT_UOM
 
-    query = """
-        SELECT t.id line_id,
+    columns = """
+               t.id line_id,
                t.{uom_column} line_uom_id,
                tu.{uom_name} line_uom_name,
                tuc.{category_name} line_uom_categ_name,
@@ -246,6 +476,14 @@ def verify_uoms(
                pt.id product_template_id,
                pt.{product_template_name} product_template_name,
                ptuc.{category_name} product_uom_categ_name
+    """.format(
+        uom_column=q(uom_field),
+        uom_name=get_value_or_en_translation(cr, "uom_uom", "name"),
+        category_name=get_value_or_en_translation(cr, "uom_category", "name"),
+        product_template_name=get_value_or_en_translation(cr, "product_template", "name"),
+    )
+    query = """
+        SELECT {{columns}}
           FROM {table} t
           JOIN uom_uom tu ON t.{uom_column} = tu.id
           JOIN uom_category tuc ON tu.category_id = tuc.id
@@ -260,30 +498,22 @@ def verify_uoms(
         table=q(table),
         uom_column=q(uom_field),
         product_column=q(product_field),
-        uom_name=get_value_or_en_translation(cr, "uom_uom", "name"),
-        category_name=get_value_or_en_translation(cr, "uom_category", "name"),
-        product_template_name=get_value_or_en_translation(cr, "product_template", "name"),
         ids=" AND t.id IN %s" if ids else "",
         active=" AND pp.active" if not include_archived_products else "",
     )
 
-    rows = []
-    if ids is None:
-        cr.execute(query)
-        rows = cr.fetchall()
-    elif ids:
-        ids_chunks = chunks(ids, size=cr.IN_MAX, fmt=tuple)
-        for chunk in ids_chunks:
-            cr.execute(query, [chunk])
-            rows.extend(cr.fetchall())
-
-    if not rows:
+    # (line id, product uom id) of all the faulty lines, needed to fix them
+    faulty, rows = _fetch_inconsistencies(
+        cr, query, columns, "t.id, pt.uom_id", lambda row: (row[0], row[4]), ids, limit
+    )
+    if not faulty:
         return []
 
     title = model.replace(".", " ").title()
+    listed_rows, more = _truncate(rows, limit, len(faulty))
 
     if auto_fix:
-        line_new_ids = {line_id: prod_uom_id for line_id, _, _, _, prod_uom_id, _, _, _, _ in rows}
+        line_new_ids = dict(faulty)
         cr.execute(
             """
             UPDATE {table} t
@@ -322,8 +552,9 @@ def verify_uoms(
                     prod_temp,
                     prod_temp_id,
                 )
-                for line_id, line_uom_id, line_uom, line_uom_categ, prod_uom_id, prod_uom, prod_temp_id, prod_temp, prod_uom_categ in rows
-            ),
+                for line_id, line_uom_id, line_uom, line_uom_categ, prod_uom_id, prod_uom, prod_temp_id, prod_temp, prod_uom_categ in listed_rows
+            )
+            + more,
         )
         faulty_ids = []
 
@@ -360,10 +591,11 @@ def verify_uoms(
                     prod_uom_id,
                     prod_uom_categ,
                 )
-                for line_id, line_uom_id, line_uom, line_uom_categ, prod_uom_id, prod_uom, prod_temp_id, prod_temp, prod_uom_categ in rows
-            ),
+                for line_id, line_uom_id, line_uom, line_uom_categ, prod_uom_id, prod_uom, prod_temp_id, prod_temp, prod_uom_categ in listed_rows
+            )
+            + more,
         )
-        faulty_ids = [r[0] for r in rows]
+        faulty_ids = [line_id for line_id, _ in faulty]
 
     _logger.warning("\n%s\n", msg)
     add_to_migration_reports(category=title + " UoM Inconsistencies", message=msg, format="md")
@@ -379,12 +611,16 @@ def verify_products(
     foreign_model_product_field="product_id",
     include_archived_products=FROM_ENV,
     ids=None,
+    limit=None,
 ):
     """
     Check if the product on the `foreign_model` is the same as the product on the `model`.
 
     When `ids` is not provided, every ids would be verified.
 
+    When `limit` is set, at most `limit` inconsistencies are listed in the report. All of
+    them are still returned.
+
     The `foreign_model` should be the one that have a reference to the `model` using this
     schema:
         >>> `foreign_model`.`foreign_reference_field` = `model`.id
@@ -409,13 +645,20 @@ def verify_products(
     if include_archived_products is FROM_ENV:
         include_archived_products = INCLUDE_ARCHIVED_PRODUCTS
 
-    query = """
-        SELECT f.id,
+    columns = """
+               f.id,
                f.{foreign_model_product_field},
                fpt.{name},
                t.id,
                t.{model_product_field},
                tpt.{name}
+    """.format(
+        name=get_value_or_en_translation(cr, "product_template", "name"),
+        model_product_field=q(model_product_field),
+        foreign_model_product_field=q(foreign_model_product_field),
+    )
+    query = """
+        SELECT {{columns}}
           FROM {table} t
           JOIN {foreign_table} f ON f.{foreign_model_reference_field} = t.id
           JOIN product_product tpp ON t.{model_product_field} = tpp.id
@@ -426,7 +669,6 @@ def verify_products(
                {ids}
                {active}
     """.format(
-        name=get_value_or_en_translation(cr, "product_template", "name"),
         table=q(table),
         foreign_table=q(foreign_table),
         foreign_model_reference_field=q(foreign_model_reference_field),
@@ -436,18 +678,10 @@ def verify_products(
         active=" AND tpp.active" if not include_archived_products else "",
     )
 
-    rows = []
-    if ids is None:
-        cr.execute(query)
-        rows = cr.fetchall()
-    elif ids:
-        ids_chunks = chunks(ids, size=cr.IN_MAX, fmt=tuple)
-        for chunk in ids_chunks:
-            cr.execute(query, [chunk])
-            rows.extend(cr.fetchall())
-
-    if not rows:
+    faulty, rows = _fetch_inconsistencies(cr, query, columns, "f.id", lambda row: row[:1], ids, limit)
+    if not faulty:
         return []
+    listed_rows, more = _truncate(rows, limit, len(faulty))
 
     title = model.replace(".", " ").title()
     foreign_title = foreign_model.replace(".", " ").title()
@@ -461,8 +695,9 @@ def verify_products(
         "     * {}(id={}) has Product `{}`(id={}), {}(id={}) has Product `{}`(id={})".format(
             foreign_title, fline_id, fline_product, fline_product_id, title, line_id, line_product, line_product_id
         )
-        for fline_id, fline_product_id, fline_product, line_id, line_product_id, line_product in rows
+        for fline_id, fline_product_id, fline_product, line_id, line_product_id, line_product in listed_rows
     )
+    msg += more
 
     add_to_migration_reports(
         category=title + " - " + foreign_title + " Products Inconsistencies",
@@ -470,4 +705,104 @@ def verify_products(
         format="md",
     )
     _logger.warning("\n%s\n", msg)
-    return [r[0] for r in rows]
+    return [fline_id for (fline_id,) in faulty]
+
+
+def verify_batch(cr, checks, limit=None, logger=_logger):
+    """
+    Run several consistency checks concurrently.
+
+    Each check runs in its own thread, on its own connection, and adds its findings to the
+    migration report as soon as it is done. During tests, or when threads are not
+    available, the checks are run one after the other on `cr`.
+
+    .. example::
+       .. code-block:: python
+
+          util.inconsistencies.verify_batch(
+              cr,
+              [
+                  (util.inconsistencies.verify_companies, ["sale.order", "partner_id"]),
+                  (util.inconsistencies.verify_uoms, ["sale.order.line"], {"uom_field": "product_uom"}),
+                  (util.inconsistencies.verify_products, ["stock.move", "sale.order.line", "sale_line_id"]),
+              ],
+              limit=100,
+          )
+
+    :param list checks: the checks to run, as `(function, args)` or `(function, args, kwargs)`
+                        tuples. The cursor is passed as the first argument of `function`.
+    :param int limit: maximum number of inconsistencies listed by each check, overriding
+                      their own default
+    :param `~logging.Logger` logger: logger used to report the progress
+    :return: the results of the checks, in the same order as `checks`
+    :rtype: list
+
+    .. warning::
+       As a side effect, the cursor will be committed, unless the checks are run serially.
+    """
+    calls = []
+    for check in checks:
+        func, args, kwargs = (tuple(check) + ({},))[:3]
+        kwargs = dict(kwargs)
+        if limit is not None:
+            kwargs.setdefault("limit", limit)
+        calls.append((func, args, kwargs))
+
+    if len(calls) <= 1 or ThreadPoolExecutor is None or _running_tests():
+        return [func(cr, *args, **kwargs) for func, args, kwargs in calls]
+
+    cursor = db_connect(cr.dbname).cursor
+
+    def run(func, args, kwargs):
+        with cursor() as wcr:
+            return func(wcr, *args, **kwargs)
+
+    cr.commit()
+    results = [None] * len(calls)
+    with ThreadPoolExecutor(max_workers=min(get_max_workers(), len(calls))) as executor:
+        futures = {executor.submit(run, *call): i for i, call in enumerate(calls)}
+        for future in log_progress(as_completed(futures), logger, qualifier="checks", size=len(calls), estimate=False):
+            results[futures[future]] = future.result()
+    return results
+
+
+def _fetch_inconsistencies(cr, query, columns, key_columns, key, ids, limit):
+    """
+    Fetch the inconsistencies found by `query`, which selects a `{columns}` placeholder.
+
+    Return the `key_columns` of all the inconsistencies, and their full `columns` for the
+    report. When `limit` is set, all the inconsistencies are only fetched with their
+    `key_columns`, and at most `limit + 1` of them with their full `columns`, to know
+    whether some are left out of the report. `key` extracts the `key_columns` from a row
+    of full `columns`.
+
+    :meta private: exclude from online docs
+    """
+
+    def fetch(select, limit=None):
+        select_query = query.replace("{columns}", select)
+        if limit is not None:
+            select_query += " LIMIT {}".format(int(limit))
+        if ids is None:
+            cr.execute(select_query)
+            return cr.fetchall()
+        rows = []
+        for chunk in chunks(ids, size=cr.IN_MAX, fmt=tuple):
+            cr.execute(select_query, [chunk])
+            rows.extend(cr.fetchall())
+            if limit is not None and len(rows) >= limit:
+                break
+        return rows
+
+    if limit is None:
+        rows = fetch(columns)
+        return [key(row) for row in rows], rows
+
+    keys = fetch(key_columns)
+    return keys, fetch(columns, limit + 1) if keys else []
+
+
+def _truncate(rows, limit, total):
+    if limit is None or len(rows) <= limit:
+        return rows, ""
+    return rows[:limit], "\n\n    Only the first {} of the {} inconsistencies are listed.".format(limit, total)
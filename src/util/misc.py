@@ -1,5 +1,6 @@
 """Miscellaneous standalone functions."""
 
+import array
 import ast
 import collections
 import datetime
@@ -7,10 +8,13 @@ import functools
 import hashlib
 import inspect
 import logging
+import math
 import os
 import re
 import sys
 import textwrap
+import threading
+import time
 import uuid
 from contextlib import contextmanager
 from itertools import chain, islice
@@ -32,6 +36,7 @@ if release.major_version == "7.0":
         return _parse_version(version.replace("saas~", ""))
 
 
+from . import json
 from .exceptions import MigrationError, SleepyDeveloperError
 
 # python3 shim
@@ -40,6 +45,11 @@ try:
 except NameError:
     unicode = str
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
 try:
     from ast import unparse as ast_unparse
 except ImportError:
@@ -356,6 +366,12 @@ def chunks(iterable, size, fmt=None):
         }.get(type(iterable), iter)
         # fmt:on
 
+    if isinstance(iterable, array.array) or hasattr(iterable, "_iter_id_arrays"):
+        # typed ids, sliced without boxing each id
+        for chunk in _id_array_chunks(iterable, size):
+            yield chunk.tolist() if fmt is list else fmt(chunk)
+        return
+
     it = iter(iterable)
     try:
         while True:
@@ -364,26 +380,335 @@ def chunks(iterable, size, fmt=None):
         return
 
 
+try:
+    array.array("q")
+except ValueError:
+    # python2, `long` are 64 bits on 64 bits platforms
+    _ID_TYPECODE = "l"
+else:
+    _ID_TYPECODE = "q"
+
+
+class IdArray(array.array):
+    """
+    Compact array of ids.
+
+    The ids are stored as 64 bits integers instead of Python objects. For a hundred
+    million ids, it uses 800MB instead of several GB. It supports the operations of
+    `array.array`, including slicing. It can be used wherever a list of ids is expected.
+    :func:`chunks` splits it without converting each id to a Python integer.
+
+    .. example::
+       .. code-block:: python
+
+          ids = util.IdArray(range(10))
+          for sub_ids in util.chunks(ids, 4, fmt=list):
+              ...
+
+    :param iterable ids: initial ids
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, ids=()):
+        return super(IdArray, cls).__new__(cls, _ID_TYPECODE, ids)
+
+    def __reduce__(self):
+        return (IdArray, (self.tolist(),))
+
+    @classmethod
+    def from_int8send(cls, data):
+        """
+        Create an array from the concatenation of `int8send` values, as sent by PostgreSQL.
+
+        :param bytes data: big-endian 64 bits integers
+        :rtype: :class:`IdArray`
+        """
+        ids = cls()
+        (getattr(ids, "frombytes", None) or ids.fromstring)(bytes(data))
+        if sys.byteorder == "little":
+            ids.byteswap()
+        return ids
+
+
+def _id_array_chunks(iterable, size):
+    if not hasattr(iterable, "_iter_id_arrays"):
+        for i in range(0, len(iterable), size):
+            yield iterable[i : i + size]
+        return
+
+    # objects like `query_ids` provide the ids by batches of arrays
+    buf = IdArray()
+    for ids in iterable._iter_id_arrays(max(size, 2**16)):
+        buf.extend(ids)
+        # walk the batch, only the remainder is kept for the next one
+        end = len(buf) - len(buf) % size
+        for i in range(0, end, size):
+            yield buf[i : i + size]
+        buf = buf[end:]
+    if buf:
+        yield buf
+
+
+CHUNK_TARGET_TIME = float(os.getenv("UPG_CHUNK_TARGET_TIME", "5"))  # seconds
+CHUNK_TARGET_MEMORY = int(os.getenv("UPG_CHUNK_TARGET_MEMORY", "256"))  # MiB
+
+
+def _get_rss():
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        if resource is None:
+            return 0
+        # peak RSS, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AdaptiveChunkSize(object):
+    """
+    Chunk size adapting itself to the cost of processing each chunk.
+
+    The time and the RSS growth of the processing of each chunk are measured. The size of
+    the next chunk is then adjusted to reach the target time and stay under the target
+    memory growth. The size is at most doubled or halved between two chunks.
+
+    The targets default to the `UPG_CHUNK_TARGET_TIME` (in seconds, `5` by default) and
+    `UPG_CHUNK_TARGET_MEMORY` (in MiB, `256` by default) environment variables.
+
+    .. example::
+       .. code-block:: python
+
+          sizer = util.AdaptiveChunkSize()
+          for ids in sizer.chunks(all_ids, fmt=list, logger=_logger, qualifier="invoices"):
+              process(ids)
+
+    :param int initial: size of the first chunk
+    :param int minimum: minimal size of the chunks
+    :param int maximum: maximal size of the chunks
+    :param float target_time: target processing time of each chunk, in seconds
+    :param int target_memory: maximal RSS growth while processing a chunk, in MiB
+    """
+
+    def __init__(self, initial=200, minimum=1, maximum=2**16, target_time=None, target_memory=None):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_time = target_time or CHUNK_TARGET_TIME
+        self.target_memory = (target_memory or CHUNK_TARGET_MEMORY) * 1024 * 1024
+        self.sizes = []
+
+    def update(self, count, duration, memory):
+        """
+        Adjust the size of the next chunk.
+
+        :param int count: number of elements in the processed chunk
+        :param float duration: time spent processing the chunk, in seconds
+        :param int memory: RSS growth while processing the chunk, in bytes
+        """
+        if not count:
+            return
+        wanted = float(self.maximum)
+        if duration > 0:
+            wanted = min(wanted, count * self.target_time / duration)
+        if memory > 0:
+            wanted = min(wanted, count * float(self.target_memory) / memory)
+        wanted = max(self.size / 2.0, min(self.size * 2.0, wanted))
+        self.size = max(self.minimum, min(self.maximum, int(wanted)))
+
+    def chunks(self, iterable, fmt=None, logger=None, qualifier="elements", size=None):
+        """
+        Split `iterable` into chunks of adaptive size.
+
+        Same as :func:`chunks`, except that the size of each chunk depends on the time and
+        memory spent by the caller on the previous ones.
+
+        :param iterable iterable: iterable object to split
+        :param function fmt: function to apply to each chunk, see :func:`chunks`
+        :param logger: when set, logger used to report the progress and the chosen sizes
+        :type logger: :class:`logging.Logger`
+        :param str qualifier: qualifier of the elements, used in the logs
+        :param int size: total number of elements, used to report the progress
+        """
+        if fmt is None:
+            # fmt:off
+            fmt = {
+                str: "".join,
+                unicode: u"".join,
+            }.get(type(iterable), iter)
+            # fmt:on
+
+        it = iter(iterable)
+        done = 0
+        progress = _Progress(logger or _logger, qualifier, size)
+        t0 = tlog = tstart = progress.start
+        m0 = _get_rss()
+        while True:
+            items = list(islice(it, self.size))
+            if not items:
+                break
+            self.sizes.append(len(items))
+            yield fmt(items)
+
+            t1, m1 = time.time(), _get_rss()
+            self.update(len(items), t1 - t0, m1 - m0)
+            t0, m0 = t1, m1
+            done += len(items)
+            progress.sink(done, t1)
+            if logger and size and t1 - tlog > 60:
+                tlog = t1
+                progress.update(done, t1)
+                logger.info(
+                    "[%6.02f%%] %d/%d %s processed in %s (%.1f %s/s, chunk size: %d)",
+                    done * 100.0 / size,
+                    done,
+                    size,
+                    qualifier,
+                    datetime.timedelta(seconds=int(t1 - tstart)),
+                    progress.rate,
+                    qualifier,
+                    self.size,
+                )
+
+        if done:
+            progress.sink(done, time.time(), final=True)
+
+        if logger and self.sizes:
+            sizes = sorted(self.sizes)
+            logger.info(
+                "%d %s processed in %d chunks of adaptive size: min %d, median %d, max %d, final %d",
+                done,
+                qualifier,
+                len(sizes),
+                sizes[0],
+                sizes[len(sizes) // 2],
+                sizes[-1],
+                self.size,
+            )
+
+
+PROGRESS_SINK = os.getenv("UPG_PROGRESS_SINK")  # file path, or number of an open file descriptor
+PROGRESS_SINK_INTERVAL = float(os.getenv("UPG_PROGRESS_SINK_INTERVAL", "5"))  # seconds
+_PROGRESS_SMOOTHING = 60.0  # seconds, time constant of the moving average of the rate
+
+_progress_sink = None
+_progress_sink_lock = threading.Lock()
+
+
+def _write_progress(record):
+    global _progress_sink  # noqa: PLW0603
+    line = json.dumps(record, sort_keys=True) + "\n"
+    with _progress_sink_lock:
+        if _progress_sink is None:
+            _progress_sink = (
+                os.fdopen(int(PROGRESS_SINK), "a") if PROGRESS_SINK.isdigit() else open(PROGRESS_SINK, "a")  # noqa: SIM115
+            )
+        _progress_sink.write(line)
+        _progress_sink.flush()
+
+
+class _Progress(object):
+    """
+    Rate and remaining time of a processing, smoothed by an exponential moving average.
+
+    Each update weights the rate of the elapsed period according to its duration, such
+    that the rate follows the changes of speed, while skewed elements are smoothed out.
+    When the `UPG_PROGRESS_SINK` environment variable is set, the progress is also written
+    as JSON lines to the file, or file descriptor, it names, every
+    `UPG_PROGRESS_SINK_INTERVAL` seconds (`5` by default).
+    """
+
+    def __init__(self, logger, qualifier, size=None):
+        self.logger = logger
+        self.qualifier = qualifier
+        self.size = size
+        self.start = self._last = self._sink_last = time.time()
+        self._done = 0
+        self.rate = None
+
+    def update(self, done, now):
+        if now <= self._last:
+            return
+        rate = (done - self._done) / (now - self._last)
+        if self.rate is None:
+            self.rate = rate
+        else:
+            weight = 1 - math.exp((self._last - now) / _PROGRESS_SMOOTHING)
+            self.rate += weight * (rate - self.rate)
+        self._last, self._done = now, done
+
+    def eta(self):
+        if not self.size or not self.rate:
+            return None
+        return max(self.size - self._done, 0) / self.rate
+
+    def sink(self, done, now, final=False):
+        if not PROGRESS_SINK or not (final or now - self._sink_last >= PROGRESS_SINK_INTERVAL):
+            return
+        self._sink_last = now
+        self.update(done, now)
+        eta = self.eta()
+        _write_progress(
+            {
+                "time": now,
+                "pid": os.getpid(),
+                "logger": self.logger.name,
+                "qualifier": self.qualifier,
+                "done": done,
+                "size": self.size,
+                "elapsed": round(now - self.start, 3),
+                "rate": round(self.rate, 3) if self.rate is not None else None,
+                "eta": round(eta, 3) if eta is not None else None,
+                "final": final,
+            }
+        )
+
+
 def log_progress(it, logger, qualifier="elements", size=None, estimate=True, log_hundred_percent=False):
+    """
+    Log the progress of the iteration over `it`, at most once a minute.
+
+    The logs give the number of elements processed per second, and, with `estimate`, the
+    estimated remaining and total times. The rate is a moving average, see
+    :class:`_Progress`, which also reports the progress to the `UPG_PROGRESS_SINK`.
+
+    :param iterable it: iterable to follow
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    :param str qualifier: qualifier of the elements, used in the logs
+    :param int size: number of elements, `len(it)` by default
+    :param bool estimate: whether to estimate the remaining time
+    :param bool log_hundred_percent: whether to log the end of the iteration, if it took
+                                     more than 10 seconds
+    """
     if size is None:
         size = len(it)
-    t0 = t1 = datetime.datetime.now()
+    progress = _Progress(logger, qualifier, size)
+    t0 = t1 = progress.start
+    i = 0
     for i, e in enumerate(it, 1):
         yield e
-        t2 = datetime.datetime.now()
-        secs_last, secs_start = (t2 - t1).total_seconds(), (t2 - t0).total_seconds()
+        t2 = time.time()
+        progress.sink(i, t2)
+        secs_last, secs_start = t2 - t1, t2 - t0
         if secs_last > 60 or (log_hundred_percent and i == size and secs_start > 10):
-            t1 = datetime.datetime.now()
-            tdiff = t2 - t0
-            j = float(i)
-            if estimate:
-                tail = " (total estimated time: %s)" % (datetime.timedelta(seconds=tdiff.total_seconds() * size / j),)
+            t1 = t2
+            progress.update(i, t2)
+            tdiff = datetime.timedelta(seconds=secs_start)
+            eta = progress.eta()
+            if estimate and eta is not None:
+                tail = " (%.1f %s/s, ETA: %s, total estimated time: %s)" % (
+                    progress.rate,
+                    qualifier,
+                    datetime.timedelta(seconds=int(eta)),
+                    datetime.timedelta(seconds=int(secs_start + eta)),
+                )
             else:
-                tail = ""
+                tail = " (%.1f %s/s)" % (progress.rate, qualifier)
 
             logger.info(
                 "[%6.02f%%] %*d/%d %s processed in %s%s",
-                (j / size * 100.0),
+                (100.0 * i / size),
                 len(str(size)),
                 i,
                 size,
@@ -391,34 +716,43 @@ def log_progress(it, logger, qualifier="elements", size=None, estimate=True, log
                 tdiff,
                 tail,
             )
+    if i:
+        progress.sink(i, time.time(), final=True)
 
 
 def log_chunks(it, logger, chunk_size, qualifier="items"):
+    progress = _Progress(logger, qualifier)
     tinit = tlog = datetime.datetime.now()
 
     def log(chunk_num, size=chunk_size):
         now = datetime.datetime.now()
+        progress.update(i, time.time())
         logger.info(
-            "Chunk #%d of %d %s processed in %s (total %s)",
+            "Chunk #%d of %d %s processed in %s (total %s, %.1f %s/s)",
             chunk_num,
             size,
             qualifier,
             now - tlog,
             now - tinit,
+            progress.rate or 0.0,
+            qualifier,
         )
         return now
 
     i = 0
     for i, e in enumerate(it, 1):
         yield e
+        progress.sink(i, time.time())
         tlog = tlog if i % chunk_size else log(i // chunk_size)
 
     if i == 0:
         # empty iterator
         logger.info("No %s to process", qualifier)
-    elif i % chunk_size != 0:
-        # log the last partial chunk
-        log(i // chunk_size + 1, i % chunk_size)
+    else:
+        if i % chunk_size != 0:
+            # log the last partial chunk
+            log(i // chunk_size + 1, i % chunk_size)
+        progress.sink(i, time.time(), final=True)
 
 
 def make_pickleable_callback(callback):
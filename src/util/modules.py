@@ -52,7 +52,15 @@ from .misc import on_CI, parse_version, str2bool, version_gte
 from .models import delete_model
 from .orm import env, flush
 from .pg import SQLStr, column_exists, format_query, table_exists, target_of
-from .records import ref, remove_group, remove_menus, remove_records, remove_view, replace_record_references_batch
+from .records import (
+    invalidate_xmlid_cache,
+    ref,
+    remove_group,
+    remove_menus,
+    remove_records,
+    remove_view,
+    replace_record_references_batch,
+)
 
 INSTALLED_MODULE_STATES = ("installed", "to install", "to upgrade")
 _logger = logging.getLogger(__name__)
@@ -274,6 +282,7 @@ def uninstall_module(cr, module):
                 remove_field(cr, model, name)
 
     cr.execute("DELETE FROM ir_model_data WHERE module=%s", (module,))
+    invalidate_xmlid_cache(cr, modules=[module])
     if table_exists(cr, "ir_translation"):
         cr.execute("DELETE FROM ir_translation WHERE module=%s", [module])
     cr.execute("UPDATE ir_module_module SET state='uninstalled' WHERE name=%s", (module,))
@@ -396,6 +405,7 @@ def rename_module(cr, old, new):
     cr.execute("UPDATE ir_module_module_dependency SET name=%s WHERE name=%s", (new, old))
     _update_view_key(cr, old, new)
     cr.execute("UPDATE ir_model_data SET module=%s WHERE module=%s", (new, old))
+    invalidate_xmlid_cache(cr, xmlids=["base.module_" + old, "base.module_" + new], modules=[old, new])
     if table_exists(cr, "ir_translation"):
         cr.execute("UPDATE ir_translation SET module=%s WHERE module=%s", [new, old])
 
@@ -468,6 +478,8 @@ def merge_module(cr, old, into, update_dependers=True):
         _logger.log(NEARLYWARN, "Unknown module %s. Skip merge into %s.", old, into)
         return
 
+    invalidate_xmlid_cache(cr, xmlids=["base.module_" + old], modules=[old, into])
+
     if into not in mod_ids:
         raise UnknownModuleError(into)
 
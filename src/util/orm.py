@@ -10,12 +10,25 @@ on this module work along the ORM of *all* supported versions.
 """
 
 import logging
+import multiprocessing
 import re
+import traceback
+import uuid
+from array import array
+from collections import OrderedDict  # used for python2 compatibility
 from contextlib import contextmanager
 from functools import wraps
-from itertools import chain
+from itertools import chain, islice
 from textwrap import dedent
 
+import psycopg2
+import psycopg2.extras
+
+try:
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+except ImportError:
+    ProcessPoolExecutor = None
+
 try:
     from unittest.mock import patch
 except ImportError:
@@ -28,8 +41,10 @@ try:
         from odoo import SUPERUSER_ID
     from odoo import fields as ofields
     from odoo import modules, release
+    from odoo.sql_db import db_connect
 except ImportError:
     from openerp import SUPERUSER_ID, modules, release
+    from openerp.sql_db import db_connect
 
     try:
         from openerp import fields as ofields
@@ -41,8 +56,19 @@ except ImportError:
 from .const import BIG_TABLE_THRESHOLD
 from .exceptions import MigrationError
 from .helpers import table_of_model
-from .misc import chunks, log_progress, version_between, version_gte
-from .pg import SQLStr, column_exists, format_query, get_columns, query_ids
+from .misc import AUTO, AdaptiveChunkSize, chunks, log_progress, version_between, version_gte
+from .pg import (
+    ColumnList,
+    SQLStr,
+    _drop_tables,
+    _running_tests,
+    column_exists,
+    copy_rows,
+    format_query,
+    get_columns,
+    get_max_workers,
+    query_ids,
+)
 
 # python3 shims
 try:
@@ -284,8 +310,14 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
     - *commit*: `commit` the cursor - also flush
     - *auto*: pick the best alternative between the two above given the number of records
       to compute and the presence of tracked fields.
+    - *parallel*: distribute the chunks among forked worker processes, each one with its
+      own cursor. Every chunk is committed independently.
 
     The *commit* strategy is less prone to cause a `MemoryError` for a huge volume of data.
+    The *parallel* strategy is meant for CPU-bound computations on big tables. The cursor
+    is committed before spawning the workers and the chunks that failed are reported
+    together, once all the others are done. It falls back to *commit* when process pools
+    are not available, and to *flush* while running tests.
 
     :param str model: name of the model to recompute
     :param list(str) fields: list of the name of the fields to recompute
@@ -294,13 +326,16 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
                                   below)
     :param logger: logger used to report the progress
     :type logger: :class:`logging.Logger`
-    :param int chunk_size: number of records per chunk - used to split the processing
+    :param int chunk_size: number of records per chunk - used to split the processing. When
+                           set to :data:`~odoo.upgrade.util.misc.AUTO`, the size of the
+                           chunks adapts to the time and memory needed to process them,
+                           see :class:`~odoo.upgrade.util.misc.AdaptiveChunkSize`
     :param str strategy: strategy used to process the re-computation
     :param str query: query to get the IDs of records to recompute, it is an error to set
                       both `ids` and `query`. Note that the processing will always happen
                       in ascending order. If that is unwanted, you must use `ids` instead.
     """
-    if strategy not in {"flush", "commit", "auto"}:
+    if strategy not in {"flush", "commit", "auto", "parallel"}:
         raise ValueError("Invalid strategy {!r}".format(strategy))
     if ids is not None and query is not None:
         raise ValueError("Cannot set both `ids` and `query`")
@@ -325,10 +360,28 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
         big_table = count > BIG_TABLE_THRESHOLD
         any_tracked_field = any(getattr(Model._fields[f], _TRACKING_ATTR, False) for f in fields)
         strategy = "commit" if big_table and any_tracked_field else "flush"
-
-    size = (count + chunk_size - 1) / chunk_size
-    qual = "{} {:d}-bucket".format(model, chunk_size) if chunk_size != 1 else model
-    for subids in log_progress(chunks(ids_, chunk_size, list), logger, qualifier=qual, size=size):
+    elif strategy == "parallel":
+        if _running_tests():
+            strategy = "flush"
+        elif ProcessPoolExecutor is None or not hasattr(multiprocessing, "get_context"):
+            _logger.warning("Process pools are not available, fallback to the `commit` strategy")
+            strategy = "commit"
+
+    if chunk_size is AUTO and strategy == "parallel":
+        # the cost of the chunks cannot be measured from the workers
+        chunk_size = 256
+
+    if chunk_size is AUTO:
+        id_chunks = AdaptiveChunkSize(initial=256).chunks(ids_, list, logger, qualifier=model, size=count)
+    else:
+        size = (count + chunk_size - 1) / chunk_size
+        qual = "{} {:d}-bucket".format(model, chunk_size) if chunk_size != 1 else model
+        if strategy == "parallel":
+            _recompute_fields_parallel(cr, Model, fields, chunks(ids_, chunk_size, list), logger, qual, size)
+            return
+        id_chunks = log_progress(chunks(ids_, chunk_size, list), logger, qualifier=qual, size=size)
+
+    for subids in id_chunks:
         records = Model.browse(subids)
         for field_name in fields:
             field = records._fields[field_name]
@@ -348,6 +401,302 @@ def recompute_fields(cr, model, fields, ids=None, logger=_logger, chunk_size=256
         invalidate(records)
 
 
+def _recompute_fields_parallel(cr, Model, fields, id_chunks, logger, qualifier, size):
+    def init_worker_process():
+        # children cannot borrow from copies of the same pool, it will cause protocol error
+        from odoo import sql_db
+
+        sql_db._Pool = None
+
+    flush(Model)
+    cr.commit()
+    failures = []
+    max_workers = get_max_workers()
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=init_worker_process, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        # only keep a bounded number of chunks in flight, the others are fetched when needed
+        id_chunks = iter(id_chunks)
+        futures = {}
+
+        def submit(count):
+            for subids in islice(id_chunks, count):
+                futures[executor.submit(_recompute_fields_worker, cr.dbname, Model._name, fields, subids)] = subids
+
+        def completed():
+            submit(max_workers * 2)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future, futures.pop(future)
+                submit(len(done))
+
+        for future, subids in log_progress(
+            completed(), logger, qualifier=qualifier, size=size, estimate=False, log_hundred_percent=True
+        ):
+            error = future.result()
+            if error:
+                logger.error(
+                    "Failed to compute fields %s of %r on ids %s to %s:\n%s",
+                    fields,
+                    Model._name,
+                    subids[0],
+                    subids[-1],
+                    error,
+                )
+                failures.append(subids)
+    invalidate(Model)
+
+    if failures:
+        raise MigrationError(
+            "Computation of fields {} of {!r} failed for {} chunk(s), on {} records: {}".format(
+                fields,
+                Model._name,
+                len(failures),
+                sum(len(subids) for subids in failures),
+                ", ".join("{}-{}".format(subids[0], subids[-1]) for subids in failures),
+            )
+        )
+
+
+def _recompute_fields_worker(dbname, model, fields, ids):
+    cr = db_connect(dbname).cursor()
+    try:
+        _recompute_chunk(env(cr)[model].browse(ids), fields)
+        cr.commit()
+    except Exception:
+        cr.rollback()
+        return traceback.format_exc()
+    finally:
+        cr.close()
+    return None
+
+
+def _recompute_chunk(records, fields):
+    for field_name in fields:
+        records.env.add_to_compute(records._fields[field_name], records)
+    recompute(records)
+    records.modified(fields)
+    flush(records)
+
+
+def recompute_fields_batch(cr, requests, logger=_logger, chunk_size=256, strategy="auto"):
+    """
+    Recompute fields of several models, following their dependencies.
+
+    Each request is a `dict` with the keys `model` and `fields`, and optionally `ids` or
+    `query` with the same meaning as for :func:`recompute_fields`. The requests on the
+    same fields are merged, and the fields are recomputed in the order of their
+    dependencies: a field is only recomputed after the ones it depends on.
+
+    When recomputing a field triggers the re-computation of a field planned for later, the
+    triggered records are added to the later step instead of being recomputed right away.
+    This way each planned field is recomputed at most once per record.
+
+    .. example::
+        .. code-block:: python
+
+            util.recompute_fields_batch(
+                cr,
+                [
+                    {"model": "account.move.line", "fields": ["balance"], "query": query},
+                    {"model": "account.move", "fields": ["amount_total"]},
+                ],
+            )
+
+    :param list(dict) requests: fields to recompute, see above
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    :param int chunk_size: number of records per chunk - used to split the processing, or
+                           :data:`~odoo.upgrade.util.misc.AUTO` to adapt it
+    :param str strategy: strategy used to process the re-computation, one of `flush`,
+                         `commit` or `auto`, see :func:`recompute_fields`
+    """
+    if strategy not in {"flush", "commit", "auto"}:
+        raise ValueError("Invalid strategy {!r}".format(strategy))
+    env_ = env(cr)
+
+    # step key: (model, compute method) - fields computed together are recomputed together
+    steps = OrderedDict()
+    step_of_field = {}
+    try:
+        for request in requests:
+            unknown_keys = set(request) - {"model", "fields", "ids", "query"}
+            if unknown_keys:
+                raise TypeError("recompute_fields_batch() got unexpected request keys: %r" % sorted(unknown_keys))
+            if request.get("ids") is not None and request.get("query") is not None:
+                raise ValueError("Cannot set both `ids` and `query`")
+            Model = env_[request["model"]]
+
+            request_steps = []
+            for field_name in request["fields"]:
+                field = Model._fields[field_name]
+                shared_compute = isinstance(field.compute, basestring) and not field.related
+                key = (Model._name, field.compute if shared_compute else field_name)
+                step = steps.get(key)
+                if step is None:
+                    step = steps[key] = {"model": Model._name, "fields": [], "table": _recompute_ids_table(cr)}
+                if field_name not in step["fields"]:
+                    step["fields"].append(field_name)
+                if step not in request_steps:
+                    request_steps.append(step)
+                step_of_field[field] = key
+
+            # the ids of the requests on the same step are merged, and deduplicated, in its table
+            for step in request_steps:
+                if request.get("ids") is not None:
+                    _add_recompute_ids(cr, step["table"], list(request["ids"]))
+                else:
+                    query = request.get("query") or format_query(
+                        cr, "SELECT id FROM {}", table_of_model(cr, Model._name)
+                    )
+                    cr.execute(
+                        format_query(
+                            cr,
+                            "INSERT INTO {} (id) SELECT id FROM ({}) q(id) WHERE id IS NOT NULL ON CONFLICT DO NOTHING",
+                            step["table"],
+                            SQLStr(query),
+                        )
+                    )
+
+        order = _recompute_plan(env_, steps, step_of_field)
+        _logger.info(
+            "Recomputation plan: %s",
+            ", ".join("{}{}".format(steps[key]["model"], steps[key]["fields"]) for key in order),
+        )
+
+        can_dedupe = hasattr(env_, "remove_to_compute") and hasattr(env_, "records_to_compute")
+        for index, key in enumerate(order):
+            step = steps[key]
+            Model = env_[step["model"]]
+            fields = step["fields"]
+            later_keys = set(order[index + 1 :])
+            later_fields = [(field, steps[k]) for field, k in step_of_field.items() if k in later_keys]
+
+            # the ids of this step are not changed while it runs, only the ones of later steps
+            ids = query_ids(cr, format_query(cr, "SELECT id FROM {}", step["table"]), itersize=2**20, trusted=True)
+            count = len(ids)
+            if not count:
+                continue
+            _logger.info("Computing fields %s of %r on %d records", fields, Model._name, count)
+            step_strategy = strategy
+            if step_strategy == "auto":
+                big_table = count > BIG_TABLE_THRESHOLD
+                any_tracked_field = any(getattr(Model._fields[f], _TRACKING_ATTR, False) for f in fields)
+                step_strategy = "commit" if big_table and any_tracked_field else "flush"
+
+            if chunk_size is AUTO:
+                sizer = AdaptiveChunkSize(initial=256)
+                id_chunks = sizer.chunks(ids, list, logger, qualifier=Model._name, size=count)
+            else:
+                size = (count + chunk_size - 1) / chunk_size
+                qual = "{} {:d}-bucket".format(Model._name, chunk_size) if chunk_size != 1 else Model._name
+                id_chunks = log_progress(chunks(ids, chunk_size, list), logger, qualifier=qual, size=size)
+            for subids in id_chunks:
+                records = Model.browse(subids)
+                for field_name in fields:
+                    field = records._fields[field_name]
+                    if hasattr(records, "_recompute_todo"):
+                        # < 13.0
+                        records._recompute_todo(field)
+                    else:
+                        Model.env.add_to_compute(field, records)
+
+                recompute(records)
+                records.modified(fields)
+                if can_dedupe:
+                    # postpone the fields planned later to their own step
+                    for later_field, later_step in later_fields:
+                        triggered = Model.env.records_to_compute(later_field)
+                        if triggered:
+                            _add_recompute_ids(cr, later_step["table"], triggered.ids)
+                            Model.env.remove_to_compute(later_field, triggered)
+                if step_strategy == "commit":
+                    cr.commit()
+                else:
+                    flush(records)
+                invalidate(records)
+    finally:
+        _drop_tables(cr, [step["table"] for step in steps.values()])
+
+
+def _recompute_ids_table(cr):
+    table = "_upgrade_recompute_ids_{}".format(uuid.uuid4().hex)
+    cr.execute(format_query(cr, "CREATE UNLOGGED TABLE {} (id int4 PRIMARY KEY)", table))
+    return table
+
+
+def _add_recompute_ids(cr, table, ids):
+    if ids:
+        cr.execute(
+            format_query(cr, "INSERT INTO {} (id) SELECT unnest(%s::int4[]) ON CONFLICT DO NOTHING", table),
+            [ids],
+        )
+
+
+def _recompute_plan(env_, steps, step_of_field):
+    """
+    Order the steps of a recomputation plan according to the dependencies of their fields.
+
+    The order of the steps is kept when there is no dependency between them. Steps part
+    of a dependency cycle are put last, in their original order.
+
+    :meta private: exclude from online docs
+    """
+    registry = env_.registry
+    field_depends = getattr(registry, "field_depends", None)
+
+    def dependencies(field):
+        if field_depends is not None:
+            # >= 15.0
+            return field_depends[field]
+        return field.depends
+
+    reachable = {}
+
+    def fields_reachable_from(field):
+        # all the fields, stored or not, the field transitively depends on
+        if field in reachable:
+            return reachable[field]
+        reachable[field] = result = set()
+        for path in dependencies(field):
+            Model = env_[field.model_name]
+            for name in path.split("."):
+                dep = Model._fields.get(name)
+                if dep is None:
+                    break
+                result.add(dep)
+                if dep.compute or dep.related:
+                    result |= fields_reachable_from(dep)
+                if not dep.relational:
+                    break
+                Model = env_[dep.comodel_name]
+        return result
+
+    predecessors = {key: set() for key in steps}
+    for field, key in step_of_field.items():
+        for dep in fields_reachable_from(field):
+            dep_key = step_of_field.get(dep)
+            if dep_key is not None and dep_key != key:
+                predecessors[key].add(dep_key)
+
+    order = []
+    remaining = list(steps)
+    while remaining:
+        ready = [key for key in remaining if not (predecessors[key] - set(order))]
+        if not ready:
+            _logger.warning(
+                "Circular dependencies between the fields %s, they will be recomputed in the given order",
+                ", ".join("{}{}".format(steps[key]["model"], steps[key]["fields"]) for key in remaining),
+            )
+            order.extend(remaining)
+            break
+        # Kahn's algorithm, keeping the original order between independent steps
+        order.append(ready[0])
+        remaining.remove(ready[0])
+    return order
+
+
 class iter_browse(object):
     """
     Iterate over recordsets.
@@ -383,20 +732,37 @@ class iter_browse(object):
     :type model: :class:`odoo.model.Model`
     :param list(int) ids: list of IDs of the records to iterate
     :param int chunk_size: number of records to load in each iteration chunk, `200` by
-                           default
+                           default. When set to :data:`~odoo.upgrade.util.misc.AUTO`, the
+                           size of the chunks adapts to the time and memory needed to
+                           process them, see :class:`~odoo.upgrade.util.misc.AdaptiveChunkSize`
     :param bool yield_chunks: when iterating, yield records in chunks of `chunk_size` instead of one by one.
                               Default is `False`
     :param logger: logger used to report the progress, by default
                    :data:`~odoo.upgrade.util.orm._logger`
     :type logger: :class:`logging.Logger`
     :param str strategy: whether to `flush` or `commit` on each chunk, default is `flush`
+    :param list(str) prefetch: fields, or paths of fields like `partner_id.country_id.code`,
+                               to read in bulk for each chunk before processing it. Only
+                               available with the new API.
     :return: the object returned by this class can be used to iterate, or call any model
              method, safely on millions of records.
 
     See also :func:`~odoo.upgrade.util.orm.env`
     """
 
-    __slots__ = ("_chunk_size", "_cr_uid", "_it", "_logger", "_model", "_patch", "_size", "_strategy", "_yield_chunks")
+    __slots__ = (
+        "_chunk_size",
+        "_cr_uid",
+        "_it",
+        "_logger",
+        "_model",
+        "_patch",
+        "_prefetch",
+        "_size",
+        "_sizer",
+        "_strategy",
+        "_yield_chunks",
+    )
 
     def __init__(self, model, *args, **kw):
         assert len(args) in [1, 3]  # either (cr, uid, ids) or (ids,)
@@ -409,21 +775,45 @@ class iter_browse(object):
         self._logger = kw.pop("logger", _logger)
         self._strategy = kw.pop("strategy", "flush")
         assert self._strategy in {"flush", "commit"}
+        self._prefetch = kw.pop("prefetch", None)
         if kw:
             raise TypeError("Unknown arguments: %s" % ", ".join(kw))
 
+        if self._prefetch and self._cr_uid:
+            raise ValueError("The `prefetch` argument is only available with the new API")
+
         self._patch = None
-        self._it = chunks(ids, self._chunk_size, fmt=self._browse)
+        self._sizer = None
+        if self._prefetch:
+            self._it = self._prefetch_chunks(self._chunks(ids, self._browse))
+        else:
+            self._it = self._ended_chunks(self._chunks(ids, self._browse))
+
+    def _chunks(self, iterable, fmt):
+        if self._chunk_size is not AUTO:
+            return chunks(iterable, self._chunk_size, fmt=fmt)
+        self._sizer = AdaptiveChunkSize()
+        return self._sizer.chunks(iterable, fmt, self._logger, qualifier=self._model._name, size=len(iterable))
 
     def _browse(self, ids):
-        next(self._end(), None)
-        args = self._cr_uid + (list(ids),)
-        if not self._patch:
-            self._patch = no_selection_cache_validation()
+        args = self._cr_uid + (ids.tolist() if isinstance(ids, array) else list(ids),)
+        self._patch = no_selection_cache_validation()
         self._patch.start()
 
         return self._model.browse(*args)
 
+    def _ended_chunks(self, chunks):
+        for records in chunks:
+            yield records
+            # end the chunk before resuming the sizer, so its flush is measured with it
+            next(self._end(), None)
+
+    def _prefetch_chunks(self, chunks):
+        for records in self._ended_chunks(chunks):
+            for path in self._prefetch:
+                records.mapped(path)
+            yield records
+
     def _end(self):
         if self._strategy == "commit":
             self._model.env.cr.commit()
@@ -432,6 +822,7 @@ class iter_browse(object):
         invalidate(self._model, *self._cr_uid)
         if self._patch:
             self._patch.stop()
+            self._patch = None
         if 0:
             yield
 
@@ -440,8 +831,10 @@ class iter_browse(object):
             raise RuntimeError("%r ran twice" % (self,))
 
         it = self._it if self._yield_chunks else chain.from_iterable(self._it)
-        sz = (self._size + self._chunk_size - 1) // self._chunk_size if self._yield_chunks else self._size
-        if self._logger:
+        if self._logger and not self._yield_chunks:
+            it = log_progress(it, self._logger, qualifier=self._model._name, size=self._size)
+        elif self._logger and not self._sizer:
+            sz = (self._size + self._chunk_size - 1) // self._chunk_size
             it = log_progress(it, self._logger, qualifier=self._model._name, size=sz)
         self._it = None
         return chain(it, self._end())
@@ -454,7 +847,7 @@ class iter_browse(object):
             raise TypeError("The attribute %r is not callable" % attr)
 
         it = self._it
-        if self._logger:
+        if self._logger and not self._sizer:
             sz = (self._size + self._chunk_size - 1) // self._chunk_size
             qualifier = "%s[:%d]" % (self._model._name, self._chunk_size)
             it = log_progress(it, self._logger, qualifier=qualifier, size=sz)
@@ -473,33 +866,54 @@ class iter_browse(object):
         An alternative to the default `create` method of the ORM that is safe to use to
         create millions of records.
 
+        With the `copy` mode, the rows are directly streamed into the table using
+        `COPY FROM STDIN`, bypassing the ORM `create` method. Only the default values,
+        computed for each record, the stored computed fields, and the dependent fields,
+        handled in bulk after the insertion, are taken into account. Overrides of `create`,
+        mail tracking, and constraints defined in Python are ignored. This mode is meant to
+        populate plain data tables.
+
         :param list(dict) values: list of values of the records to create
         :param bool multi: whether to use the multi version of `create`, by default is
-                           `True` from Odoo 12 and above
+                           `True` from Odoo 12 and above, not available with the `copy` mode
+        :param str mode: how to create the records, either `orm` (the default) or `copy`
         """
+        mode = kw.pop("mode", "orm")
+        if mode == "copy" and "multi" in kw:
+            raise ValueError("The `multi` argument cannot be used with the `copy` mode")
         multi = kw.pop("multi", version_gte("saas~11.5"))
         if kw:
             raise TypeError("Unknown arguments: %s" % ", ".join(kw))
 
+        if mode not in {"orm", "copy"}:
+            raise ValueError("Invalid mode {!r}".format(mode))
+
         if not values:
             raise ValueError("`create` cannot be called with an empty `values` argument")
 
         if self._size:
             raise ValueError("`create` can only called on empty `browse_record` objects.")
 
+        if mode == "copy":
+            if self._cr_uid:
+                raise ValueError("The `copy` mode is only available with the new API")
+            insert, fnames = self._copy_inserter(values)
+
         ids = []
         size = len(values)
-        it = chunks(values, self._chunk_size, fmt=list)
-        if self._logger:
+        it = self._chunks(values, list)
+        if self._logger and not self._sizer:
             sz = (size + self._chunk_size - 1) // self._chunk_size
             qualifier = "env[%r].create([:%d])" % (self._model._name, self._chunk_size)
             it = log_progress(it, self._logger, qualifier=qualifier, size=sz)
 
-        self._patch = no_selection_cache_validation()
         for sub_values in it:
+            self._patch = no_selection_cache_validation()
             self._patch.start()
 
-            if multi:
+            if mode == "copy":
+                ids += insert(sub_values)
+            elif multi:
                 ids += self._model.create(sub_values).ids
             elif not self._cr_uid:
                 ids += [self._model.create(sub_value).id for sub_value in sub_values]
@@ -508,10 +922,129 @@ class iter_browse(object):
                 ids += [self._model.create(*(self._cr_uid + (sub_value,))) for sub_value in sub_values]
 
             next(self._end(), None)
+
+        if mode == "copy":
+            self._copy_post_create(ids, fnames)
+
         args = self._cr_uid + (ids,)
-        return iter_browse(
-            self._model, *args, chunk_size=self._chunk_size, logger=self._logger, strategy=self._strategy
-        )
+        kwargs = {
+            "chunk_size": self._chunk_size,
+            "logger": self._logger,
+            "strategy": self._strategy,
+            "prefetch": self._prefetch,
+        }
+        return iter_browse(self._model, *args, **kwargs)
+
+    def _copy_inserter(self, values):
+        Model = self._model
+        cr = Model.env.cr
+        if Model._inherits:
+            raise ValueError("The `copy` mode cannot be used on models with `_inherits`: %r" % Model._name)
+
+        def copyable(field):
+            return (
+                field.store
+                and getattr(field, "column_type", True)
+                and field.type not in ("one2many", "many2many")
+                and not field.inherited
+            )
+
+        fnames = set()
+        for vals in values:
+            fnames.update(vals)
+        fnames.discard("id")
+        invalid = [fname for fname in fnames if fname not in Model._fields or not copyable(Model._fields[fname])]
+        if invalid:
+            raise ValueError(
+                "Fields %s of %r cannot be set with the `copy` mode" % (", ".join(sorted(invalid)), Model._name)
+            )
+
+        log_access = {}
+        if getattr(Model, "_log_access", False):
+            cr.execute("SELECT now() AT TIME ZONE 'UTC'")
+            [now] = cr.fetchone()
+            uid = Model.env.uid
+            log_access = {"create_uid": uid, "write_uid": uid, "create_date": now, "write_date": now}
+        # like the ORM, default values are computed for each record, as they can differ
+        # for each of them, e.g. sequences, dates, or uuids
+        defaultable = [
+            fname
+            for fname, field in Model._fields.items()
+            if copyable(field) and fname != "id" and fname not in log_access
+        ]
+
+        table = Model._table
+        written = set(fnames) | set(log_access)
+
+        def insert(sub_values):
+            cr.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)", [table, len(sub_values)]
+            )
+            new_ids = [id_ for (id_,) in cr.fetchall()]
+            records = []
+            for vals in sub_values:
+                missing = [fname for fname in defaultable if fname not in vals]
+                defaults = Model.default_get(missing) if missing else {}
+                record = {fname: value for fname, value in defaults.items() if fname in missing}
+                record.update(log_access)
+                record.update(vals)
+                records.append(record)
+            columns = sorted({fname for record in records for fname in record} - {"id"})
+            written.update(columns)
+            fields_ = [Model._fields[fname] for fname in columns]
+            rows = [
+                [id_]
+                + [
+                    getattr(field, "convert_to_column_insert", field.convert_to_column)(record.get(field.name), Model)
+                    for field in fields_
+                ]
+                for id_, record in zip(new_ids, records)
+            ]
+            try:
+                copy_rows(cr, table, ["id"] + columns, rows)
+            except TypeError:
+                # some values are only rendered as SQL by their adapter
+                psycopg2.extras.execute_values(
+                    cr._obj,
+                    format_query(
+                        cr, "INSERT INTO {} ({}) VALUES %s", table, ColumnList.from_unquoted(cr, ["id"] + columns)
+                    ),
+                    rows,
+                    page_size=len(rows),
+                )
+            return new_ids
+
+        return insert, written
+
+    def _copy_post_create(self, ids, fnames):
+        Model = self._model
+        to_compute = [
+            fname
+            for fname, field in Model._fields.items()
+            if field.store and field.compute and fname not in fnames and fname != "parent_path"
+        ]
+        if to_compute:
+            recompute_fields(
+                Model.env.cr,
+                Model,
+                to_compute,
+                ids=ids,
+                logger=self._logger or _logger,
+                chunk_size=self._chunk_size,
+                strategy=self._strategy,
+            )
+
+        # update the parent paths and trigger the recomputation of the dependent fields
+        for sub_ids in chunks(ids, self._chunk_size if self._chunk_size is not AUTO else 200, list):
+            records = Model.browse(sub_ids)
+            if getattr(Model, "_parent_store", False) and hasattr(records, "_parent_store_create"):
+                records._parent_store_create()
+            records.modified(list(fnames) + to_compute)
+            if self._strategy == "commit":
+                Model.env.cr.commit()
+            else:
+                flush(records)
+            invalidate(records)
 
 
 @contextmanager
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Utility functions for interacting with PostgreSQL."""
 
+import binascii
 import collections
+import io
 import logging
 import os
 import re
@@ -30,9 +32,15 @@ try:  # noqa: SIM105
 except NameError:
     pass
 
+# python3 shims
+try:
+    basestring  # noqa: B018
+except NameError:
+    basestring = unicode = str
+
 import psycopg2
 from psycopg2 import errorcodes, sql
-from psycopg2.extensions import quote_ident
+from psycopg2.extensions import Binary, QuotedString, quote_ident
 from psycopg2.extras import Json
 
 try:
@@ -43,15 +51,17 @@ except ImportError:
 
     odoo_module = None
 
+from . import json, profiling
 from .exceptions import MigrationError, SleepyDeveloperError
 from .helpers import _validate_table, model_of_table
-from .misc import AUTO, Sentinel, log_progress, on_CI, version_gte
+from .misc import AUTO, IdArray, Sentinel, log_progress, on_CI, version_gte
 
 _logger = logging.getLogger(__name__)
 
 ON_DELETE_ACTIONS = frozenset(("SET NULL", "CASCADE", "RESTRICT", "NO ACTION", "SET DEFAULT"))
 MAX_BUCKETS = int(os.getenv("MAX_BUCKETS", "150000"))
 DEFAULT_BUCKET_SIZE = int(os.getenv("BUCKET_SIZE", "10000"))
+BULK_UPDATE_COPY_THRESHOLD = int(os.getenv("BULK_UPDATE_COPY_THRESHOLD", "10000"))
 
 
 class PGRegexp(str):
@@ -88,6 +98,25 @@ def savepoint(cr):
         yield
 
 
+def _drop_tables(cr, tables):
+    # used to clean up work tables, also when an error occurred
+    try:
+        for table in tables:
+            cr.execute(format_query(cr, "DROP TABLE IF EXISTS {}", table))
+    except psycopg2.InternalError as e:
+        if e.pgcode != errorcodes.IN_FAILED_SQL_TRANSACTION:
+            raise
+        # the tables created in the aborted transaction are gone with it, not the committed ones
+        _logger.warning("Cannot drop the work tables %s in an aborted transaction", ", ".join(tables))
+
+
+def _running_tests():
+    # the tests run in a single transaction, nothing can be committed nor run on other cursors
+    return getattr(threading.current_thread(), "testing", False) or (
+        odoo_module is not None and getattr(odoo_module, "current_test", False)
+    )
+
+
 def _parallel_execute_serial(cr, queries, logger=_logger, qualifier="queries"):
     cnt = 0
     for query in log_progress(queries, logger, qualifier=qualifier, size=len(queries)):
@@ -109,9 +138,10 @@ if ThreadPoolExecutor is not None:
 
         max_workers = min(get_max_workers(), len(queries))
         cursor = db_connect(cr.dbname).cursor
+        origin = profiling._caller()
 
         def execute(query):
-            with cursor() as tcr:
+            with profiling._inherit(origin), cursor() as tcr:
                 tcr.execute(query)
                 return tcr.rowcount
 
@@ -181,12 +211,7 @@ def parallel_execute(cr, queries, logger=_logger, qualifier="queries"):
     .. note::
        If a concurrency issue occurs, the *failing* queries will be retried sequentially.
     """
-    parallel_execute_impl = (
-        _parallel_execute_serial
-        if getattr(threading.current_thread(), "testing", False)
-        or (odoo_module is not None and getattr(odoo_module, "current_test", False))
-        else _parallel_execute_threaded
-    )
+    parallel_execute_impl = _parallel_execute_serial if _running_tests() else _parallel_execute_threaded
     return parallel_execute_impl(cr, queries, logger=_logger, qualifier=qualifier)
 
 
@@ -835,6 +860,227 @@ def alter_column_type(cr, table, column, type, using=None, where=None, logger=_l
     cr.execute(format_query(cr, "ALTER TABLE {} DROP COLUMN {} CASCADE", table, tmp_column))
 
 
+def alter_columns_type(cr, table, specs, vacuum=False, logger=_logger):
+    """
+    Alter the type of several columns of a table, in a single pass.
+
+    A new column of the new type is created for each column. All the new columns are then
+    filled by a single `UPDATE`, split in parallel queries, before replacing the old
+    columns. The indexes and constraints depending on the altered columns,
+    including foreign keys from other tables, are captured beforehand and recreated
+    afterwards, the indexes being built in parallel. The defaults, `NOT NULL` flags, and
+    owned sequences of the columns are kept. The views depending on the columns are
+    dropped, as with :func:`alter_column_type`.
+
+    .. example::
+       .. code-block:: python
+
+          util.alter_columns_type(
+              cr,
+              "account_move_line",
+              {
+                  "id": "int8",
+                  "quantity": ("numeric", None),
+                  "amount": ("numeric", "round({0}::numeric, 2)"),
+              },
+              vacuum="full",
+          )
+
+    :param str table: name of the affected table
+    :param dict specs: new type of each column to alter, or a `(type, using)` tuple where
+                       `using` is a SQL expression defining how to convert the value, as for
+                       :func:`alter_column_type`
+    :param bool | str vacuum: whether to vacuum the table once the columns are converted,
+                              to make the space used by the old rows reusable. With `full`,
+                              the table is rewritten to give the space back to the system,
+                              before recreating the indexes. As a side effect, the cursor
+                              is committed.
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+    """
+    _validate_table(table)
+    if vacuum not in (False, True, "full"):
+        raise ValueError("Invalid vacuum mode {!r}".format(vacuum))
+    columns = {}
+    for column, spec in specs.items():
+        type_, using = (spec, None) if isinstance(spec, basestring) else spec
+        if not using and column_type(cr, table, column, sized=True) == _normalize_pg_type(type_):
+            logger.info("Column %r of table %r is already defined as %r", column, table, type_)
+            continue
+        columns[column] = (type_, using or "{{0}}::{}".format(type_))
+    if not columns:
+        return
+
+    names = sorted(columns)
+    cr.execute(
+        """
+        SELECT a.attname, a.attnum, a.attnotnull, pg_get_expr(d.adbin, d.adrelid)
+          FROM pg_attribute a
+     LEFT JOIN pg_attrdef d
+            ON d.adrelid = a.attrelid
+           AND d.adnum = a.attnum
+         WHERE a.attrelid = %s::regclass
+           AND a.attname = ANY(%s)
+        """,
+        [table, names],
+    )
+    attrs = {name: (attnum, notnull, default) for name, attnum, notnull, default in cr.fetchall()}
+    attnums = [attrs[name][0] for name in names]
+
+    # constraints on the columns, or referencing them
+    cr.execute(
+        """
+        SELECT c.conrelid::regclass::text,
+               c.conname,
+               pg_get_constraintdef(c.oid),
+               CASE WHEN c.contype IN ('p', 'u') THEN pg_get_indexdef(c.conindid) END,
+               c.contype
+          FROM pg_constraint c
+         WHERE (c.conrelid = %(table)s::regclass AND c.conkey && %(attnums)s::int2[])
+            OR (c.confrelid = %(table)s::regclass AND c.confkey && %(attnums)s::int2[])
+      ORDER BY c.contype = 'f', c.conname
+        """,
+        {"table": table, "attnums": attnums},
+    )
+    constraints = cr.fetchall()
+
+    # other indexes on, or using, the columns
+    cr.execute(
+        """
+        SELECT DISTINCT pg_get_indexdef(i.indexrelid)
+          FROM pg_index i
+          JOIN pg_depend d
+            ON d.classid = 'pg_class'::regclass
+           AND d.objid = i.indexrelid
+           AND d.refobjid = i.indrelid
+         WHERE i.indrelid = %s::regclass
+           AND d.refobjsubid = ANY(%s)
+           AND NOT EXISTS(SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+        """,
+        [table, attnums],
+    )
+    indexes = [indexdef for (indexdef,) in cr.fetchall()]
+
+    # sequences owned by the columns, like the one of `id`
+    cr.execute(
+        """
+        SELECT s.objid::regclass::text, a.attname
+          FROM pg_depend s
+          JOIN pg_attribute a
+            ON a.attrelid = s.refobjid
+           AND a.attnum = s.refobjsubid
+         WHERE s.classid = 'pg_class'::regclass
+           AND s.refobjid = %s::regclass
+           AND s.refobjsubid = ANY(%s)
+           AND s.deptype IN ('a', 'i')
+           AND EXISTS(SELECT 1 FROM pg_class c WHERE c.oid = s.objid AND c.relkind = 'S')
+        """,
+        [table, attnums],
+    )
+    sequences = cr.fetchall()
+
+    if table_exists(cr, "ir_model_fields_selection"):
+        cr.execute(
+            """
+            DELETE FROM ir_model_fields_selection s
+                  USING ir_model_fields f
+                  WHERE f.id = s.field_id
+                    AND f.model = %s
+                    AND f.name = ANY(%s)
+            """,
+            [model_of_table(cr, table), names],
+        )
+    for column in names:
+        drop_depending_views(cr, table, column)
+
+    # the new columns are filled while the old ones, including `id`, are still in place
+    new_columns = {column: "_{}_upg".format(column) for column in names}
+    cr.execute(
+        format_query(
+            cr,
+            "ALTER TABLE {} {}",
+            table,
+            sql.SQL(", ").join(
+                format_query(cr, "ADD COLUMN {} {}", new_columns[column], sql.SQL(columns[column][0]))
+                for column in names
+            ),
+        )
+    )
+    explode_execute(
+        cr,
+        format_query(
+            cr,
+            "UPDATE {} SET {}",
+            table,
+            sql.SQL(", ").join(
+                format_query(cr, "{} = {}", new_columns[column], sql.SQL(format_query(cr, columns[column][1], column)))
+                for column in names
+            ),
+        ),
+        table=table,
+        logger=logger,
+    )
+
+    for sequence, column in sequences:
+        cr.execute(format_query(cr, "ALTER SEQUENCE {} OWNED BY {}.{}", SQLStr(sequence), table, new_columns[column]))
+    cr.execute(
+        format_query(
+            cr,
+            "ALTER TABLE {} {}",
+            table,
+            sql.SQL(", ").join(format_query(cr, "DROP COLUMN {} CASCADE", column) for column in names),
+        )
+    )
+    for column in names:
+        cr.execute(format_query(cr, "ALTER TABLE {} RENAME COLUMN {} TO {}", table, new_columns[column], column))
+    for column in names:
+        _, notnull, default = attrs[column]
+        if default is not None:
+            cr.execute(
+                format_query(cr, "ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {}", table, column, SQLStr(default))
+            )
+        if notnull:
+            cr.execute(format_query(cr, "ALTER TABLE {} ALTER COLUMN {} SET NOT NULL", table, column))
+
+    if vacuum:
+        _vacuum(cr, table, full=vacuum == "full")
+
+    # build the indexes in parallel, including the ones of the unique and primary key constraints
+    parallel_execute(
+        cr,
+        indexes + [indexdef for _, _, _, indexdef, _ in constraints if indexdef],
+        logger=logger,
+        qualifier="indexes of {}".format(table),
+    )
+    for contable, conname, condef, indexdef, contype in constraints:
+        if indexdef:
+            index_name = re.match(r"CREATE (?:UNIQUE )?INDEX (\S+) ON", indexdef).group(1)
+            query = "ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}".format(
+                contable,
+                quote_ident(conname, cr._cnx),
+                "PRIMARY KEY" if contype == "p" else "UNIQUE",
+                index_name,
+            )
+        else:
+            query = "ALTER TABLE {} ADD CONSTRAINT {} {}".format(contable, quote_ident(conname, cr._cnx), condef)
+        cr.execute(query)
+    cr.execute(format_query(cr, "ANALYZE {}", table))
+
+
+def _vacuum(cr, table, full=False):
+    if _running_tests():
+        # cannot commit during tests
+        return
+    cr.commit()
+    with db_connect(cr.dbname).cursor() as vcr:
+        # VACUUM cannot run inside a transaction block
+        vcr._cnx.autocommit = True
+        try:
+            vcr.execute(format_query(vcr, "VACUUM {}{}", sql.SQL("FULL " if full else ""), table))
+        finally:
+            vcr._cnx.autocommit = False
+
+
 def table_exists(cr, table):
     _validate_table(table)
     cr.execute(
@@ -1086,6 +1332,203 @@ def temp_index(cr, table, *columns):
         cr.execute('DROP INDEX IF EXISTS "{}"'.format(name))
 
 
+INDEX_BUILD_MEMORY = int(os.getenv("UPG_INDEX_BUILD_MEMORY", "1024"))  # MiB, shared by the concurrent builds
+_INDEX_SNAPSHOT_TABLE = "_upgrade_dropped_indexes"
+
+
+@contextmanager
+def without_indexes(cr, tables, logger=_logger):
+    """
+    Drop the indexes of some tables during a bulk phase, and rebuild them afterwards.
+
+    The definitions of the indexes of the tables are saved, the indexes are dropped, and
+    rebuilt in parallel at the end of the context manager, using
+    :func:`restore_indexes`. Only the plain indexes are dropped: the primary keys, the
+    unique indexes, and the indexes backing a constraint are kept.
+
+    .. example::
+       .. code-block:: python
+
+          with util.without_indexes(cr, ["account_move_line", "account_partial_reconcile"]):
+              util.explode_execute(cr, "UPDATE account_move_line SET ...", table="account_move_line")
+
+    If an error occurs, the indexes are rebuilt sequentially, without committing, before
+    re-raising the error. When this is not possible because the transaction is aborted,
+    the dropped indexes are only gone if their removal was committed by the bulk phase,
+    in which case their definitions are committed too, and can be rebuilt by calling
+    :func:`restore_indexes`.
+
+    :param list(str) tables: names of the tables whose indexes are dropped
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+
+    .. warning::
+       As a side effect, the cursor is committed when the indexes are rebuilt.
+    """
+    if isinstance(tables, basestring):
+        tables = [tables]
+    for table in tables:
+        _validate_table(table)
+    _create_index_snapshot_table(cr)
+    query = format_query(
+        cr,
+        """
+        INSERT INTO {}(name, tablename, indexdef)
+        SELECT quote_ident(i.relname), t.relname, pg_get_indexdef(x.indexrelid)
+          FROM pg_index x
+          JOIN pg_class i
+            ON i.oid = x.indexrelid
+          JOIN pg_class t
+            ON t.oid = x.indrelid
+         WHERE x.indrelid = ANY(ARRAY(SELECT to_regclass(unnest(%s::text[]))))
+           AND NOT x.indisprimary
+           AND NOT x.indisunique
+           AND NOT EXISTS(SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+            ON CONFLICT (name) DO UPDATE
+           SET tablename = EXCLUDED.tablename,
+               indexdef = EXCLUDED.indexdef,
+               duration = NULL
+        RETURNING name
+        """,
+        _INDEX_SNAPSHOT_TABLE,
+    )
+    cr.execute(query, [list(tables)])
+    names = [name for (name,) in cr.fetchall()]
+    if names:
+        logger.info("Drop %s indexes of tables %s", len(names), ", ".join(tables))
+        cr.execute("DROP INDEX {}".format(", ".join(names)))
+    try:
+        yield
+    except Exception:
+        if names:
+            _restore_indexes_on_error(cr, names, logger)
+        raise
+    if names:
+        restore_indexes(cr, names, logger=logger)
+
+
+def restore_indexes(cr, names=None, logger=_logger):
+    """
+    Rebuild in parallel indexes dropped by :func:`without_indexes`.
+
+    Each build has its share of the `UPG_INDEX_BUILD_MEMORY` environment variable (in MiB)
+    as `maintenance_work_mem`, and of the CPUs as `max_parallel_maintenance_workers`. The
+    build time of each index is logged.
+
+    :param list(str) names: names of the indexes to rebuild, all the dropped ones if not set
+    :param logger: logger used to report the progress
+    :type logger: :class:`logging.Logger`
+
+    .. warning::
+       As a side effect, the cursor is committed.
+    """
+    if not table_exists(cr, _INDEX_SNAPSHOT_TABLE):
+        return
+    query = format_query(cr, "SELECT name, indexdef FROM {} WHERE duration IS NULL", _INDEX_SNAPSHOT_TABLE)
+    if names is not None:
+        query += cr.mogrify(" AND name = ANY(%s)", [list(names)]).decode()
+    cr.execute(query)
+    indexes = cr.fetchall()
+    if not indexes:
+        return
+
+    workers = min(get_max_workers(), len(indexes))
+    settings = {"maintenance_work_mem": "{}MB".format(max(64, INDEX_BUILD_MEMORY // workers))}
+    if cr._cnx.server_version >= 110000:
+        settings["max_parallel_maintenance_workers"] = str(max(0, cpu_count() // workers - 1))
+    # when the builds run serially on `cr`, the local settings would outlive them, restore them after each build
+    names = sorted(settings)
+    cr.execute("SELECT {}".format(", ".join(["current_setting(%s)"] * len(names))), names)
+    current = dict(zip(names, cr.fetchone()))
+
+    def set_local(values):
+        return SQLStr(
+            "; ".join(format_query(cr, "SET LOCAL {} = {}", name, sql.Literal(values[name])) for name in names)
+        )
+
+    queries = [
+        cr.mogrify(
+            format_query(
+                cr,
+                """
+                {settings};
+                SELECT set_config('upgrade.index_build_start', clock_timestamp()::text, true);
+                {indexdef};
+                UPDATE {table}
+                   SET duration = clock_timestamp() - current_setting('upgrade.index_build_start')::timestamptz
+                 WHERE name = %s;
+                {restore}
+                """,
+                settings=set_local(settings),
+                indexdef=SQLStr(indexdef.replace("%", "%%")),
+                table=_INDEX_SNAPSHOT_TABLE,
+                restore=set_local(current),
+            ),
+            [name],
+        ).decode()
+        for name, indexdef in indexes
+    ]
+    parallel_execute(cr, queries, logger=logger, qualifier="indexes")
+
+    cr.execute(
+        format_query(
+            cr,
+            "DELETE FROM {} WHERE name = ANY(%s) AND duration IS NOT NULL RETURNING name, tablename, duration",
+            _INDEX_SNAPSHOT_TABLE,
+        ),
+        [[name for name, _ in indexes]],
+    )
+    for name, table, duration in sorted(cr.fetchall(), key=lambda r: r[2], reverse=True):
+        logger.info("Index %s on table %s built in %.1fs", name, table, duration.total_seconds())
+    _drop_index_snapshot_table_if_empty(cr)
+
+
+def _create_index_snapshot_table(cr):
+    cr.execute(
+        format_query(
+            cr,
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS {}(
+                name varchar PRIMARY KEY,
+                tablename varchar NOT NULL,
+                indexdef text NOT NULL,
+                duration interval
+            )
+            """,
+            _INDEX_SNAPSHOT_TABLE,
+        )
+    )
+
+
+def _drop_index_snapshot_table_if_empty(cr):
+    cr.execute(format_query(cr, "SELECT 1 FROM {} LIMIT 1", _INDEX_SNAPSHOT_TABLE))
+    if not cr.rowcount:
+        cr.execute(format_query(cr, "DROP TABLE {}", _INDEX_SNAPSHOT_TABLE))
+
+
+def _restore_indexes_on_error(cr, names, logger):
+    # rebuild the indexes in the current transaction, the bulk phase being interrupted, no commit is allowed
+    try:
+        with savepoint(cr):
+            cr.execute(
+                format_query(cr, "DELETE FROM {} WHERE name = ANY(%s) RETURNING indexdef", _INDEX_SNAPSHOT_TABLE),
+                [names],
+            )
+            for (indexdef,) in cr.fetchall():
+                cr.execute(indexdef)
+            _drop_index_snapshot_table_if_empty(cr)
+    except psycopg2.InternalError as e:
+        if e.pgcode != errorcodes.IN_FAILED_SQL_TRANSACTION:
+            raise
+    else:
+        return
+    logger.error(
+        "Cannot rebuild the indexes %s in an aborted transaction. If their removal was committed, "
+        "they can be restored with `util.restore_indexes(cr)`",
+        ", ".join(names),
+    )
+
+
 def get_depending_views(cr, table, column):
     # http://stackoverflow.com/a/11773226/75349
     _validate_table(table)
@@ -1876,7 +2319,7 @@ def create_id_sequence(cr, table, set_as_default=True):
         )
 
 
-def bulk_update_table(cr, table, columns, mapping, key_col="id"):
+def bulk_update_table(cr, table, columns, mapping, key_col="id", method=AUTO, parallel=False):
     """
     Update table based on mapping.
 
@@ -1910,6 +2353,15 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
                          following the **same** order
     :param str key_col: column used as key to get the values from `mapping` during the
                         update.
+    :param str method: how the mapping is sent to the database. With `json`, it is sent
+                       as a single JSON document. With `copy`, it is copied into a typed
+                       table joined by the update, which allows to use the indexes on
+                       `key_col`. By default, `copy` is used for mappings of more than
+                       :data:`BULK_UPDATE_COPY_THRESHOLD` entries.
+    :param bool parallel: with the `copy` method, whether to split the update in
+                          buckets of ids run in parallel, see
+                          :func:`~odoo.upgrade.util.pg.explode_execute`. As a side effect,
+                          the cursor is committed.
 
     .. warning::
 
@@ -1922,12 +2374,23 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
         return
 
     assert isinstance(mapping, dict)
+    if method is AUTO:
+        method = "copy" if len(mapping) > BULK_UPDATE_COPY_THRESHOLD else "json"
+    if method not in {"json", "copy"}:
+        raise ValueError("Invalid method {!r}".format(method))
+
     if isinstance(columns, str):
         columns = [columns]
+        if method == "copy":
+            mapping = {key: [value] for key, value in mapping.items()}
     else:
         n_columns = len(columns)
         assert all(isinstance(value, (list, tuple)) and len(value) == n_columns for value in mapping.values())
 
+    if method == "copy":
+        _bulk_update_table_copy(cr, table, list(columns), mapping, key_col, parallel)
+        return
+
     query = format_query(
         cr,
         """
@@ -1949,21 +2412,208 @@ def bulk_update_table(cr, table, columns, mapping, key_col="id"):
     cr.execute(query, [Json(mapping)])
 
 
+def _bulk_update_table_copy(cr, table, columns, mapping, key_col, parallel):
+    # the mapping is copied into a typed table, named after the columns of `table`
+    map_table = "_upgrade_bulk_update_{}".format(uuid.uuid4().hex)
+    cols = ColumnList.from_unquoted(cr, columns)
+    cr.execute(
+        format_query(
+            cr,
+            "CREATE UNLOGGED TABLE {} ({})",
+            map_table,
+            SQLStr(
+                ", ".join(
+                    format_query(cr, "{} {}", col_name, SQLStr(column_type(cr, table, col_name, sized=True)))
+                    for col_name in [key_col] + columns
+                )
+            ),
+        )
+    )
+    copy_rows(cr, map_table, [key_col] + columns, ([key] + list(values) for key, values in mapping.items()))
+    cr.execute(format_query(cr, "CREATE INDEX ON {} ({})", map_table, key_col))
+    cr.execute(format_query(cr, "ANALYZE {}", map_table))
+
+    query = format_query(
+        cr,
+        """
+        UPDATE {table} t
+           SET ({cols}) = ROW({m_cols})
+          FROM {map_table} m
+         WHERE t.{key_col} = m.{key_col}
+        """,
+        table=table,
+        cols=cols,
+        m_cols=cols.using(alias="m"),
+        map_table=map_table,
+        key_col=key_col,
+    )
+    if not parallel:
+        cr.execute(query)
+    elif key_col == "id":
+        # only split the range of the mapped ids
+        explode_execute(cr, query, table=map_table, alias="m")
+    else:
+        explode_execute(cr, query, table=table, alias="t")
+    cr.execute(format_query(cr, "DROP TABLE {}", map_table))
+
+
+def _copy_escape(value):
+    """
+    Render a value in the text format of `COPY`.
+
+    :meta private: exclude from online docs
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, Binary):
+        # bytea, in hex format
+        return "\\\\x" + binascii.hexlify(bytes(value.adapted)).decode("ascii")
+    if isinstance(value, (Json, QuotedString)):
+        value = value.adapted
+    elif hasattr(value, "getquoted"):
+        # other adapters, like `AsIs`, render SQL that cannot be copied
+        raise TypeError("Cannot copy a value adapted as SQL: {!r}".format(value))
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, bytes) and bytes is not str:
+        # bytea, in hex format
+        return "\\\\x" + binascii.hexlify(value).decode("ascii")
+    elif not isinstance(value, basestring):
+        value = str(value)
+    if not isinstance(value, unicode):
+        value = value.decode("utf-8")
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def copy_rows(cr, table, columns, rows):
+    """
+    Insert rows into a table using `COPY FROM STDIN`.
+
+    This is way faster than `INSERT` queries to load a lot of rows. The values are
+    serialized in the text format of `COPY`: `None` becomes `NULL`, `dict` and `list`
+    values are serialized as JSON, `bytes` as `bytea`, and other values are rendered as
+    text and casted by PostgreSQL to the type of their column. The values wrapped by the
+    `Json`, `Binary`, and `QuotedString` adapters of psycopg2 are unwrapped, while other
+    adapters raise a `TypeError`, before anything is sent to PostgreSQL.
+
+    .. example::
+       .. code-block:: python
+
+          util.copy_rows(cr, "res_partner_title", ["name", "shortcut"], [("Doctor", "Dr."), ("Madam", None)])
+
+    :param str table: table to insert into
+    :param list(str) columns: columns to fill, in the order of the values of the rows
+    :param iterable rows: values of the rows to insert, each row being a sequence of
+                          values matching `columns`
+    :return: the number of inserted rows
+    :rtype: int
+    """
+    _validate_table(table)
+    buf = io.BytesIO()
+    count = 0
+    for row in rows:
+        buf.write(("\t".join(_copy_escape(value) for value in row) + "\n").encode("utf-8"))
+        count += 1
+    if not count:
+        return 0
+    buf.seek(0)
+    query = format_query(cr, "COPY {} ({}) FROM STDIN", table, ColumnList.from_unquoted(cr, columns))
+    cr.copy_expert(query, buf)
+    return count
+
+
+_SIMPLE_PK_SELECT_RE = re.compile(
+    r"""
+    ^\s*SELECT\s+(?:(?P<alias>\w+)\.)?"?id"?
+    \s+FROM\s+"?(?P<table>\w+)"?(?:\s+(?:AS\s+)?(?P<table_alias>(?!WHERE\b)\w+))?
+    (?:\s+WHERE\s+(?!.*\b(?:SELECT|JOIN|GROUP|HAVING|UNION|INTERSECT|EXCEPT|LIMIT|OFFSET|ORDER|FOR)\b)[^;]*)?
+    \s*$
+    """,
+    re.IGNORECASE | re.VERBOSE | re.DOTALL,
+)
+_SQL_NOISE_RE = re.compile(r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'", re.DOTALL)
+_DML_CTE_RE = re.compile(r"\bAS(?:\s+(?:NOT\s+)?MATERIALIZED)?\s*\(\s*(?:INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_STATEMENT_RE = re.compile(r"\b(SELECT|VALUES|TABLE|INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+
+def _strip_sql_noise(query):
+    return _SQL_NOISE_RE.sub(" ", query)
+
+
+def _is_dml(query):
+    query = _strip_sql_noise(query)
+    if _DML_CTE_RE.search(query):
+        return True
+    # the statement is given by the first keyword outside of parentheses, which skips the CTEs
+    depth = 0
+    for part in re.split(r"([()])", query):
+        if part == "(":
+            depth += 1
+        elif part == ")":
+            depth -= 1
+        elif depth == 0:
+            match = _STATEMENT_RE.search(part)
+            if match:
+                return match.group(1).upper() not in ("SELECT", "VALUES", "TABLE")
+    return False
+
+
 class query_ids(object):
     """
     Iterator over ids returned by a query.
 
     This allows iteration over a potentially huge number of ids without exhausting memory.
 
+    The ids are either stored first in a temporary table, which also allows to verify they
+    are unique, or fetched by pages directly from the query, in ascending order. As the
+    query is then run again for each page, only queries whose result is not changed during
+    the iteration can be used directly.
+
     :param str query: the query that returns the ids. It can be DML,
-                      e.g. `UPDATE table WHERE ... RETURNING id`.
+                      e.g. `UPDATE table WHERE ... RETURNING id`, unless `trusted` is set.
     :param int itersize: determines the number of rows fetched from PG at once,
                          see :func:`~odoo.upgrade.util.pg.named_cursor`.
+    :param bool trusted: whether the query is known to return unique, non-null ids, and to
+                         be stable while iterating. When set, the ids are fetched directly
+                         from the query, with a length only estimated by the query planner.
+                         When unset, only simple queries on the primary key, like
+                         `SELECT id FROM table WHERE ...`, are used directly: their length is
+                         exact and the pages stop at the greatest id found when the iteration
+                         starts. Rows updated during the iteration so they do not match the
+                         query anymore are then skipped if they were not reached yet; set it
+                         to `False` to always store the ids first.
     """
 
-    def __init__(self, cr, query, itersize=None):
+    def __init__(self, cr, query, itersize=None, trusted=None):
         self._ncr = None
         self._cr = cr
+        self._tmp_tbl = None
+        self._query = None
+        self._buffer = []
+        self._last = None
+        self._max = None
+        self._itersize = itersize or 2000
+        dml = _is_dml(query)
+        if trusted and dml:
+            raise ValueError("Only SELECT queries can be trusted, ids of DML queries must be stored:\n{}".format(query))
+
+        simple = trusted is not False and not dml and self._is_simple_pk_select(cr, query)
+        if simple:
+            self._query = query
+            # rows created or updated after this snapshot can still match the query, never
+            # go past it, so the iteration is consistent with the length
+            cr.execute(format_query(cr, "SELECT count(*), max(id) FROM ({}) q(id)", SQLStr(query)))
+            self._len, self._max = cr.fetchone()
+            if not self._len:
+                self._query = None
+            return
+        if trusted:
+            self._query = query
+            self._len = self._estimate(cr, query)
+            return
+
         self._tmp_tbl = "_upgrade_query_ids_{}".format(uuid.uuid4().hex)
         cr.execute(
             format_query(
@@ -1994,31 +2644,119 @@ class query_ids(object):
         self._ncr.execute(format_query(cr, "SELECT id FROM {} ORDER BY id", self._tmp_tbl))
         self._it = iter(self._ncr)
 
+    @staticmethod
+    def _is_simple_pk_select(cr, query):
+        match = _SIMPLE_PK_SELECT_RE.match(_strip_sql_noise(query))
+        if not match:
+            return False
+        alias = match.group("alias")
+        if alias and alias not in (match.group("table"), match.group("table_alias")):
+            return False
+        cr.execute(
+            """
+            SELECT 1
+              FROM pg_index i
+              JOIN pg_attribute a
+                ON a.attrelid = i.indrelid
+               AND a.attnum = ANY(i.indkey)
+             WHERE i.indrelid = to_regclass(%s)
+               AND i.indisprimary
+               AND i.indnatts = 1
+               AND a.attname = 'id'
+            """,
+            [match.group("table")],
+        )
+        return bool(cr.rowcount)
+
+    @staticmethod
+    def _estimate(cr, query):
+        cr.execute(format_query(cr, "EXPLAIN (FORMAT JSON) {}", SQLStr(query)))
+        [plan] = cr.fetchone()
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    def _page_query(self):
+        # keyset pagination, on the temporary table or directly on the query
+        source = (
+            format_query(self._cr, "{}", self._tmp_tbl)
+            if self._tmp_tbl
+            else format_query(self._cr, "({}) AS q(id)", SQLStr(self._query))
+        )
+        return format_query(
+            self._cr,
+            """
+            SELECT id
+              FROM {}
+             WHERE (%(last)s IS NULL OR id > %(last)s)
+               AND (%(max)s IS NULL OR id <= %(max)s)
+          ORDER BY id
+             LIMIT %(size)s
+            """,
+            SQLStr(source),
+        )
+
     def _close(self):
         if self._ncr:
             if self._ncr.closed:
                 return
             self._ncr.close()
+        self._query = None
+        if not self._tmp_tbl:
+            return
         try:
             self._cr.execute(format_query(self._cr, "DROP TABLE IF EXISTS {}", self._tmp_tbl))
         except psycopg2.InternalError as e:
             if e.pgcode != errorcodes.IN_FAILED_SQL_TRANSACTION:
                 raise
 
+    def _closed(self):
+        return self._ncr.closed if self._ncr else self._query is None
+
     def __len__(self):
         return self._len
 
+    def _iter_id_arrays(self, size):
+        # used by `chunks`, instead of the named cursor: fetch the ids by batches of binary
+        # data, loaded without creating a Python object per id
+        if self._closed():
+            return
+        query = format_query(
+            self._cr,
+            "SELECT string_agg(int8send(id::int8), ''::bytea ORDER BY id), max(id) FROM ({}) t",
+            SQLStr(self._page_query()),
+        )
+        last = self._last
+        while True:
+            self._cr.execute(query, {"last": last, "max": self._max, "size": size})
+            data, last = self._cr.fetchone()
+            if data is None:
+                break
+            yield IdArray.from_int8send(data)
+        self._close()
+
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self._ncr.closed:
+        if self._closed():
             raise StopIteration
-        try:
-            return next(self._it)[0]
-        except StopIteration:
-            self._close()
-            raise
+        if self._ncr:
+            try:
+                return next(self._it)[0]
+            except StopIteration:
+                self._close()
+                raise
+
+        if not self._buffer:
+            self._cr.execute(self._page_query(), {"last": self._last, "max": self._max, "size": self._itersize})
+            self._buffer = [id_ for (id_,) in self._cr.fetchall()]
+            if not self._buffer:
+                self._close()
+                raise StopIteration
+            self._buffer.reverse()
+            self._last = self._buffer[0]
+        return self._buffer.pop()
 
     def next(self):
         return self.__next__()
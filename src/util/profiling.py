@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of the queries and scripts run during an upgrade.
+
+When the `UPG_PROFILE` environment variable is set to a file path, every query executed
+through an Odoo cursor is timed. Its duration, number of affected rows, and size are
+attributed to the outermost `util` function in the call stack, and to the upgrade script
+running it, named as `module/version/script`. The report is written at exit, as CSV if
+the path ends with `.csv`, as JSON otherwise.
+
+When the `UPG_SCRIPT_LEDGER` environment variable is set, the execution of each upgrade
+script is recorded: its module, version, stage, name, start, duration, number of queries,
+number of affected rows, peak RSS, and whether it failed. The records are appended, one
+JSON object per line, to the file named by the variable if it ends with `.json`, or
+inserted in the `_upgrade_script_timings` unlogged table of the upgraded database
+otherwise. The table is written through its own connection, to keep the records of the
+scripts whose transaction is rolled back, and can be queried once the upgrade is done:
+
+.. code-block:: sql
+
+   SELECT module, version, stage, script, duration, queries, peak_rss
+     FROM _upgrade_script_timings
+ ORDER BY duration DESC
+
+The upgrade scripts are only timed once `util` is imported, which usually happens while
+the first upgrade script is loaded. That first script is thus not recorded. When `base`
+is upgraded, it is usually `base/0.0.0/pre-00-upgrade-start`, which only stores the start
+time of the upgrade.
+"""
+
+import atexit
+import csv
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from odoo import sql_db
+    from odoo.modules import migration
+except ImportError:
+    from openerp import sql_db
+    from openerp.modules import migration
+
+from . import json
+from .misc import _get_rss, str2bool
+
+# python3 shims
+try:
+    basestring  # noqa: B018
+except NameError:
+    basestring = (str, bytes)
+
+_logger = logging.getLogger(__name__)
+
+PROFILE_PATH = os.getenv("UPG_PROFILE")
+SCRIPT_LEDGER = os.getenv("UPG_SCRIPT_LEDGER")
+if SCRIPT_LEDGER and not SCRIPT_LEDGER.endswith(".json") and not str2bool(SCRIPT_LEDGER, default=True):
+    SCRIPT_LEDGER = None
+
+_UTIL_PREFIX = __name__.rpartition(".")[0] + "."
+_NO_HELPER = "-"
+_NO_SCRIPT = "-"
+
+_stats = {}
+_script_counters = None  # [queries, rows] of the running upgrade script
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _caller():
+    """
+    Return the `(script, helper)` the current query would be attributed to.
+
+    Returns `None` when the profiler is not enabled.
+    """
+    if not PROFILE_PATH:
+        return None
+    inherited = getattr(_local, "caller", None)
+    if inherited:
+        return inherited
+    helper = _NO_HELPER
+    script = _NO_SCRIPT
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__") or ""
+        if module == __name__:
+            # the profiler's own frames, e.g. the wrapped `execute`
+            pass
+        elif module.startswith(_UTIL_PREFIX):
+            helper = "{}.{}".format(module[len(_UTIL_PREFIX) :], frame.f_code.co_name)
+        elif frame.f_code.co_name == "migrate":
+            script = _script_name(frame.f_globals.get("__file__") or "")
+        frame = frame.f_back
+    return script, helper
+
+
+@contextmanager
+def _inherit(origin):
+    """
+    Attribute the queries of the current thread to `origin`, as returned by :func:`_caller`.
+
+    Used by the worker threads of :func:`~odoo.upgrade.util.pg.parallel_execute`, which
+    run queries on behalf of their parent thread.
+    """
+    if origin is None:
+        yield
+        return
+    previous = getattr(_local, "caller", None)
+    _local.caller = origin
+    try:
+        yield
+    finally:
+        _local.caller = previous
+
+
+def _script_name(path):
+    parts = os.path.normpath(path).split(os.sep)
+    if len(parts) < 3:
+        return _NO_SCRIPT
+    return "/".join(parts[-3:-1] + [os.path.splitext(parts[-1])[0]])
+
+
+def _record(origin, duration, rows, size):
+    rows = max(rows, 0)
+    with _lock:
+        if _script_counters is not None:
+            _script_counters[0] += 1
+            _script_counters[1] += rows
+        if origin is None:
+            return
+        stat = _stats.get(origin)
+        if stat is None:
+            stat = _stats[origin] = [0, 0.0, 0, 0]
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] += rows
+        stat[3] += size
+
+
+def _wrap_execute(execute):
+    def profiled_execute(self, query, *args, **kwargs):
+        origin = _caller()
+        start = time.time()
+        try:
+            return execute(self, query, *args, **kwargs)
+        finally:
+            try:
+                rows = self.rowcount
+            except Exception:
+                rows = -1
+            _record(origin, time.time() - start, rows or 0, len(query) if isinstance(query, basestring) else 0)
+
+    profiled_execute._upg_profiled = True
+    return profiled_execute
+
+
+def stats():
+    """Return the collected statistics, the most expensive first."""
+    with _lock:
+        items = list(_stats.items())
+    return [
+        {
+            "script": script,
+            "helper": helper,
+            "queries": count,
+            "duration": round(duration, 6),
+            "rows": rows,
+            "bytes": size,
+        }
+        for (script, helper), (count, duration, rows, size) in sorted(items, key=lambda item: -item[1][1])
+    ]
+
+
+def dump(path=None):
+    """Write the report to `path`, `UPG_PROFILE` by default."""
+    path = path or PROFILE_PATH
+    rows = stats()
+    with open(path, "w") as fp:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(fp, ["script", "helper", "queries", "duration", "rows", "bytes"])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            fp.write(json.dumps(rows))
+    _logger.info("SQL profile of %s queries written to %s", sum(r["queries"] for r in rows), path)
+
+
+def _reset_peak_rss():
+    # on Linux, writing `5` to `clear_refs` resets the peak RSS of the process
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except (IOError, OSError):
+        pass
+
+
+def _peak_rss():
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return _get_rss()
+
+
+def _timed_migrate(migrate, path):
+    parts = os.path.normpath(path).split(os.sep)
+    script = os.path.splitext(parts[-1])[0]
+    info = {
+        "module": parts[-3] if len(parts) >= 3 else "",
+        "version": parts[-2] if len(parts) >= 2 else "",
+        "stage": script.partition("-")[0],
+        "script": script,
+    }
+
+    @functools.wraps(migrate)
+    def timed_migrate(cr, version):
+        global _script_counters  # noqa: PLW0603
+        counters = _script_counters = [0, 0]
+        _reset_peak_rss()
+        timer = time.time()
+        failed = True
+        try:
+            result = migrate(cr, version)
+            failed = False
+            return result
+        finally:
+            _script_counters = None
+            entry = dict(
+                info,
+                start=time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timer)),
+                duration=round(time.time() - timer, 6),
+                queries=counters[0],
+                rows=counters[1],
+                peak_rss=_peak_rss(),
+                failed=failed,
+            )
+            try:
+                _write_ledger(cr.dbname, entry)
+            except Exception:
+                _logger.exception("Cannot record the execution of the upgrade script %s", path)
+
+    return timed_migrate
+
+
+def _write_ledger(dbname, entry):
+    if SCRIPT_LEDGER.endswith(".json"):
+        with open(SCRIPT_LEDGER, "a") as fp:
+            fp.write(json.dumps(entry, sort_keys=True) + "\n")
+        return
+    lcr = sql_db.db_connect(dbname).cursor()
+    try:
+        lcr.execute(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS _upgrade_script_timings(
+                id serial PRIMARY KEY,
+                module varchar,
+                version varchar,
+                stage varchar,
+                script varchar,
+                start timestamp,
+                duration float8,
+                queries integer,
+                rows bigint,
+                peak_rss bigint,
+                failed boolean
+            )
+            """
+        )
+        lcr.execute(
+            """
+            INSERT INTO _upgrade_script_timings(module, version, stage, script, start,
+                                                duration, queries, rows, peak_rss, failed)
+                 VALUES (%(module)s, %(version)s, %(stage)s, %(script)s, %(start)s,
+                         %(duration)s, %(queries)s, %(rows)s, %(peak_rss)s, %(failed)s)
+            """,
+            entry,
+        )
+        lcr.commit()
+    finally:
+        lcr.close()
+
+
+def _wrap_load_script(load_script):
+    @functools.wraps(load_script)
+    def ledger_load_script(path, module_name):
+        mod = load_script(path, module_name)
+        if callable(getattr(mod, "migrate", None)):
+            mod.migrate = _timed_migrate(mod.migrate, path)
+        return mod
+
+    ledger_load_script._upg_profiled = True
+    return ledger_load_script
+
+
+def _enable():
+    if getattr(sql_db.Cursor.execute, "_upg_profiled", False):
+        return
+    sql_db.Cursor.execute = _wrap_execute(sql_db.Cursor.execute)
+    if PROFILE_PATH:
+        atexit.register(dump)
+    if SCRIPT_LEDGER:
+        if getattr(migration, "load_script", None) is None:
+            _logger.warning("Cannot record the execution of the upgrade scripts on this version")
+        elif not getattr(migration.load_script, "_upg_profiled", False):
+            migration.load_script = _wrap_load_script(migration.load_script)
+
+
+if PROFILE_PATH or SCRIPT_LEDGER:
+    _enable()
@@ -1,5 +1,6 @@
 """Utility functions for record-level operations."""
 
+import copy
 import logging
 import os
 import re
@@ -38,8 +39,10 @@ from .inherit import direct_inherit_parents, for_each_inherit
 from .misc import AUTOMATIC, chunks, version_between, version_gte
 from .orm import env, flush
 from .pg import (
+    DEFAULT_BUCKET_SIZE,
     PGRegexp,
     SQLStr,
+    _drop_tables,
     _get_unique_indexes_with,
     _validate_table,
     column_exists,
@@ -56,10 +59,12 @@ from .pg import (
     table_exists,
     target_of,
 )
-from .report import add_to_migration_reports
+from .report import add_to_migration_reports, html_escape
 
 _logger = logging.getLogger(__name__)
 
+XMLID_CACHE_SIZE = int(os.getenv("UPG_XMLID_CACHE_SIZE", "0"))
+
 # python3 shims
 try:
     basestring  # noqa: B018
@@ -67,6 +72,104 @@ except NameError:
     basestring = unicode = str
 
 
+class _XmlidCache(object):
+    """
+    LRU cache of the records referenced by xml_ids, used by :func:`ref` and :func:`refs`.
+
+    Only existing xml_ids are cached. The util functions that rename or remove xml_ids
+    invalidate it, but direct changes to `ir_model_data` done by upgrade scripts are not
+    detected. That is why the cache is disabled unless its size is set via the
+    `UPG_XMLID_CACHE_SIZE` environment variable.
+
+    :meta private: exclude from online docs
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()  # (dbname, xmlid) -> (model, res_id)
+        # reverse indexes, to invalidate without scanning the whole cache
+        self._by_module = {}  # (dbname, module) -> {xmlid}
+        self._by_record = {}  # (dbname, model, res_id) -> {xmlid}
+        self.stats = {"hits": 0, "misses": 0, "queries": 0, "saved_queries": 0, "invalidations": 0}
+
+    def get(self, cr, xmlid):
+        key = (cr.dbname, xmlid)
+        value = self._data.pop(key, None)
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        self._data[key] = value  # most recently used
+        self.stats["hits"] += 1
+        return value
+
+    def set(self, cr, xmlid, model, res_id):
+        if not self.size:
+            return
+        self._discard(cr.dbname, xmlid)
+        self._data[(cr.dbname, xmlid)] = (model, res_id)
+        self._by_module.setdefault((cr.dbname, xmlid.partition(".")[0]), set()).add(xmlid)
+        self._by_record.setdefault((cr.dbname, model, res_id), set()).add(xmlid)
+        while len(self._data) > self.size:
+            (dbname, xmlid), _ = next(iter(self._data.items()))
+            self._discard(dbname, xmlid)
+
+    def _discard(self, dbname, xmlid):
+        value = self._data.pop((dbname, xmlid), None)
+        if value is None:
+            return False
+        for index, key in [(self._by_module, (dbname, xmlid.partition(".")[0])), (self._by_record, (dbname,) + value)]:
+            xmlids = index[key]
+            xmlids.discard(xmlid)
+            if not xmlids:
+                del index[key]
+        return True
+
+    def invalidate(self, cr, xmlids=(), modules=(), model=None, ids=()):
+        """Forget the given xml_ids, the xml_ids of the given modules, and the ones referencing `model` `ids`."""
+        if not self._data:
+            return
+        dbname = cr.dbname
+        xmlids = set(xmlids)
+        for module in modules:
+            xmlids.update(self._by_module.get((dbname, module), ()))
+        for res_id in ids:
+            xmlids.update(self._by_record.get((dbname, model, res_id), ()))
+        for xmlid in xmlids:
+            if self._discard(dbname, xmlid):
+                self.stats["invalidations"] += 1
+
+
+_xmlid_cache = _XmlidCache(XMLID_CACHE_SIZE)
+
+
+def xmlid_cache_stats():
+    """
+    Return the statistics of the xml_id cache used by :func:`ref` and :func:`refs`.
+
+    The cache is enabled by setting its size, in number of xml_ids, via the
+    `UPG_XMLID_CACHE_SIZE` environment variable. The returned dict contains the number of
+    cache `hits` and `misses`, the number of `queries` done to resolve xml_ids, and the
+    number of `saved_queries` thanks to the cache.
+
+    :rtype: dict
+    """
+    return dict(_xmlid_cache.stats, size=len(_xmlid_cache._data), max_size=_xmlid_cache.size)
+
+
+def invalidate_xmlid_cache(cr, xmlids=(), modules=(), model=None, ids=()):
+    """
+    Invalidate entries of the xml_id cache used by :func:`ref` and :func:`refs`.
+
+    To call after changing `ir_model_data` directly, when the cache is enabled.
+
+    :param list(str) xmlids: xml_ids to forget, under the format `module.name`
+    :param list(str) modules: modules whose xml_ids are forgotten
+    :param str model: model of the records whose xml_ids are forgotten
+    :param list(int) ids: ids of the records of `model` whose xml_ids are forgotten
+    """
+    _xmlid_cache.invalidate(cr, xmlids=xmlids, modules=modules, model=model, ids=ids)
+
+
 def remove_view(cr, xml_id=None, view_id=None, silent=False, key=None):
     """
     Remove a view and all its descendants.
@@ -371,6 +474,8 @@ def remove_record(cr, name):
     else:
         raise TypeError("Either use a fully qualified xmlid string <module>.<name> or a 2-tuple (<model>, <res_id>)")
 
+    _xmlid_cache.invalidate(cr, model=model, ids=[res_id])
+
     # deleguate to the right method
     if model == "ir.ui.view":
         _logger.log(NEARLYWARN, "Removing view %r", name)
@@ -392,6 +497,7 @@ def remove_records(cr, model, ids):
         return
 
     ids = tuple(ids)
+    _xmlid_cache.invalidate(cr, model=model, ids=ids)
 
     # remove theme model's copy_ids
     theme_copy_model = _get_theme_models().get(model)
@@ -427,40 +533,29 @@ def remove_records(cr, model, ids):
         cr,
         [cr.mogrify(base_query, [chunk_ids]).decode() for chunk_ids in chunks(ids, 1000, fmt=tuple)],
     )
+    ids_table = None
     for ir in indirect_references(cr, bound_only=True):
         if not ir.company_dependent_comodel:
             query = 'DELETE FROM "{}" WHERE {} AND "{}" IN %s'.format(ir.table, ir.model_filter(), ir.res_id)
             cr.execute(query, [model, ids])
         elif ir.company_dependent_comodel == model:
-            json_path = cr.mogrify(
-                "$.* ? ({})".format(" || ".join(["@ == %s"] * len(ids))),
-                ids,
-            ).decode()
-
-            query = cr.mogrify(
-                format_query(
-                    cr,
-                    """
-                    UPDATE {table}
-                       SET {column} = (
-                            SELECT jsonb_object_agg(
-                                key,
-                                CASE
-                                    WHEN value::int4 IN %s THEN NULL
-                                    ELSE value::int4
-                                END)
-                              FROM jsonb_each_text({column})
-                           )
-                     WHERE {column} IS NOT NULL
-                       AND {column} @? {json_path}
-                    """,
-                    table=ir.table,
-                    column=ir.res_id,
-                    json_path=sql.Literal(json_path),
-                ),
-                [ids],
-            ).decode()
-            explode_execute(cr, query, table=ir.table)
+            if ids_table is None:
+                ids_table = "_upgrade_remove_records_ids_" + uuid.uuid4().hex
+                cr.execute(
+                    format_query(
+                        cr,
+                        """
+                        CREATE UNLOGGED TABLE {0}(id int4 PRIMARY KEY);
+                        INSERT INTO {0}(id) SELECT DISTINCT unnest(%s::int4[]);
+                        ANALYZE {0};
+                        """,
+                        ids_table,
+                    ),
+                    [list(ids)],
+                )
+            _remove_company_dependent_values(cr, ir.table, ir.res_id, ids_table)
+    if ids_table is not None:
+        cr.execute(format_query(cr, "DROP TABLE {}", ids_table))
     _rm_refs(cr, model, ids)
 
     if model == "res.groups":
@@ -476,6 +571,53 @@ def remove_records(cr, model, ids):
         )
 
 
+def _remove_company_dependent_values(cr, table, column, ids_table):
+    """
+    Unset the values of a company-dependent column that are in `ids_table`.
+
+    The rows holding a removed id are found by joining the values of the column with the
+    table of the removed ids, which is linear in the number of rows. When the column has a
+    GIN index on `jsonb_path_query_array(<column>, '$.*')`, it is used instead, avoiding the
+    scan of the whole table. Such an index is not created here, as building it costs more
+    than a single scan; it only pays off when several removals target the same column.
+
+    :meta private: exclude from online docs
+    """
+    cr.execute(
+        """
+        SELECT 1
+          FROM pg_indexes
+         WHERE tablename = %s
+           AND indexdef ~ %s
+        """,
+        [table, r"USING gin \(jsonb_path_query_array\({}, '\$\.\*'::jsonpath\)\)$".format(re.escape(column))],
+    )
+    if cr.rowcount:
+        where = "jsonb_path_query_array(t.{column}, '$.*') @> ANY(ARRAY(SELECT jsonb_build_array(id) FROM {ids}))"
+    else:
+        where = "EXISTS(SELECT 1 FROM jsonb_each_text(t.{column}) e JOIN {ids} r ON r.id = e.value::int4)"
+    query = format_query(
+        cr,
+        """
+        UPDATE {table} t
+           SET {column} = (
+                SELECT jsonb_object_agg(e.key, CASE WHEN r.id IS NULL THEN e.value::int4 END)
+                  FROM jsonb_each_text(t.{column}) e
+             LEFT JOIN {ids} r
+                    ON r.id = e.value::int4
+               )
+         WHERE """
+        + where
+        + """
+           AND {{parallel_filter}}
+        """,
+        table=table,
+        column=column,
+        ids=ids_table,
+    )
+    explode_execute(cr, query, table=table, alias="t")
+
+
 def _rm_refs(cr, model, ids=None):
     if ids is None:
         match = "like %s"
@@ -486,33 +628,44 @@ def _rm_refs(cr, model, ids=None):
         match = "in %s"
         needle = tuple("{0},{1}".format(model, i) for i in ids)
 
-    # "model-comma" fields
+    # "model-comma" fields, grouped by model to scan each table once
     cr.execute(
         """
-        SELECT model, name
-          FROM ir_model_fields
-         WHERE ttype='reference'
-         UNION
-        SELECT 'ir.translation', 'name'
+        SELECT model, array_agg(name ORDER BY name)
+          FROM (
+                SELECT model, name
+                  FROM ir_model_fields
+                 WHERE ttype='reference'
+                 UNION
+                SELECT 'ir.translation', 'name'
+               ) f
+      GROUP BY model
     """
     )
 
-    for ref_model, ref_column in cr.fetchall():
+    for ref_model, ref_fields in cr.fetchall():
         table = table_of_model(cr, ref_model)
-        if column_updatable(cr, table, ref_column):
-            query_tail = ' FROM "{0}" WHERE "{1}" {2}'.format(table, ref_column, match)
-            if ref_model == "ir.ui.view":
-                cr.execute("SELECT id" + query_tail, [needle])
-                for (view_id,) in cr.fetchall():
-                    remove_view(cr, view_id=view_id, silent=True)
-            elif ref_model == "ir.ui.menu":
-                cr.execute("SELECT id" + query_tail, [needle])
-                menu_ids = tuple(m[0] for m in cr.fetchall())
-                remove_menus(cr, menu_ids)
-            else:
-                cr.execute("SELECT id" + query_tail, [needle])
-                for (record_id,) in cr.fetchall():
-                    remove_record(cr, (ref_model, record_id))
+        ref_columns = [column for column in ref_fields if column_updatable(cr, table, column)]
+        if not ref_columns:
+            continue
+        where = " OR ".join(format_query(cr, "{} " + match, column) for column in ref_columns)
+        cr.execute(
+            format_query(cr, "SELECT id FROM {} WHERE {}", table, SQLStr(where)),
+            [needle] * len(ref_columns),
+        )
+        record_ids = [record_id for (record_id,) in cr.fetchall()]
+        if not record_ids:
+            continue
+        if ref_model == "ir.ui.view":
+            for view_id in record_ids:
+                remove_view(cr, view_id=view_id, silent=True)
+        elif ref_model == "ir.ui.menu":
+            remove_menus(cr, tuple(record_ids))
+        elif ref_model == "res.groups":
+            for group_id in record_ids:
+                remove_group(cr, group_id=group_id)
+        else:
+            remove_records(cr, ref_model, record_ids)
 
     if table_exists(cr, "ir_values"):
         column, _ = _ir_values_value(cr)
@@ -768,6 +921,7 @@ def rename_xmlid(cr, old, new, noupdate=None, on_collision="fail"):
 
     old_module, _, old_name = old.partition(".")
     new_module, _, new_name = new.partition(".")
+    _xmlid_cache.invalidate(cr, xmlids=[old, new])
     cr.execute("SELECT model, res_id FROM ir_model_data WHERE module = %s AND name = %s", [new_module, new_name])
     new_model, new_id = cr.fetchone() or (None, None)
     cr.execute("SELECT model, res_id FROM ir_model_data WHERE module = %s AND name = %s", [old_module, old_name])
@@ -857,6 +1011,275 @@ def rename_xmlid(cr, old, new, noupdate=None, on_collision="fail"):
     return None
 
 
+def rename_xmlid_batch(cr, mapping, noupdate=None, on_collision="fail"):
+    """
+    Rename many :term:`external identifiers <external identifier>` (`xml_id`) at once.
+
+    Batch version of :func:`rename_xmlid`. Collisions are detected for all the xml_ids at
+    once, and all the renames are done with a single update. The keys of the renamed views
+    and the `t-call` and `t-name` references to them are updated in one pass over the
+    views.
+
+    .. example::
+       .. code-block:: python
+
+          util.rename_xmlid_batch(cr, {"sale.old_view": "sale.new_view", "sale.old_menu": "sale.new_menu"})
+
+    :param dict(str, str) mapping: new xml_id by current xml_id, both under the format
+                                   `module.name`. A new xml_id cannot also be renamed.
+    :param bool or None noupdate: value to set on the `noupdate` flag of the xml_ids,
+                                  ignored if `None`
+    :param str on_collision: how to proceed if a new xml_id already exists, the options
+                             are `merge` or `fail` (default), see :func:`rename_xmlid`
+    :return: the ID of the record referenced by each renamed *new* xml_id
+    :rtype: dict(str, int)
+    """
+    if on_collision not in {"fail", "merge"}:
+        raise ValueError("Invalid value for the `on_collision` argument: {0!r}".format(on_collision))
+    if not mapping:
+        return {}
+    for old, new in mapping.items():
+        if "." not in old or "." not in new:
+            raise ValueError("Please use fully qualified name <module>.<name>")
+        if old == new:
+            raise ValueError("Cannot rename an XMLID to itself")
+    if len(set(mapping.values())) != len(mapping):
+        raise ValueError("Cannot rename several XMLIDs to the same one")
+    chained = set(mapping) & set(mapping.values())
+    if chained:
+        raise ValueError("XMLIDs cannot be both renamed and renaming targets: {}".format(", ".join(sorted(chained))))
+
+    _xmlid_cache.invalidate(cr, xmlids=list(mapping) + list(mapping.values()))
+
+    table = "_upgrade_rename_xmlid_{}".format(uuid.uuid4().hex)
+    try:
+        renamed = _rename_xmlids(cr, table, mapping, noupdate, on_collision)
+    finally:
+        _drop_tables(cr, [table])
+
+    views = {old: (new, res_id) for old, new, model, res_id in renamed if model == "ir.ui.view"}
+    if views and column_exists(cr, "ir_ui_view", "key"):
+        execute_values(
+            cr,
+            """
+            UPDATE ir_ui_view v
+               SET key = m.new
+              FROM (VALUES %s) AS m(old, new, id)
+             WHERE v.id = m.id
+               AND v.key = m.old
+         RETURNING m.old, m.new
+            """,
+            [(old, new, res_id) for old, (new, res_id) in views.items()],
+            page_size=len(views),
+        )
+        # iff the key has been updated for a view, also update it for all other cowed views.
+        # Don't change the view keys unconditionally to avoid changing unrelated views.
+        keys = dict(cr.fetchall())
+        if keys:
+            execute_values(
+                cr,
+                "UPDATE ir_ui_view v SET key = m.new FROM (VALUES %s) AS m(old, new) WHERE v.key = m.old",
+                list(keys.items()),
+            )
+            _replace_tcalls(cr, keys)
+
+    menus = {old: new for old, new, model, _ in renamed if model == "ir.ui.menu"}
+    if menus and column_exists(cr, "res_users_settings", "homemenu_config"):
+        for chunk in chunks(menus, 1000, fmt=list):
+            pattern = r"\y({})\y".format("|".join(re.escape(old) for old in chunk))
+            cr.execute(
+                "SELECT id, homemenu_config::text FROM res_users_settings WHERE homemenu_config::text ~ %s", [pattern]
+            )
+            py_pattern = re.compile(r"\b({})\b".format("|".join(re.escape(old) for old in chunk)))
+            updates = [(id_, py_pattern.sub(lambda m: menus[m.group(1)], config)) for id_, config in cr.fetchall()]
+            if updates:
+                execute_values(
+                    cr,
+                    """
+                    UPDATE res_users_settings s
+                       SET homemenu_config = v.config::jsonb
+                      FROM (VALUES %s) AS v(id, config)
+                     WHERE s.id = v.id
+                    """,
+                    updates,
+                )
+
+    by_model = {}
+    for old, new, model, _ in renamed:
+        by_model.setdefault(model, {})[old] = new
+    for model, model_mapping in by_model.items():
+        for parent_model, inh in direct_inherit_parents(cr, model):
+            if inh.via:
+                parent = parent_model.replace(".", "_")
+                rename_xmlid_batch(
+                    cr,
+                    {"{}_{}".format(old, parent): "{}_{}".format(new, parent) for old, new in model_mapping.items()},
+                    noupdate=noupdate,
+                    on_collision=on_collision,
+                )
+
+    return {new: res_id for _, new, _, res_id in renamed}
+
+
+def _rename_xmlids(cr, table, mapping, noupdate, on_collision):
+    """
+    Rename the xml_ids of `mapping`, using `table` to store it, see :func:`rename_xmlid_batch`.
+
+    :return: the current and new xml_id, the model, and the record ID of each renamed xml_id
+    :rtype: list(tuple)
+
+    :meta private: exclude from online docs
+    """
+    cr.execute(
+        format_query(
+            cr,
+            """
+            CREATE TEMPORARY TABLE {}(
+                old_module varchar, old_name varchar, new_module varchar, new_name varchar,
+                PRIMARY KEY (old_module, old_name)
+            )
+            """,
+            table,
+        )
+    )
+    execute_values(
+        cr,
+        format_query(cr, "INSERT INTO {} VALUES %s", table),
+        [old.split(".", 1) + new.split(".", 1) for old, new in mapping.items()],
+    )
+
+    cr.execute(
+        format_query(
+            cr,
+            """
+            SELECT m.old_module || '.' || m.old_name,
+                   m.new_module || '.' || m.new_name,
+                   o.model, o.res_id, n.model, n.res_id
+              FROM {} m
+              JOIN ir_model_data o
+                ON o.module = m.old_module
+               AND o.name = m.old_name
+              JOIN ir_model_data n
+                ON n.module = m.new_module
+               AND n.name = m.new_name
+            """,
+            table,
+        )
+    )
+    collisions = cr.fetchall()
+    conflicts = [c for c in collisions if (c[2], c[3]) != (c[4], c[5])]
+    mismatches = [c for c in conflicts if c[2] != c[4]]
+    if conflicts and on_collision == "fail":
+        raise MigrationError(
+            "Can't rename the following xmlids as the new ones already exist:\n"
+            + "\n".join(" - {} -> {}".format(old, new) for old, new, _, _, _, _ in conflicts)
+        )
+    if mismatches:
+        raise MigrationError(
+            "Model mismatch while renaming xmlids:\n"
+            + "\n".join(" - {} ({}) -> {} ({})".format(old, om, new, nm) for old, new, om, _, nm, _ in mismatches)
+        )
+
+    id_mappings = {}
+    for _, _, model, old_id, _, new_id in conflicts:
+        id_mappings.setdefault(model, {})[old_id] = new_id
+    for model, id_mapping in id_mappings.items():
+        replace_record_references_batch(cr, id_mapping, model, replace_xmlid=False)
+
+    renamed = [(old, new, model, new_id) for old, new, _, _, model, new_id in collisions]
+    if collisions:
+        collided = [new for _, new, _, _, _, _ in collisions]
+        if noupdate is not None:
+            for new in collided:
+                force_noupdate(cr, new, bool(noupdate))
+        cr.execute(
+            format_query(
+                cr,
+                """
+                DELETE FROM ir_model_data d
+                      USING {} m
+                      WHERE d.module = m.old_module
+                        AND d.name = m.old_name
+                        AND m.new_module || '.' || m.new_name IN %s
+                """,
+                table,
+            ),
+            [tuple(collided)],
+        )
+
+    cr.execute(
+        format_query(
+            cr,
+            """
+            UPDATE ir_model_data d
+               SET module = m.new_module,
+                   name = m.new_name
+                   {}
+              FROM {} m
+             WHERE d.module = m.old_module
+               AND d.name = m.old_name
+         RETURNING m.old_module || '.' || m.old_name, m.new_module || '.' || m.new_name, d.model, d.res_id
+            """,
+            SQLStr("") if noupdate is None else SQLStr(", noupdate = " + str(bool(noupdate)).lower()),
+            table,
+        )
+    )
+    renamed += cr.fetchall()
+    return renamed
+
+
+def _replace_tcalls(cr, keys):
+    """
+    Replace the `t-call` and `t-name` references to views keys in all views archs.
+
+    :param dict(str, str) keys: new key by old key
+
+    :meta private: exclude from online docs
+    """
+    arch_col = "arch_db" if column_exists(cr, "ir_ui_view", "arch_db") else "arch"
+    jsonb_column = column_type(cr, "ir_ui_view", arch_col) == "jsonb"
+    for chunk in chunks(keys, 1000, fmt=list):
+        alternatives = "|".join(re.escape(old) for old in chunk)
+        search_pattern = r"""\yt-(call|name)=(["'])({})\2""".format(alternatives)
+        py_pattern = re.compile(r"""\bt-(call|name)=(["'])({})\2""".format(alternatives))
+
+        def replace(match):
+            return "t-{0}={1}{2}{1}".format(match.group(1), match.group(2), keys[match.group(3)])
+
+        if jsonb_column:
+            cr.execute(
+                format_query(
+                    cr,
+                    "SELECT id, {arch} FROM ir_ui_view WHERE jsonb_path_match({arch}, 'exists($.* ? (@ like_regex {match}))')",
+                    arch=arch_col,
+                    match=SQLStr(str(Json(search_pattern))[1:-1]),
+                )
+            )
+            updates = [
+                (view_id, Json({lang: py_pattern.sub(replace, value) for lang, value in arch.items()}))
+                for view_id, arch in cr.fetchall()
+            ]
+            template = "(%s, %s::jsonb)"
+        else:
+            cr.execute(
+                format_query(cr, "SELECT id, {arch} FROM ir_ui_view WHERE {arch} ~ %s", arch=arch_col),
+                [search_pattern],
+            )
+            updates = [(view_id, py_pattern.sub(replace, arch)) for view_id, arch in cr.fetchall()]
+            template = None
+        if updates:
+            execute_values(
+                cr,
+                format_query(
+                    cr,
+                    "UPDATE ir_ui_view v SET {arch} = u.arch FROM (VALUES %s) AS u(id, arch) WHERE v.id = u.id",
+                    arch=arch_col,
+                ),
+                updates,
+                template=template,
+            )
+
+
 def _refs(cr, *xmlids):
     if not xmlids:
         return {}
@@ -865,6 +1288,20 @@ def _refs(cr, *xmlids):
         if "." not in xmlid:
             raise ValueError("Please use fully qualified name <module>.<name>")
 
+    result = {}
+    if _xmlid_cache.size:
+        missing = []
+        for xmlid in xmlids:
+            cached = _xmlid_cache.get(cr, xmlid)
+            if cached is None:
+                missing.append(xmlid)
+            else:
+                result[xmlid] = cached[1]
+        if not missing:
+            _xmlid_cache.stats["saved_queries"] += 1
+            return result
+        xmlids = missing
+
     pairs = list(map(list, zip(*(xmlid.split(".", 1) for xmlid in xmlids))))
 
     cr.execute(
@@ -874,7 +1311,8 @@ def _refs(cr, *xmlids):
                    unnest(%s::text[]) AS name
         )
         SELECT xmlids.module || '.' || xmlids.name,
-               res_id
+               imd.model,
+               imd.res_id
           FROM xmlids
      LEFT JOIN ir_model_data imd
             ON imd.module = xmlids.module
@@ -882,7 +1320,12 @@ def _refs(cr, *xmlids):
         """,
         pairs,
     )
-    return dict(cr.fetchall())
+    _xmlid_cache.stats["queries"] += 1
+    for xmlid, model, res_id in cr.fetchall():
+        result[xmlid] = res_id
+        if res_id is not None:
+            _xmlid_cache.set(cr, xmlid, model, res_id)
+    return result
 
 
 def ref(cr, xmlid):
@@ -896,17 +1339,46 @@ def ref(cr, xmlid):
     return _refs(cr, xmlid)[xmlid]
 
 
-def refs(cr, xmlids, strict=False):
+def refs(cr, xmlids=None, strict=False, module=None):
     """
     Return a mapping of xmlid -> res_id for the given list of xmlids.
 
-    :param list xmlids: list of fully qualified xml_ids, each under the format `module.name`
+    When `module` is set, all the xml_ids of the module are fetched at once, and also
+    stored in the xml_id cache if enabled --see :func:`xmlid_cache_stats`. This allows to
+    prefetch the xml_ids of a module before resolving them one by one with :func:`ref`.
+
+    .. example::
+       .. code-block:: python
+
+          util.refs(cr, module="account")  # one query
+          for xmlid in xmlids:
+              res_id = util.ref(cr, xmlid)  # no query, if the cache is enabled and big enough
+
+    :param list xmlids: list of fully qualified xml_ids, each under the format `module.name`,
+                        defaults to all the xml_ids of `module` when `module` is set
     :param bool strict: if ``True``, only include xmlids that exist in the database.
+    :param str module: optional, module to fetch all the xml_ids of
     :return: dict mapping each xmlid to its res_id; missing xmlids map to ``None`` unless
              ``strict=True``, in which case they are omitted from the result.
     :rtype: dict
     """
-    result = _refs(cr, *xmlids)
+    if module is not None:
+        cr.execute("SELECT name, model, res_id FROM ir_model_data WHERE module = %s", [module])
+        _xmlid_cache.stats["queries"] += 1
+        module_refs = {}
+        for name, model, res_id in cr.fetchall():
+            xmlid = "{}.{}".format(module, name)
+            module_refs[xmlid] = res_id
+            _xmlid_cache.set(cr, xmlid, model, res_id)
+        if xmlids is None:
+            return module_refs
+        # xml_ids of other modules are still resolved via the database
+        result = _refs(cr, *[xmlid for xmlid in xmlids if xmlid not in module_refs])
+        result.update((xmlid, module_refs[xmlid]) for xmlid in xmlids if xmlid in module_refs)
+    elif xmlids is None:
+        raise TypeError("refs() requires either `xmlids` or `module`")
+    else:
+        result = _refs(cr, *xmlids)
     if strict:
         return {xmlid: res_id for xmlid, res_id in result.items() if res_id is not None}
     return result
@@ -973,6 +1445,7 @@ def ensure_xmlid_match_record(cr, xmlid, model, values):
         raise ValueError("Please use fully qualified name <module>.<name>")
 
     logger = _logger.getChild("ensure_xmlid_match_record")
+    _xmlid_cache.invalidate(cr, xmlids=[xmlid])
 
     module, _, name = xmlid.partition(".")
     cr.execute(
@@ -1080,12 +1553,15 @@ def update_record_from_xml(
        its xml_id. That will happen on this function as well, unless `force_create` is set
        to `False`.
     """
-    __update_record_from_xml(
+    if "." not in xmlid:
+        raise ValueError("Please use fully qualified name <module>.<name>")
+
+    __update_records_from_xml(
         cr,
-        xmlid,
+        [xmlid],
         reset_write_metadata=reset_write_metadata,
         force_create=force_create,
-        from_module=from_module,
+        from_module=from_module or xmlid.partition(".")[0],
         reset_translations=reset_translations,
         ensure_references=ensure_references,
         fields=fields,
@@ -1093,9 +1569,89 @@ def update_record_from_xml(
     )
 
 
-def __update_record_from_xml(
+def update_records_from_xml(
     cr,
-    xmlid,
+    xmlids,
+    reset_write_metadata=True,
+    force_create=AUTOMATIC,
+    from_module=None,
+    reset_translations=(),
+    ensure_references=False,
+    fields=None,
+):
+    """
+    Update records based on their definition in the :doc:`/developer/reference/backend/data`.
+
+    Batch version of :func:`update_record_from_xml`. The xml_ids are grouped by the module
+    in which their definition is searched, and the data files of each module are parsed
+    only once for all of them. The records defined in the same data file are updated
+    together, in the order they are defined in the file.
+
+    .. example::
+       .. code-block:: python
+
+          util.update_records_from_xml(cr, ["sale.view_order_form", "sale.view_order_tree"])
+
+    :param list(str) xmlids: records xml_ids, under the format `module.name`
+
+    See :func:`update_record_from_xml` for the other parameters, they apply to all the
+    records.
+    """
+    by_module = OrderedDict()
+    for xmlid in xmlids:
+        if "." not in xmlid:
+            raise ValueError("Please use fully qualified name <module>.<name>")
+        by_module.setdefault(from_module or xmlid.partition(".")[0], []).append(xmlid)
+
+    done_refs = set()
+    for module, module_xmlids in by_module.items():
+        __update_records_from_xml(
+            cr,
+            module_xmlids,
+            reset_write_metadata=reset_write_metadata,
+            force_create=force_create,
+            from_module=module,
+            reset_translations=reset_translations,
+            ensure_references=ensure_references,
+            fields=fields,
+            done_refs=done_refs,
+        )
+
+
+def _xml_data_index(module):
+    """
+    Index the records defined in the XML data files of a module by xml_id.
+
+    Return a dict mapping the fully qualified xml_ids to the list of their definitions, as
+    `(position, filename, node)` tuples. The position is the order of the definition in
+    the data files of the manifest.
+
+    :meta private: exclude from online docs
+    """
+    from .modules import get_manifest  # noqa: PLC0415
+
+    index = {}
+    position = 0
+    for f in get_manifest(module).get("data", []):
+        if not f.endswith(".xml"):
+            continue
+        xml_filename = "{}/{}".format(module, f)
+        with file_open(os.path.join(module, f)) as fp:
+            doc = lxml.etree.parse(fp)
+        for node in doc.xpath(
+            "//*[self::act_window or self::menuitem or self::record or self::report or self::template][@id]"
+        ):
+            xmlid = node.get("id")
+            if "." not in xmlid:
+                xmlid = "{}.{}".format(module, xmlid)
+            index.setdefault(xmlid, []).append((position, xml_filename, node))
+            position += 1
+    return index
+
+
+def __update_records_from_xml(
+    cr,
+    xmlids,
     reset_write_metadata,
     force_create,
     from_module,
@@ -1103,60 +1659,73 @@ def __update_record_from_xml(
     ensure_references,
     fields,
     done_refs,
+    index=None,
 ):
-    from .modules import get_manifest  # noqa: PLC0415
-
-    if "." not in xmlid:
-        raise ValueError("Please use fully qualified name <module>.<name>")
-
     if force_create is AUTOMATIC:
         force_create = fields is None  # don't force record creation if we are filtering fields
 
-    module, _, name = xmlid.partition(".")
-
+    xmlids = list(OrderedDict.fromkeys(xmlids))
+    # the records can be recreated by the update
+    _xmlid_cache.invalidate(cr, xmlids=xmlids)
     cr.execute(
         """
+        WITH xmlids AS (
+            SELECT unnest(%s::text[]) AS module,
+                   unnest(%s::text[]) AS name
+        )
         UPDATE ir_model_data d
            SET noupdate = false
           FROM ir_model_data o
+          JOIN xmlids x
+            ON x.module = o.module
+           AND x.name = o.name
          WHERE o.id = d.id
-           AND d.module = %s
-           AND d.name = %s
-     RETURNING d.model, d.res_id, o.noupdate
+     RETURNING d.module || '.' || d.name, d.model, d.res_id, o.noupdate
     """,
-        [module, name],
+        list(map(list, zip(*(xmlid.split(".", 1) for xmlid in xmlids)))),
     )
-    if cr.rowcount:
-        model, res_id, noupdate = cr.fetchone()
-        if model == "ir.model":
-            return
-    elif not force_create:
-        _logger.warning("Record %r not found in database. Skip update.", xmlid)
-        return
-    else:
-        # The xmlid doesn't already exists, nothing to reset
-        reset_write_metadata = noupdate = reset_translations = False
-        fields = None
+    existing = {xmlid: (model, res_id, noupdate) for xmlid, model, res_id, noupdate in cr.fetchall()}
 
-    write_data = None
-    if reset_write_metadata:
-        table = table_of_model(cr, model)
-        cr.execute("SELECT write_uid, write_date, id FROM {} WHERE id=%s".format(table), [res_id])
-        write_data = cr.fetchone()
+    records = OrderedDict()
+    for xmlid in xmlids:
+        if xmlid in existing:
+            model, res_id, noupdate = existing[xmlid]
+            if model == "ir.model":
+                continue
+            record = {
+                "model": model,
+                "res_id": res_id,
+                "noupdate": noupdate,
+                "reset_write_metadata": reset_write_metadata,
+                "reset_translations": reset_translations,
+                "fields": fields,
+            }
+        elif not force_create:
+            _logger.warning("Record %r not found in database. Skip update.", xmlid)
+            continue
+        else:
+            # The xmlid doesn't already exists, nothing to reset
+            record = {
+                "noupdate": False,
+                "reset_write_metadata": False,
+                "reset_translations": False,
+                "fields": None,
+            }
+        record.update(write_data=None, template=False, nodes=[])
+        records[xmlid] = record
+
+        if record["reset_write_metadata"]:
+            record["table"] = table_of_model(cr, record["model"])
+            cr.execute("SELECT write_uid, write_date, id FROM {} WHERE id=%s".format(record["table"]), [res_id])
+            record["write_data"] = cr.fetchone()
 
-    from_module = from_module or module
+    if not records:
+        return
 
-    id_match = (
-        "@id='{module}.{name}' or @id='{name}'".format(module=module, name=name)
-        if module == from_module
-        else "@id='{module}.{name}'".format(module=module, name=name)
-    )
-    xpath = "//*[self::act_window or self::menuitem or self::record or self::report or self::template][{}]".format(id_match)  # fmt: skip
+    if index is None:
+        index = _xml_data_index(from_module)
 
-    roots = OrderedDict()
-    manifest = get_manifest(from_module)
-    template = False
-    found = False
+    nodes_by_file = {}
     extra_references = []
 
     def add_ref(ref):
@@ -1165,61 +1734,61 @@ def __update_record_from_xml(
         elif ref.split(".")[0] == from_module:
             extra_references.append(ref)
 
-    for f in manifest.get("data", []):
-        if not f.endswith(".xml"):
+    not_found = []
+    for xmlid, record in records.items():
+        if xmlid not in index:
+            not_found.append(xmlid)
             continue
-        with file_open(os.path.join(from_module, f)) as fp:
-            doc = lxml.etree.parse(fp)
-            for node in doc.xpath(xpath):
-                found = True
-                xml_filename = "{}/{}".format(from_module, f)
-                root = roots.get(xml_filename)
-                if root is None:
-                    # use a data tag inside openerp tag to be compatible with all supported versions
-                    root = roots[xml_filename] = lxml.etree.fromstring("<openerp><data/></openerp>")
-                parent = node.getparent()
-                if node.tag == "record" and fields is not None:
-                    for fn in node.xpath("./field[@name]"):
-                        if fn.attrib["name"] not in fields:
-                            node.remove(fn)
-                root[0].append(node)
-
-                if node.tag == "menuitem" and parent.tag == "menuitem" and "parent_id" not in node.attrib:
-                    root[0].append(
-                        lxml.builder.E.record(
-                            lxml.builder.E.field(name="parent_id", ref=parent.attrib["id"]),
-                            model="ir.ui.menu",
-                            id=node.attrib["id"],
-                        )
+        for position, xml_filename, orig_node in index[xmlid]:
+            # the index is kept intact, for the referenced records
+            node = copy.deepcopy(orig_node)
+            parent = orig_node.getparent()
+            if node.tag == "record" and record["fields"] is not None:
+                for fn in node.xpath("./field[@name]"):
+                    if fn.attrib["name"] not in record["fields"]:
+                        node.remove(fn)
+            nodes = [node]
+
+            if node.tag == "menuitem" and parent.tag == "menuitem" and "parent_id" not in node.attrib:
+                nodes.append(
+                    lxml.builder.E.record(
+                        lxml.builder.E.field(name="parent_id", ref=parent.attrib["id"]),
+                        model="ir.ui.menu",
+                        id=node.attrib["id"],
                     )
+                )
+            nodes_by_file.setdefault(xml_filename, []).append((position, nodes))
+            record["nodes"].extend(nodes)
+
+            if node.tag == "template":
+                record["template"] = True
+            if ensure_references:
+                for ref_node in (r for n in nodes for r in n.xpath("descendant-or-self::field[@ref]")):
+                    if record["fields"] is not None and ref_node.attrib["name"] not in record["fields"]:
+                        continue
+                    add_ref(ref_node.get("ref"))
+                for eval_node in (e for n in nodes for e in n.xpath("descendant-or-self::field[@eval]")):
+                    if record["fields"] is not None and eval_node.attrib["name"] not in record["fields"]:
+                        continue
+                    for ref_match in re.finditer(r"\bref\((['\"])(.*?)\1\)", eval_node.get("eval")):
+                        add_ref(ref_match.group(2))
+
+    if not_found:
+        for xmlid, record in records.items():
+            if record["noupdate"]:
+                force_noupdate(cr, xmlid, noupdate=True)
+        suffix = (
+            " in %r module" % from_module if any(xmlid.partition(".")[0] != from_module for xmlid in not_found) else ""
+        )
+        raise ValueError("Cannot find %s%s" % (", ".join(map(repr, not_found)), suffix))
 
-                if node.tag == "template":
-                    template = True
-                if ensure_references:
-                    for ref_node in node.xpath("//field[@ref]"):
-                        if fields is not None and ref_node.attrib["name"] not in fields:
-                            continue
-                        add_ref(ref_node.get("ref"))
-                    for eval_node in node.xpath("//field[@eval]"):
-                        if fields is not None and eval_node.attrib["name"] not in fields:
-                            continue
-                        for ref_match in re.finditer(r"\bref\((['\"])(.*?)\1\)", eval_node.get("eval")):
-                            add_ref(ref_match.group(2))
-
-    if not found:
-        if noupdate:
-            force_noupdate(cr, xmlid, noupdate=True)
-        suffix = " in %r module" % from_module if from_module != module else ""
-        raise ValueError("Cannot find %r%s" % (xmlid, suffix))
-
-    done_refs.add(xmlid)
-    for ref in extra_references:
-        if ref in done_refs:
-            continue
-        _logger.info("Update of %s - ensuring the reference %s exists", xmlid, ref)
-        __update_record_from_xml(
+    done_refs.update(records)
+    refs = [ref for ref in OrderedDict.fromkeys(extra_references) if ref not in done_refs]
+    if refs:
+        _logger.info("Update of %s - ensuring the references %s exist", ", ".join(records), ", ".join(refs))
+        __update_records_from_xml(
             cr,
-            ref,
+            refs,
             reset_write_metadata=reset_write_metadata,
             force_create=True,
             from_module=from_module,
@@ -1227,11 +1796,17 @@ def __update_record_from_xml(
             ensure_references=True,
             fields=None,
             done_refs=done_refs,
+            index=index,
         )
 
     cr_or_env = env(cr) if version_gte("saas~16.2") else cr
     parse_kw = {"mode": "update"} if version_between("8.0", "12.0") else {}
-    for xml_filename, root in roots.items():
+    # load the files in the order of the manifest, and the records in the order of the files
+    for xml_filename, file_nodes in sorted(nodes_by_file.items(), key=lambda item: min(item[1])[0]):
+        # use a data tag inside openerp tag to be compatible with all supported versions
+        root = lxml.etree.fromstring("<openerp><data/></openerp>")
+        for _, nodes in sorted(file_nodes, key=itemgetter(0)):
+            root[0].extend(nodes)
         kw = {"xml_filename": xml_filename} if version_gte("8.saas~6") else {}
         importer = xml_import(cr_or_env, from_module, idref={}, mode="update", **kw)
         importer.parse(root, **parse_kw)
@@ -1239,55 +1814,19 @@ def __update_record_from_xml(
     if version_gte("13.0"):
         flush(env(cr)["base"])
 
-    if noupdate:
-        force_noupdate(cr, xmlid, noupdate=True)
-    if reset_write_metadata and write_data:
-        cr.execute("UPDATE {} SET write_uid=%s, write_date=%s WHERE id=%s".format(table), write_data)
-
-    if reset_translations:
-        if reset_translations is True:
-            if fields is None:
-                fields_with_values_from_xml = {elem.attrib["name"] for elem in node.xpath("//record/field")}
-                if template:
-                    fields_with_values_from_xml |= {"arch_db", "name"}
-            else:
-                fields_with_values_from_xml = fields
-            if version_gte("saas~18.5"):  # translate is varchar
-                sql_code = "SELECT name FROM ir_model_fields WHERE model = %s AND translate IS NOT NULL AND name IN %s"
-            else:  # translate is boolean
-                sql_code = "SELECT name FROM ir_model_fields WHERE model = %s AND translate = true AND name IN %s"
+    update_translations = False
+    for xmlid, record in records.items():
+        if record["noupdate"]:
+            force_noupdate(cr, xmlid, noupdate=True)
+        if record["reset_write_metadata"] and record["write_data"]:
             cr.execute(
-                sql_code,
-                [model, tuple(fields_with_values_from_xml)],
+                "UPDATE {} SET write_uid=%s, write_date=%s WHERE id=%s".format(record["table"]), record["write_data"]
             )
-            reset_translations = [fname for [fname] in cr.fetchall()]
-
-        if table_exists(cr, "ir_translation"):
-            cr.execute(
-                """
-                    DELETE FROM ir_translation
-                          WHERE name IN %s
-                            AND res_id = %s
-                """,
-                [tuple("{},{}".format(model, f) for f in reset_translations), res_id],
-            )
-        else:
-            query = """
-                UPDATE {}
-                   SET {}
-                 WHERE id = %s
-            """.format(
-                table,
-                ",".join(
-                    [
-                        """%s = NULLIF(jsonb_build_object('en_US', %s->>'en_US'), '{"en_US": null}'::jsonb)"""
-                        % (fname, fname)
-                        for fname in reset_translations
-                    ]
-                ),
-            )
-            cr.execute(query, [res_id])
+        if record["reset_translations"]:
+            _reset_translations_from_xml(cr, record)
+            update_translations = True
 
+    if update_translations:
         env_ = env(cr)
         module_to_reload_from = env_["ir.module.module"].search(
             [("name", "=", from_module), ("state", "=", "installed")]
@@ -1300,6 +1839,61 @@ def __update_record_from_xml(
                 module_to_reload_from.update_translations()
 
 
+def _reset_translations_from_xml(cr, record):
+    model, res_id, fields, reset_translations = (
+        record["model"],
+        record["res_id"],
+        record["fields"],
+        record["reset_translations"],
+    )
+    if reset_translations is True:
+        if fields is None:
+            fields_with_values_from_xml = {
+                elem.attrib["name"]
+                for node in record["nodes"]
+                for elem in node.xpath("descendant-or-self::record/field")
+            }
+            if record["template"]:
+                fields_with_values_from_xml |= {"arch_db", "name"}
+        else:
+            fields_with_values_from_xml = fields
+        if version_gte("saas~18.5"):  # translate is varchar
+            sql_code = "SELECT name FROM ir_model_fields WHERE model = %s AND translate IS NOT NULL AND name IN %s"
+        else:  # translate is boolean
+            sql_code = "SELECT name FROM ir_model_fields WHERE model = %s AND translate = true AND name IN %s"
+        cr.execute(
+            sql_code,
+            [model, tuple(fields_with_values_from_xml)],
+        )
+        reset_translations = [fname for [fname] in cr.fetchall()]
+
+    if table_exists(cr, "ir_translation"):
+        cr.execute(
+            """
+                DELETE FROM ir_translation
+                      WHERE name IN %s
+                        AND res_id = %s
+            """,
+            [tuple("{},{}".format(model, f) for f in reset_translations), res_id],
+        )
+    else:
+        query = """
+            UPDATE {}
+               SET {}
+             WHERE id = %s
+        """.format(
+            table_of_model(cr, model),
+            ",".join(
+                [
+                    """%s = NULLIF(jsonb_build_object('en_US', %s->>'en_US'), '{"en_US": null}'::jsonb)"""
+                    % (fname, fname)
+                    for fname in reset_translations
+                ]
+            ),
+        )
+        cr.execute(query, [res_id])
+
+
 def delete_unused(cr, *xmlids, **kwargs):
     """
     Remove unused records.
@@ -1399,35 +1993,20 @@ def delete_unused(cr, *xmlids, **kwargs):
 
         m2m_tables = include_m2m if include_m2m != "*" else get_m2m_tables(cr, table)
 
-        sub = " UNION ALL ".join(
-            [
-                format_query(cr, "SELECT 1 FROM {} x WHERE x.{} = ANY(s.children)", fk_tbl, fk_col)
-                for fk_tbl, fk_col, _, fk_act in get_fk(cr, table, quote_ident=False)
-                # ignore "on delete cascade" fk (they are indirect dependencies (lines or m2m))
-                if (fk_act != "c" or fk_tbl in m2m_tables)
-                # ignore children records unless the deletion is restricted
-                if not (fk_tbl == table and fk_act != "r")
-            ]
-        )
-        if sub:
-            query = format_query(
-                cr,
-                r"""
-                WITH _kids AS (
-                    {}
-                )
-                SELECT t.id
-                  FROM {} t
-                  JOIN _kids s
-                    ON s.id = t.id
-                 WHERE NOT EXISTS({})
-                """,
-                kids_query,
-                table,
-                sql.SQL(sub),
-            )
-            cr.execute(query, {"ids": list(ids)})
-            sub_ids = list(map(itemgetter(0), cr.fetchall()))
+        fks = [
+            (fk_tbl, fk_col)
+            for fk_tbl, fk_col, _, fk_act in get_fk(cr, table, quote_ident=False)
+            # ignore "on delete cascade" fk (they are indirect dependencies (lines or m2m))
+            if (fk_act != "c" or fk_tbl in m2m_tables)
+            # ignore children records unless the deletion is restricted
+            if not (fk_tbl == table and fk_act != "r")
+        ]
+        if fks:
+            references = _get_referencing_columns(cr, kids_query, ids, fks)
+            sub_ids = [id_ for id_, columns in references.items() if not columns]
+            referenced = {id_: columns for id_, columns in references.items() if columns}
+            if referenced:
+                _report_kept_records(cr, model, referenced, res_id_to_xmlid)
         else:
             sub_ids = list(ids)
 
@@ -1462,10 +2041,103 @@ def delete_unused(cr, *xmlids, **kwargs):
                AND d.name = x.name
         """
         cr.execute(query.format(select_xids))
+    _xmlid_cache.invalidate(cr, xmlids=xmlids)
 
     return deleted
 
 
+def _get_referencing_columns(cr, kids_query, ids, fks):
+    """
+    Return the columns still referencing the given records or their children.
+
+    Each referencing column is checked by its own `EXISTS` condition, all of them in a
+    single query.
+
+    :param str kids_query: query returning the records `id` and their `children` ids
+    :param list(int) ids: ids of the records, for the `kids_query`
+    :param list(tuple(str, str)) fks: referencing columns, as `(table, column)` pairs
+    :return: the referencing columns, as `table.column`, by id of existing record; empty
+             for unreferenced records
+    :rtype: dict(int, list(str))
+
+    :meta private: exclude from online docs
+    """
+    checks = [
+        format_query(
+            cr,
+            "SELECT DISTINCT k.id, {} FROM kids k WHERE EXISTS(SELECT 1 FROM {} x WHERE x.{} = k.child)",
+            sql.Literal("{}.{}".format(fk_table, fk_column)),
+            fk_table,
+            fk_column,
+        )
+        for fk_table, fk_column in fks
+    ]
+    # `kids` is used several times, it is only computed once
+    cr.execute(
+        format_query(
+            cr,
+            """
+            WITH kids AS (
+                SELECT k.id, unnest(k.children) AS child
+                  FROM ({kids_query}) k
+            )
+            SELECT k.id, array_remove(array_agg(DISTINCT r.ref), NULL)
+              FROM (SELECT DISTINCT id FROM kids) k
+         LEFT JOIN ({checks}) r(id, ref)
+                ON r.id = k.id
+          GROUP BY k.id
+            """,
+            kids_query=SQLStr(kids_query),
+            checks=SQLStr(" UNION ALL ".join(checks)),
+        ),
+        {"ids": list(ids)},
+    )
+    return dict(cr.fetchall())
+
+
+def _report_kept_records(cr, model, referenced, res_id_to_xmlid, limit=20):
+    """
+    Report the records that `delete_unused` could not remove, and what references them.
+
+    :meta private: exclude from online docs
+    """
+    by_column = {}
+    for columns in referenced.values():
+        for column in columns:
+            by_column[column] = by_column.get(column, 0) + 1
+    _logger.info(
+        "%s unused %s records kept because still referenced by: %s",
+        len(referenced),
+        model,
+        ", ".join("{} ({})".format(column, count) for column, count in sorted(by_column.items())),
+    )
+
+    kept = sorted(referenced.items())
+    add_to_migration_reports(
+        """
+            <details>
+            <summary>
+                The following records of model {model} were not removed, as they are still referenced.{disclaimer}
+            </summary>
+              <ul>{li}</ul>
+            </details>
+        """.format(
+            model=html_escape(model),
+            disclaimer=" Find below a list of the first {} (out of {}) kept records.".format(limit, len(kept))
+            if len(kept) > limit
+            else "",
+            li="".join(
+                "<li>{} (#{}): referenced from {}</li>".format(
+                    html_escape(res_id_to_xmlid.get(id_, "")), id_, html_escape(", ".join(columns))
+                )
+                for id_, columns in kept[:limit]
+            ),
+        ),
+        format="html",
+        category="Unused records",
+    )
+
+
 def replace_record_references(cr, old, new, replace_xmlid=True, parent_field="parent_id"):
     """
     Replace all (in)direct references of a record by another.
@@ -2000,10 +2672,21 @@ def _remove_redundant_tcalls(cr, match):
             )
 
 
-def update_parent_path(cr, model, parent_field="parent_id"):
+def update_parent_path(cr, model, parent_field="parent_id", parallel=False):
     """
     Trigger the update of parent paths in a model.
 
+    By default the paths are computed by a single recursive query. With `parallel`, they
+    are computed level by level into staging tables, each level being split in buckets of
+    parents processed in parallel, so all the trees of the forest progress together. The
+    rows whose path changed are then updated by buckets of ids, also in parallel. This is
+    meant for huge hierarchies, like locations or analytic accounts.
+
+    :param str model: model to update
+    :param str parent_field: field holding the parent of the records
+    :param bool parallel: whether to compute and update the paths in parallel. As a side
+                          effect, the cursor is committed.
+
     :meta private: exclude from online docs
     """
     if not version_gte("saas~11.3"):
@@ -2012,6 +2695,9 @@ def update_parent_path(cr, model, parent_field="parent_id"):
     table = table_of_model(cr, model)
     name_field = "name" if column_exists(cr, table, "name") else "id"
     break_recursive_loops(cr, model, parent_field, name_field)
+    if parallel:
+        _update_parent_path_parallel(cr, table, parent_field)
+        return
     query = format_query(
         cr,
         """
@@ -2039,3 +2725,91 @@ def update_parent_path(cr, model, parent_field="parent_id"):
         parent_field=parent_field,
     )
     cr.execute(query)
+
+
+def _update_parent_path_parallel(cr, table, parent_field):
+    # one staging table per level, so each level is only split over the ids of its own rows
+    prefix = "_upgrade_parent_path_{}_".format(uuid.uuid4().hex)
+    stages = []
+
+    def new_stage():
+        stage = prefix + str(len(stages))
+        cr.execute(
+            format_query(cr, "CREATE UNLOGGED TABLE {}(id int4 PRIMARY KEY, parent_path varchar NOT NULL)", stage)
+        )
+        stages.append(stage)
+        return stage
+
+    def execute_on_stage(query, stage, qualifier):
+        cr.execute(format_query(cr, "SELECT count(*), min(id), max(id) FROM {}", stage))
+        count, min_id, max_id = cr.fetchone()
+        if not count:
+            return 0
+        # the ids of a level can be sparse, size the buckets to hold about `DEFAULT_BUCKET_SIZE` of them
+        buckets = -(-count // DEFAULT_BUCKET_SIZE)
+        bucket_size = -(-(max_id - min_id + 1) // buckets)
+        return explode_execute(cr, query, table=stage, alias="s", bucket_size=bucket_size, qualifier=qualifier)
+
+    try:
+        stage = new_stage()
+        explode_execute(
+            cr,
+            format_query(
+                cr,
+                """
+                INSERT INTO {stage}(id, parent_path)
+                     SELECT r.id, concat(r.id, '/')
+                       FROM {table} r
+                      WHERE r.{parent_field} IS NULL
+                """,
+                stage=stage,
+                table=table,
+                parent_field=parent_field,
+            ),
+            table=table,
+            alias="r",
+        )
+        while True:
+            parents = stage
+            cr.execute(format_query(cr, "ANALYZE {}", parents))
+            stage = new_stage()
+            count = execute_on_stage(
+                format_query(
+                    cr,
+                    """
+                    INSERT INTO {stage}(id, parent_path)
+                         SELECT r.id, concat(s.parent_path, r.id, '/')
+                           FROM {parents} s
+                           JOIN {table} r
+                             ON r.{parent_field} = s.id
+                    """,
+                    stage=stage,
+                    parents=parents,
+                    table=table,
+                    parent_field=parent_field,
+                ),
+                parents,
+                qualifier="level {} parents".format(len(stages) - 2),
+            )
+            if not count:
+                break
+
+        for level, stage in enumerate(stages):
+            execute_on_stage(
+                format_query(
+                    cr,
+                    """
+                    UPDATE {table} r
+                       SET parent_path = s.parent_path
+                      FROM {stage} s
+                     WHERE s.id = r.id
+                       AND r.parent_path IS DISTINCT FROM s.parent_path
+                    """,
+                    stage=stage,
+                    table=table,
+                ),
+                stage,
+                qualifier="level {} paths".format(level),
+            )
+    finally:
+        _drop_tables(cr, stages)
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# ruff: noqa: PLC0415
+"""
+Benchmark the hot paths of `util` on synthetic data.
+
+For each repetition, a scratch database is cloned from a template database where `base` is
+installed, filled with synthetic data at the requested scale, and the benchmarked functions
+are timed on it. The fastest run of each benchmark is kept. The results are written as JSON,
+and compared to a baseline when given. The exit code is `1` if a benchmark is slower than its
+baseline duration multiplied by its threshold.
+
+Usage:
+
+    tools/benchmark-util.py --odoo-path ~/src/odoo --template base17 --scale 100k \
+        --baseline bench-17.json [--update-baseline] [-- <odoo options>]
+
+The baseline file maps each scale to the duration and threshold of each benchmark:
+
+    {"100000": {"explode_execute": {"duration": 1.52, "threshold": 1.25}, ...}}
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+logging.basicConfig(
+    level=logging.INFO, stream=sys.stderr, format="%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+)
+logger = logging.getLogger(__name__)
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+SCALES = {"1k": 1_000, "100k": 100_000, "10M": 10_000_000}
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Register a benchmark: a function preparing its data and returning the callable to time."""
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+def translatable(util, cr, table, column, expr):
+    return f"jsonb_build_object('en_US', {expr})" if util.column_type(cr, table, column) == "jsonb" else expr
+
+
+def create_partners(util, cr, n, tag):
+    name = translatable(util, cr, "res_partner", "name", "'Bench ' || i")
+    cr.execute(
+        f"""
+        INSERT INTO res_partner(name, ref, active, type, is_company, create_date, write_date)
+             SELECT {name}, %s, true, 'contact', i % 10 = 0, now() at time zone 'utc', now() at time zone 'utc'
+               FROM generate_series(1, %s) i
+          RETURNING id
+        """,
+        [tag, n],
+    )
+    return [id_ for (id_,) in cr.fetchall()]
+
+
+def create_categories(util, cr, n, tag, partner_ids=()):
+    # categories form a tree of arity 10, and each partner gets two of them
+    name = translatable(util, cr, "res_partner_category", "name", f"'{tag} ' || i")
+    cr.execute(
+        f"""
+        INSERT INTO res_partner_category(name, active)
+             SELECT {name}, true
+               FROM generate_series(1, %s) i
+          RETURNING id
+        """,
+        [n],
+    )
+    ids = sorted(id_ for (id_,) in cr.fetchall())
+    cr.execute(
+        """
+        UPDATE res_partner_category c
+           SET parent_id = (%(ids)s::int[])[(o.n - 1) / 10]
+          FROM unnest(%(ids)s::int[]) WITH ORDINALITY o(id, n)
+         WHERE c.id = o.id
+           AND o.n > 10
+        """,
+        {"ids": ids},
+    )
+    if partner_ids:
+        cr.execute(
+            """
+            INSERT INTO res_partner_res_partner_category_rel(partner_id, category_id)
+                 SELECT DISTINCT p.id, (%(cids)s::int[])[1 + (p.id * k) % cardinality(%(cids)s::int[])]
+                   FROM unnest(%(pids)s::int[]) p(id), generate_series(1, 2) k
+            """,
+            {"pids": list(partner_ids), "cids": ids},
+        )
+    return ids
+
+
+def create_views(util, cr, n, field):
+    arch = f'<form><sheet><group><field name="{field}"/><field name="name"/></group></sheet></form>'
+    arch_expr = translatable(util, cr, "ir_ui_view", "arch_db", "%(arch)s")
+    cr.execute(
+        f"""
+        INSERT INTO ir_ui_view(name, model, type, arch_db, priority, mode, active)
+             SELECT 'bench.view.' || i, 'res.partner', 'form', {arch_expr}, 16, 'primary', true
+               FROM generate_series(1, %(n)s) i
+        """,
+        {"arch": arch, "n": n},
+    )
+
+
+def create_filters(cr, n, field):
+    cr.execute(
+        """
+        INSERT INTO ir_filters(name, model_id, domain, context, sort, active, is_default)
+             SELECT 'bench filter ' || i, 'res.partner',
+                    format('[("%%s", "=", "bench %%s"), ("name", "ilike", "bench")]', %s, i), '{}', '[]', true, false
+               FROM generate_series(1, %s) i
+        """,
+        [field, n],
+    )
+
+
+@benchmark
+def bench_explode_execute(util, cr, n):
+    cr.execute("CREATE TABLE _bench_move(id serial PRIMARY KEY, partner_id int4, amount numeric, name varchar)")
+    cr.execute(
+        "INSERT INTO _bench_move(partner_id, amount, name) SELECT i % 1000, i, 'MOVE/' || i FROM generate_series(1, %s) i",
+        [n],
+    )
+    return lambda: util.explode_execute(cr, "UPDATE _bench_move SET amount = amount * 2", table="_bench_move")
+
+
+def _html_converter(content):
+    return True, content.replace('class="bench"', 'class="bench converted"')
+
+
+@benchmark
+def bench_convert_html_columns(util, cr, n):
+    from odoo.upgrade.util import snippets
+
+    cr.execute("CREATE TABLE _bench_html(id serial PRIMARY KEY, body text)")
+    cr.execute(
+        """
+        INSERT INTO _bench_html(body)
+             SELECT '<div class="bench"><p>Row ' || i || '</p><img src="/web/image/' || i || '"/></div>'
+               FROM generate_series(1, %s) i
+        """,
+        [n],
+    )
+    return lambda: snippets.convert_html_columns(cr, "_bench_html", ["body"], _html_converter)
+
+
+@benchmark
+def bench_recompute_fields(util, cr, n):
+    ids = create_partners(util, cr, n, "bench-recompute")
+    return lambda: util.recompute_fields(cr, "res.partner", ["commercial_partner_id"], ids=ids)
+
+
+@benchmark
+def bench_replace_record_references_batch(util, cr, n):
+    ids = create_partners(util, cr, n, "bench-merge")
+    create_categories(util, cr, max(10, n // 100), "bench-merge", ids)
+    mapping = dict(zip(ids[::2], ids[1::2]))
+    return lambda: util.replace_record_references_batch(cr, mapping, "res.partner")
+
+
+@benchmark
+def bench_rename_field(util, cr, n):
+    env = util.env(cr)
+    env["ir.model.fields"].create(
+        {
+            "name": "x_bench",
+            "model_id": env["ir.model"]._get_id("res.partner"),
+            "ttype": "char",
+            "field_description": "Bench",
+            "state": "manual",
+        }
+    )
+    create_views(util, cr, max(10, n // 1000), "x_bench")
+    create_filters(cr, max(10, n // 100), "x_bench")
+    return lambda: util.rename_field(cr, "res.partner", "x_bench", "x_bench_renamed")
+
+
+@benchmark
+def bench_adapt_domains(util, cr, n):
+    create_filters(cr, max(10, n // 100), "function")
+    return lambda: util.adapt_domains(cr, "res.partner", "function", "job_title")
+
+
+@benchmark
+def bench_update_parent_path(util, cr, n):
+    create_categories(util, cr, n, "bench-tree")
+    return lambda: util.update_parent_path(cr, "res.partner.category")
+
+
+@benchmark
+def bench_remove_records(util, cr, n):
+    partner_ids = create_partners(util, cr, n, "bench-remove")
+    ids = create_categories(util, cr, max(10, n // 100), "bench-remove", partner_ids)
+    return lambda: util.remove_records(cr, "res.partner.category", ids)
+
+
+def run(options: Namespace, dbname: str):
+    # the benchmarked functions may commit: each run gets its own scratch database
+    from odoo.modules.registry import Registry
+
+    from odoo.upgrade import util
+
+    registry = Registry(dbname)
+    durations = {}
+    for name in options.benchmarks or BENCHMARKS:
+        with registry.cursor() as cr:
+            call = BENCHMARKS[name](util, cr, options.scale)
+            cr.commit()
+            start = time.perf_counter()
+            call()
+            durations[name] = time.perf_counter() - start
+            cr.commit()
+        logger.info("%s: %.3fs", name, durations[name])
+    return durations
+
+
+def compare(results: dict, baseline: dict, default_threshold: float, min_delta: float):
+    regressions = []
+    for name, result in results.items():
+        ref = baseline.get(name)
+        if not ref:
+            logger.warning("%s: no baseline", name)
+            continue
+        limit = ref["duration"] * ref.get("threshold", default_threshold)
+        result["baseline"] = ref["duration"]
+        result["ratio"] = round(result["duration"] / ref["duration"], 3) if ref["duration"] else None
+        if result["duration"] > limit and result["duration"] - ref["duration"] > min_delta:
+            regressions.append(name)
+            logger.error("%s: %.3fs > %.3fs (baseline %.3fs)", name, result["duration"], limit, ref["duration"])
+    return regressions
+
+
+def main(options: Namespace):
+    sys.path.insert(0, str(options.odoo_path))
+    import odoo
+    from odoo.modules.module import initialize_sys_path
+    from odoo.modules.registry import Registry
+
+    odoo.tools.config.parse_config(["--upgrade-path", str(SRC), *options.odoo_args])
+    initialize_sys_path()
+
+    runs = []
+    for _ in range(options.repeat):
+        dbname = f"{options.db_prefix}-{uuid.uuid4().hex[:8]}"
+        logger.info("Create scratch database %s from %s", dbname, options.template)
+        subprocess.run(["createdb", "-T", options.template, dbname], check=True)
+        try:
+            runs.append(run(options, dbname))
+        finally:
+            Registry.delete(dbname)
+            odoo.sql_db.close_db(dbname)
+            if options.keep_db:
+                logger.info("Scratch database %s kept", dbname)
+            else:
+                subprocess.run(["dropdb", "--if-exists", dbname], check=True)
+    results = {
+        name: {"duration": round(min(r[name] for r in runs), 3), "durations": [round(r[name], 3) for r in runs]}
+        for name in runs[0]
+    }
+
+    baselines = json.loads(options.baseline.read_text()) if options.baseline and options.baseline.exists() else {}
+    scale_key = str(options.scale)
+    regressions = compare(results, baselines.get(scale_key, {}), options.threshold, options.min_delta)
+
+    if options.update_baseline and options.baseline:
+        baseline = baselines.setdefault(scale_key, {})
+        for name, result in results.items():
+            baseline.setdefault(name, {})["duration"] = result["duration"]
+        options.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        logger.info("Baseline %s updated", options.baseline)
+        regressions = []
+
+    output = {"scale": options.scale, "results": results, "regressions": regressions}
+    if options.output:
+        options.output.write_text(json.dumps(output, indent=2, sort_keys=True) + "\n")
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 1 if regressions else 0
+
+
+def scale(value: str) -> int:
+    return SCALES[value] if value in SCALES else int(value)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the hot paths of `util` on synthetic data")
+
+    parser.add_argument("--odoo-path", dest="odoo_path", type=Path, default=os.getenv("ODOO_PATH", "."))
+    parser.add_argument(
+        "--template", "-t", required=True, help="database, with `base` installed, the scratch database is cloned from"
+    )
+    parser.add_argument("--db-prefix", dest="db_prefix", default="upg-bench")
+    parser.add_argument("--keep-db", dest="keep_db", action="store_true")
+    parser.add_argument("--scale", "-s", type=scale, default="1k", help="1k, 100k, 10M, or a number of rows")
+    parser.add_argument("--repeat", "-r", type=int, default=1, help="runs of each benchmark; the fastest is kept")
+    parser.add_argument(
+        "--benchmark", "-b", dest="benchmarks", action="append", choices=sorted(BENCHMARKS), metavar="NAME"
+    )
+    parser.add_argument("--baseline", type=Path, help="JSON file with the reference durations and thresholds")
+    parser.add_argument("--update-baseline", dest="update_baseline", action="store_true")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="default ratio to the baseline considered as a regression"
+    )
+    parser.add_argument(
+        "--min-delta", dest="min_delta", type=float, default=0.05, help="ignore slowdowns shorter than this (seconds)"
+    )
+    parser.add_argument("--output", "-o", type=Path, help="JSON file for the results, stdout by default")
+    parser.add_argument("odoo_args", nargs="*", help="extra Odoo options, after `--`")
+
+    sys.exit(main(parser.parse_args()))